@@ -45,6 +45,12 @@ db = None
 # stores ItemInfo objects so we can quickly fetch them
 item_info_cache = None
 
+# running totals of the items in each feed and folder
+feed_counts = None
+
+# search index for all items in the database
+search_index = None
+
 # command line arguments for thumbnailer (linux)
 movie_data_program_info = None
 
@@ -99,6 +99,8 @@ class Controller:
         app.db.finish_transaction()
         if app.item_info_cache is not None:
             app.item_info_cache.save()
+        if app.search_index is not None:
+            app.search_index.close()
         logging.info("Closing Database...")
         if app.db is not None:
             app.db.close()
@@ -33,6 +33,7 @@ import threading
 
 from miro import app
 from miro import signals
+from miro import viewpredicate
 
 class DatabaseException(Exception):
     """Superclass for classes that subclass Exception and are all
@@ -228,6 +229,10 @@ class ViewTrackerManager(object):
         self.table_to_tracker = {}
         # maps joined tables to trackers
         self.joined_table_to_tracker = {}
+        # maps table_name -> attribute name -> trackers that depend on it
+        self.attribute_to_tracker = {}
+        # maps table_name to trackers that we can't index by attribute
+        self.unindexed_trackers = {}
 
     def trackers_for_table(self, table_name):
         try:
@@ -239,15 +244,59 @@ class ViewTrackerManager(object):
     def trackers_for_ddb_class(self, klass):
         return self.trackers_for_table(app.db.table_name(klass))
 
-    def update_view_trackers(self, obj):
-        """Update view trackers based on an object change."""
-
-        for tracker in self.trackers_for_ddb_class(obj.__class__):
-            tracker.object_changed(obj)
+    def add_tracker(self, tracker):
+        table_name = tracker.table_name
+        self.trackers_for_table(table_name).add(tracker)
+        dependencies = tracker.dependencies()
+        if dependencies is None:
+            self.unindexed_trackers.setdefault(table_name, set()).add(tracker)
+        else:
+            attr_map = self.attribute_to_tracker.setdefault(table_name, {})
+            for attr in dependencies:
+                attr_map.setdefault(attr, set()).add(tracker)
+
+    def remove_tracker(self, tracker):
+        table_name = tracker.table_name
+        self.trackers_for_table(table_name).discard(tracker)
+        self.unindexed_trackers.get(table_name, set()).discard(tracker)
+        attr_map = self.attribute_to_tracker.get(table_name, {})
+        for trackers in attr_map.values():
+            trackers.discard(tracker)
+
+    def _trackers_to_check(self, table_name, changed_attributes):
+        """Get the trackers that could be affected by a set of attribute
+        changes.
+        """
+        to_check = set(self.unindexed_trackers.get(table_name, ()))
+        attr_map = self.attribute_to_tracker.get(table_name, {})
+        for attr in changed_attributes:
+            to_check.update(attr_map.get(attr, ()))
+        return to_check
+
+    def update_view_trackers(self, obj, changed_attributes=None):
+        """Update view trackers based on an object change.
+
+        :param changed_attributes: set of attributes that changed on obj,
+            or None to check every tracker.  Trackers whose where clause
+            doesn't depend on any of those attributes don't re-check if obj
+            is in their view, they just send the changed signal.
+        """
+        table_name = app.db.table_name(obj.__class__)
+        trackers = self.trackers_for_table(table_name)
+        if changed_attributes is None:
+            for tracker in trackers:
+                tracker.object_changed(obj)
+            return
+        to_check = self._trackers_to_check(table_name, changed_attributes)
+        for tracker in trackers:
+            tracker.object_changed(obj, check_view=(tracker in to_check))
 
-    def bulk_update_view_trackers(self, table_name):
+    def bulk_update_view_trackers(self, table_name, objects):
+        """Update view trackers after objects were inserted/changed in
+        bulk.
+        """
         for tracker in self.trackers_for_table(table_name):
-            tracker.check_all_objects()
+            tracker.check_objects(objects)
 
     def bulk_remove_from_view_trackers(self, table_name, objects):
         for tracker in self.trackers_for_table(table_name):
@@ -270,14 +319,21 @@ class ViewTracker(signals.SignalEmitter):
             raise TypeError("values must be a tuple")
         self.values = values
         self.joins = joins
+        self.predicate = viewpredicate.ViewPredicate(self.table_name,
+                where, values, joins)
         self.bulk_mode = False
         self.current_ids = self._view_object_ids()
-        vt_manager = app.view_tracker_manager
-        vt_manager.trackers_for_table(self.table_name).add(self)
+        app.view_tracker_manager.add_tracker(self)
 
     def unlink(self):
-        vt_manager = app.view_tracker_manager
-        vt_manager.trackers_for_table(self.table_name).discard(self)
+        app.view_tracker_manager.remove_tracker(self)
+
+    def dependencies(self):
+        """Get the attributes that our view depends on.
+
+        :returns: frozenset of attribute names, or None if we can't tell
+        """
+        return self.predicate.dependencies()
 
     def set_bulk_mode(self, bulk_mode):
         """Set/Unset bulk mode.
@@ -289,13 +345,30 @@ class ViewTracker(signals.SignalEmitter):
         self.bulk_mode = bulk_mode
 
     def _obj_in_view(self, obj):
-        """Check if a single object is in our view."""
-        where = '%s.id = ?' % (self.table_name,)
-        if self.where:
-            where += ' AND (%s)' % (self.where,)
+        """Check if a single object is in our view.
 
-        values = (obj.id,) + self.values
-        return app.db.query_count(self.table_name, where, values,
+        We try to do this in python using our compiled predicate and only
+        query the database for the parts of the where clause that it can't
+        handle.
+        """
+        try:
+            if not self.predicate.matches(obj):
+                return False
+        except viewpredicate.CantEvaluate:
+            return self._sql_obj_in_view(obj, self.where, self.values)
+        if self.predicate.is_fully_compiled():
+            return True
+        return self._sql_obj_in_view(obj, self.predicate.residual_where,
+                self.predicate.residual_values)
+
+    def _sql_obj_in_view(self, obj, where, values):
+        """Check if a single object is in our view using a SQL query."""
+        sql_where = '%s.id = ?' % (self.table_name,)
+        if where:
+            sql_where += ' AND (%s)' % (where,)
+
+        sql_values = (obj.id,) + values
+        return app.db.query_count(self.table_name, sql_where, sql_values,
                 self.joins) > 0
 
     def _view_object_ids(self):
@@ -303,8 +376,11 @@ class ViewTracker(signals.SignalEmitter):
         return set(app.db.query_ids(self.table_name,
                                     self.where, self.values, joins=self.joins))
 
-    def object_changed(self, obj):
-        self.check_object(obj)
+    def object_changed(self, obj, check_view=True):
+        if check_view:
+            self.check_object(obj)
+        elif obj.id in self.current_ids:
+            self.emit('changed', self.fetcher.fetch_obj_for_ddb_object(obj))
 
     def remove_object(self, obj):
         if obj.id in self.current_ids:
@@ -312,9 +388,12 @@ class ViewTracker(signals.SignalEmitter):
             self.emit('removed', self.fetcher.fetch_obj_for_ddb_object(obj))
 
     def remove_objects(self, objects):
+        removed = []
         for obj in [o for o in objects if o.id in self.current_ids]:
             self.current_ids.remove(obj.id)
-            self.emit('removed', self.fetcher.fetch_obj_for_ddb_object(obj))
+            removed.append(self.fetcher.fetch_obj_for_ddb_object(obj))
+        if removed:
+            self._emit_for_objects('removed', removed)
 
     def check_object(self, obj):
         before = (obj.id in self.current_ids)
@@ -328,6 +407,39 @@ class ViewTracker(signals.SignalEmitter):
         elif before and now:
             self.emit('changed', self.fetcher.fetch_obj_for_ddb_object(obj))
 
+    def check_objects(self, objects):
+        """Check a list of objects that changed in bulk.
+
+        Unlike check_all_objects(), this only queries the ids of objects and
+        only sends signals for them.  In bulk mode, we send at most one
+        bulk-added, bulk-removed and bulk-changed signal.
+        """
+        if not objects:
+            return
+        in_view = set(app.db.query_ids_in(self.table_name,
+            [obj.id for obj in objects], self.where, self.values,
+            self.joins))
+        added = []
+        removed = []
+        changed = []
+        for obj in objects:
+            before = (obj.id in self.current_ids)
+            now = (obj.id in in_view)
+            if before and not now:
+                self.current_ids.remove(obj.id)
+                removed.append(self.fetcher.fetch_obj_for_ddb_object(obj))
+            elif now and not before:
+                self.current_ids.add(obj.id)
+                added.append(self.fetcher.fetch_obj_for_ddb_object(obj))
+            elif before and now:
+                changed.append(self.fetcher.fetch_obj_for_ddb_object(obj))
+        if added:
+            self._emit_for_objects('added', added)
+        if removed:
+            self._emit_for_objects('removed', removed)
+        if changed:
+            self._emit_for_objects('changed', changed)
+
     def _emit_for_objects(self, signal, objects):
         if self.bulk_mode:
             self.emit('bulk-' + signal, objects)
@@ -434,13 +546,11 @@ class BulkSQLManager(object):
                 obj.removed_from_db()
 
     def _update_view_trackers(self, to_insert, to_remove):
-        for table_name in to_insert:
-            app.view_tracker_manager.bulk_update_view_trackers(table_name)
+        for table_name, objects in to_insert.items():
+            app.view_tracker_manager.bulk_update_view_trackers(table_name,
+                    objects)
 
         for table_name, objects in to_remove.items():
-            if table_name in to_insert:
-                # already updated the view above
-                continue
             app.view_tracker_manager.bulk_remove_from_view_trackers(
                 table_name, objects)
 
@@ -488,6 +598,13 @@ class AttributeUpdateTracker(object):
         try:
             return instance.__dict__[self.name]
         except KeyError:
+            # maybe this is a lazy column that we haven't loaded yet (see
+            # LiveStorage._restore_objects())
+            loader = instance.__dict__.get('_lazy_column_loader')
+            if loader is not None:
+                loader.load([instance])
+                if self.name in instance.__dict__:
+                    return instance.__dict__[self.name]
             raise AttributeError(self.name)
         except AttributeError:
             if instance is None:
@@ -579,8 +696,10 @@ class DDBObject(signals.SignalEmitter):
         return app.db.delete(cls, where, values)
 
     @classmethod
-    def select(cls, columns, where=None, values=None, convert=True):
-        return app.db.select(cls, columns, where, values, convert=convert)
+    def select(cls, columns, where=None, values=None, convert=True,
+            reporting=False):
+        return app.db.select(cls, columns, where, values, convert=convert,
+                reporting=reporting)
 
     def setup_new(self):
         """Initialize a newly created object."""
@@ -687,9 +806,12 @@ class DDBObject(signals.SignalEmitter):
             # view trackers in this case.  Both will be done when the
             # BulkSQLManager.finish() is called.
             return
+        # update_obj() resets changed_attributes, so grab them first.
+        changed_attributes = self.changed_attributes
         if needs_save:
             app.db.update_obj(self)
-        app.view_tracker_manager.update_view_trackers(self)
+        app.view_tracker_manager.update_view_trackers(self,
+                changed_attributes)
 
     def on_signal_change(self):
         pass
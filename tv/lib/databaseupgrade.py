@@ -3312,3 +3312,29 @@ def upgrade160(cursor):
     cursor.execute("ALTER TABLE global_state ADD COLUMN tabs_width integer")
     cursor.execute("UPDATE global_state SET tabs_width=200")
 
+def upgrade161(cursor):
+    """Create the search index tables"""
+    cursor.execute("CREATE TABLE search_index_posting"
+            "(ngram TEXT PRIMARY KEY, item_ids BLOB)")
+    cursor.execute("CREATE TABLE search_index_item"
+            "(id INTEGER PRIMARY KEY, ngrams TEXT)")
+
+def upgrade162(cursor):
+    """Add content_hash columns to the RSS feed impl tables."""
+    cursor.execute("ALTER TABLE rss_feed_impl ADD COLUMN content_hash text")
+    for table in ('saved_search_feed_impl', 'search_feed_impl'):
+        cursor.execute("ALTER TABLE %s ADD COLUMN content_hash pythonrepr" %
+                table)
+        cursor.execute("UPDATE %s SET content_hash='{}'" % table)
+
+def upgrade163(cursor):
+    """Add columns to remember how feed updates went."""
+    for table in ('feed_impl', 'rss_feed_impl', 'saved_search_feed_impl',
+            'scraper_feed_impl', 'search_feed_impl',
+            'directory_watch_feed_impl', 'directory_feed_impl',
+            'search_downloads_feed_impl', 'manual_feed_impl'):
+        cursor.execute("ALTER TABLE %s ADD COLUMN last_update_finished "
+                "timestamp" % table)
+        cursor.execute("ALTER TABLE %s ADD COLUMN unchanged_rate real" %
+                table)
+        cursor.execute("UPDATE %s SET unchanged_rate=0.0" % table)
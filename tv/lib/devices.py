@@ -580,7 +580,9 @@ class DeviceSyncManager(object):
         eventloop.call_in_thread(lambda x: self._copy_file_callback(x),
                                  lambda x: None,
                                  self._copy_in_thread,
-                                 self, info, final_path)
+                                 'copy file to device',
+                                 info, final_path,
+                                 lane=eventloop.LANE_IO)
 
     def _copy_in_thread(self, info, final_path):
         if self.stopping:
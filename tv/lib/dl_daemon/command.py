@@ -56,7 +56,7 @@ class Command(object):
         if self.daemon.shutdown:
             return
         eventloop.add_idle(lambda : self.daemon.send(self, callback),
-                           "sending command %r" % self)
+                           "sending command (%r)" % self)
 
     def action(self):
         # for overriding
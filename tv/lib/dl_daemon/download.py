@@ -30,7 +30,7 @@
 import os
 import stat
 import time
-from threading import RLock
+from threading import Lock, RLock
 from copy import copy
 import sys
 import datetime
@@ -231,6 +231,22 @@ class TorrentSession(object):
         self.dht_on = None
         self.pe_set = None
         self.enc_req = None
+        # If libtorrent can post state updates, we get the status for
+        # torrents that changed from alerts, rather than polling every
+        # torrent.  We also use save_resume_data alerts to get fast resume
+        # data.  Set in startup().
+        self.use_alerts = False
+        # maps info hashes to (generation, fast resume data) tuples waiting
+        # to be written to disk
+        self._pending_resume_data = {}
+        # maps info hashes to the generation of their latest fast resume
+        # data.  We only write data if it's still the latest.
+        self._resume_data_generation = {}
+        self._resume_data_lock = Lock()
+        # held while writing fast resume files, so that checking the
+        # generation and writing happen together
+        self._resume_file_lock = Lock()
+        self._resume_data_writer_running = False
 
     def startup(self):
         version = app.config.get(prefs.APP_VERSION).split(".")
@@ -248,6 +264,12 @@ class TorrentSession(object):
         # MR is for Miro.
         fingerprint = lt.fingerprint("MR", major, minor, 0, 0)
         self.session = lt.session(fingerprint)
+        self.use_alerts = hasattr(self.session, 'post_torrent_updates')
+        if self.use_alerts:
+            self.session.set_alert_mask(
+                lt.alert.category_t.error_notification |
+                lt.alert.category_t.status_notification |
+                lt.alert.category_t.storage_notification)
         self.listen()
         self.set_upnp()
         self.set_dht()
@@ -333,6 +355,8 @@ class TorrentSession(object):
         self.session.stop_upnp()
         self.session.stop_dht()
         app.downloader_config_watcher.disconnect(self.callback_handle)
+        # don't lose fast resume data that's still waiting to be written
+        self._write_resume_data()
 
     def on_config_changed(self, obj, key, value):
         if key == prefs.BT_MIN_PORT.key:
@@ -390,11 +414,141 @@ class TorrentSession(object):
             del self.info_hash_to_downloader[info_hash]
 
     def update_torrents(self):
+        if self.use_alerts:
+            self._handle_alerts()
+            # ask for the next batch of status updates.  They come back as a
+            # state_update_alert that we handle the next time through.
+            self.session.post_torrent_updates()
+            return
         # Copy this set into a list in case any of the torrents gets
         # removed during the iteration.
         for torrent in [x for x in self.torrents]:
             torrent.update_status()
 
+    def _pop_alerts(self):
+        if hasattr(self.session, 'pop_alerts'):
+            return self.session.pop_alerts()
+        # older libtorrent versions only give us one at a time
+        alerts = []
+        alert = self.session.pop_alert()
+        while alert is not None:
+            alerts.append(alert)
+            alert = self.session.pop_alert()
+        return alerts
+
+    def _downloader_for_handle(self, handle):
+        try:
+            info_hash = info_hash_to_long(handle.info_hash())
+        except StandardError:
+            # the torrent was removed from the session
+            return None
+        return self.info_hash_to_downloader.get(info_hash)
+
+    def _handle_alerts(self):
+        for alert in self._pop_alerts():
+            if isinstance(alert, lt.state_update_alert):
+                # only contains torrents whose status changed since the
+                # last post_torrent_updates() call
+                for status in alert.status:
+                    downloader = self._downloader_for_handle(status.handle)
+                    if downloader is not None:
+                        downloader.update_status(status)
+            elif isinstance(alert, lt.save_resume_data_alert):
+                downloader = self._downloader_for_handle(alert.handle)
+                if downloader is not None:
+                    self.queue_resume_data(downloader.info_hash,
+                                           alert.resume_data)
+            elif isinstance(alert, lt.save_resume_data_failed_alert):
+                logging.debug("save_resume_data failed: %s", alert.message())
+
+    def queue_resume_data(self, info_hash, resume_data):
+        """Save fast resume data to disk in a background thread.
+
+        If there's already data waiting to be written for info_hash, it gets
+        replaced, so we only write the latest data.
+
+        :param info_hash: the info hash for the torrent
+        :param resume_data: the (not bencoded) fast resume data
+        """
+        self._resume_data_lock.acquire()
+        try:
+            generation = self._next_resume_data_generation(info_hash)
+            self._pending_resume_data[info_hash] = (generation, resume_data)
+            if self._resume_data_writer_running:
+                return
+            self._resume_data_writer_running = True
+        finally:
+            self._resume_data_lock.release()
+        self._start_resume_data_writer()
+
+    def _next_resume_data_generation(self, info_hash):
+        # Note: _resume_data_lock must be held when this is called.
+        generation = self._resume_data_generation.get(info_hash, 0) + 1
+        self._resume_data_generation[info_hash] = generation
+        return generation
+
+    def _start_resume_data_writer(self):
+        eventloop.call_in_thread(lambda result: None,
+                                 self._on_resume_data_writer_error,
+                                 self._write_resume_data,
+                                 'Write fast resume data',
+                                 lane=eventloop.LANE_IO)
+
+    def _write_resume_data(self):
+        """Write out all the pending fast resume data."""
+        while True:
+            self._resume_data_lock.acquire()
+            try:
+                if not self._pending_resume_data:
+                    self._resume_data_writer_running = False
+                    return
+                info_hash, (generation, resume_data) = (
+                    self._pending_resume_data.popitem())
+            finally:
+                self._resume_data_lock.release()
+            fast_resume_data = lt.bencode(resume_data)
+            self._resume_file_lock.acquire()
+            try:
+                # if newer data came in while we were encoding, don't
+                # overwrite it
+                if self._resume_data_generation.get(info_hash) == generation:
+                    save_fast_resume_data(info_hash, fast_resume_data)
+            finally:
+                self._resume_file_lock.release()
+
+    def _on_resume_data_writer_error(self, error):
+        logging.warning("Error writing fast resume data: %s", error)
+        # the data that caused the error was already popped, so keep going
+        # with the rest.
+        self._resume_data_lock.acquire()
+        try:
+            restart = bool(self._pending_resume_data)
+            self._resume_data_writer_running = restart
+        finally:
+            self._resume_data_lock.release()
+        if restart:
+            self._start_resume_data_writer()
+
+    def save_resume_data_now(self, info_hash, fast_resume_data):
+        """Save fast resume data to disk right away.
+
+        Any data for info_hash that's waiting to be written gets dropped.
+
+        :param info_hash: the info hash for the torrent
+        :param fast_resume_data: the bencoded fast resume data
+        """
+        self._resume_data_lock.acquire()
+        try:
+            self._pending_resume_data.pop(info_hash, None)
+            self._next_resume_data_generation(info_hash)
+        finally:
+            self._resume_data_lock.release()
+        self._resume_file_lock.acquire()
+        try:
+            save_fast_resume_data(info_hash, fast_resume_data)
+        finally:
+            self._resume_file_lock.release()
+
 TORRENT_SESSION = TorrentSession()
 
 class DownloadStatusUpdater(object):
@@ -1207,8 +1361,12 @@ class BTDownloader(BGDownloader):
                       self.leechers,
                       self.currentSize)
 
-    def update_status(self):
-        """
+    def update_status(self, status=None):
+        """Update our status from the torrent's status.
+
+        :param status: torrent_status from a state_update_alert.  If None, we
+            ask the torrent for it.
+
         activity -- string specifying what's currently happening or None for
                 normal operations.
         upRate -- upload rate in B/s
@@ -1222,7 +1380,8 @@ class BTDownloader(BGDownloader):
         leechers -- number of leechers for this torrent
         connecting -- nummber of peers we're connected to
         """
-        status = self.torrent.status()
+        if status is None:
+            status = self.torrent.status()
         self.totalSize = status.total_wanted
         self.rate = status.download_payload_rate
         self.upRate = status.upload_payload_rate
@@ -1294,10 +1453,21 @@ class BTDownloader(BGDownloader):
             return
         self._last_frd_update = time_now
 
+        if not force and TORRENT_SESSION.use_alerts:
+            # libtorrent sends a save_resume_data_alert with the data, which
+            # TorrentSession writes to disk in a background thread.  When
+            # we're forced, we're about to remove the torrent, so we can't
+            # wait for that.
+            if ((not hasattr(self.torrent, 'need_save_resume_data') or
+                 self.torrent.need_save_resume_data())):
+                self.torrent.save_resume_data()
+            return
+
         try:
-            # FIXME - we should switch to save_resume_data which uses
-            # an alert to save resume data rather than
-            # write_resume_data which looks deprecated in 0.15.5.
+            if not force:
+                TORRENT_SESSION.queue_resume_data(self.info_hash,
+                        self.torrent.write_resume_data())
+                return
             self.fast_resume_data = lt.bencode(
                 self.torrent.write_resume_data())
         except RuntimeError, rte:
@@ -1310,7 +1480,8 @@ class BTDownloader(BGDownloader):
                 "RuntimeError kicked up in update_fast_resume_data: %s", rte)
             return
 
-        save_fast_resume_data(self.info_hash, self.fast_resume_data)
+        TORRENT_SESSION.save_resume_data_now(self.info_hash,
+                self.fast_resume_data)
 
     def handle_error(self, short_reason, reason):
         self._shutdown_torrent()
@@ -37,9 +37,12 @@ TODO: handle user setting clock back
 
 import threading
 import errno
+import math
 import select
+import sys
 import socket
 import heapq
+import itertools
 import Queue
 import logging
 import traceback
@@ -55,13 +58,162 @@ from miro.plat.utils import thread_body
 
 cumulative = {}
 
+# Priorities for idle calls.  Lower values run first.  Calls with the same
+# priority run in the order they were added.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 50
+PRIORITY_LOW = 100
+
+# Max time to spend running idle calls before we go back and check for
+# network activity and timeouts.
+IDLE_TIME_BUDGET = 0.1
+
+class CallStats(object):
+    """Tracks latency/duration histograms for DelayedCalls.
+
+    Latency is the time between when a call was ready to run and when it
+    actually ran.  Duration is how long the call took.  Both are tracked
+    per kind of call, which lets us see which callbacks are starving the
+    others.
+
+    Call names often include details about the object they work on, like
+    "Feed update (My Podcast)".  We record those under the name without
+    the details (see _call_stats_key()), so each kind of call gets 1 entry.
+    """
+    # upper bounds for the histogram buckets.  There's an extra bucket for
+    # everything above the last one.
+    BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0)
+    # max number of names to track.  After this, calls get lumped together
+    MAX_NAMES = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.stats = {}
+        finally:
+            self.lock.release()
+
+    def _make_entry(self):
+        return {
+            'count': 0,
+            'total_duration': 0.0,
+            'max_duration': 0.0,
+            'max_latency': 0.0,
+            'duration': [0] * (len(self.BUCKETS) + 1),
+            'latency': [0] * (len(self.BUCKETS) + 1),
+        }
+
+    def _bucket_index(self, value):
+        for i, limit in enumerate(self.BUCKETS):
+            if value < limit:
+                return i
+        return len(self.BUCKETS)
+
+    def record(self, name, latency, duration):
+        name = _call_stats_key(name)
+        self.lock.acquire()
+        try:
+            try:
+                entry = self.stats[name]
+            except KeyError:
+                if len(self.stats) >= self.MAX_NAMES:
+                    name = 'other'
+                entry = self.stats.setdefault(name, self._make_entry())
+            entry['count'] += 1
+            entry['total_duration'] += duration
+            entry['max_duration'] = max(entry['max_duration'], duration)
+            entry['max_latency'] = max(entry['max_latency'], latency)
+            entry['duration'][self._bucket_index(duration)] += 1
+            entry['latency'][self._bucket_index(latency)] += 1
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        """Get a copy of our stats.
+
+        :returns: dict mapping call names to dicts with the keys count,
+            total_duration, max_duration, max_latency, duration and latency.
+            duration and latency are lists of counts for each bucket in
+            BUCKETS.
+        """
+        self.lock.acquire()
+        try:
+            rv = {}
+            for name, entry in self.stats.iteritems():
+                entry = entry.copy()
+                entry['duration'] = list(entry['duration'])
+                entry['latency'] = list(entry['latency'])
+                rv[name] = entry
+            return rv
+        finally:
+            self.lock.release()
+
+    def format_stats(self):
+        """Format our stats as a table, slowest calls first."""
+        headers = ['<%gs' % limit for limit in self.BUCKETS]
+        headers.append('>=%gs' % self.BUCKETS[-1])
+        lines = ['%-8s %-10s %-8s %-8s %-35s %-35s %s' % ('count', 'total',
+            'max', 'maxwait', 'duration (%s)' % ' '.join(headers),
+            'latency', 'name')]
+        stats = self.get_stats().items()
+        stats.sort(key=lambda (name, entry): entry['total_duration'],
+                reverse=True)
+        for name, entry in stats:
+            lines.append('%-8d %-10.3f %-8.3f %-8.3f %-35s %-35s %s' % (
+                entry['count'], entry['total_duration'],
+                entry['max_duration'], entry['max_latency'],
+                ' '.join(str(c) for c in entry['duration']),
+                ' '.join(str(c) for c in entry['latency']),
+                name))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """Write out our stats to a file."""
+        f = open(path, 'w')
+        try:
+            f.write(self.format_stats())
+            f.write('\n')
+        finally:
+            f.close()
+
+# prefixes that we add to call names.  _call_stats_key() keeps these, but
+# strips the details from the name inside them.
+_CALL_NAME_WRAPPERS = ('timeout (', 'idle (', 'Thread Pool Callback (',
+        'Thread Pool Errback (')
+
+def _call_stats_key(name):
+    """Get the name that CallStats records a call under.
+
+    Details about the object that a call works on go in parentheses at the
+    end of its name, for example "Feed update (My Podcast)".  We drop them,
+    so that "timeout (Feed update (My Podcast))" becomes
+    "timeout (Feed update)".
+    """
+    for prefix in _CALL_NAME_WRAPPERS:
+        if name.startswith(prefix) and name.endswith(')'):
+            return '%s%s)' % (prefix,
+                    _call_stats_key(name[len(prefix):-1]))
+    details_start = name.find(' (')
+    if details_start > 0:
+        return name[:details_start]
+    return name
+
+call_stats = CallStats()
+
 class DelayedCall(object):
-    def __init__(self, function, name, args, kwargs):
+    def __init__(self, function, name, args, kwargs, ready_time=None):
         self.function = function
         self.name = name
         self.args = args
         self.kwargs = kwargs
         self.canceled = False
+        if ready_time is None:
+            ready_time = clock()
+        self.ready_time = ready_time
 
     def _unlink(self):
         """Removes the references that this object has to the outside
@@ -82,6 +234,8 @@ class DelayedCall(object):
             success = trapcall.trap_call(when, self.function, *self.args,
                     **self.kwargs)
             end = clock()
+            call_stats.record(self.name, max(0, start - self.ready_time),
+                    end - start)
             if end-start > 0.5:
                 logging.timing("%s too slow (%.3f secs)",
                                self.name, end-start)
@@ -108,7 +262,8 @@ class Scheduler(object):
         if kwargs is None:
             kwargs = {}
         scheduled_time = clock() + delay
-        dc = DelayedCall(function,  "timeout (%s)" % (name,), args, kwargs)
+        dc = DelayedCall(function,  "timeout (%s)" % (name,), args, kwargs,
+                ready_time=scheduled_time)
         heapq.heappush(self.heap, (scheduled_time, dc))
         return dc
 
@@ -126,18 +281,31 @@ class Scheduler(object):
         return dc.dispatch()
 
 class CallQueue(object):
+    """Queue of DelayedCalls.
+
+    Calls are ordered by their priority, then by the order they were added.
+    This class is thread-safe.
+    """
     def __init__(self):
-        self.queue = Queue.Queue()
+        self.heap = []
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
         self.quit_flag = False
         self.queue_size_warning_count = 0
 
-    def add_idle(self, function, name, args=None, kwargs=None):
+    def add_idle(self, function, name, args=None, kwargs=None,
+            priority=PRIORITY_NORMAL):
         if args is None:
             args = ()
         if kwargs is None:
             kwargs = {}
         dc = DelayedCall(function, "idle (%s)" % (name,), args, kwargs)
-        self.queue.put(dc)
+        self.lock.acquire()
+        try:
+            heapq.heappush(self.heap, (priority, self.counter.next(), dc))
+            queue_size = len(self.heap)
+        finally:
+            self.lock.release()
 
         # Check if our queue size is too big and log a warning if so.  Only do
         # this a few times.  That should be enough to track down errors, but
@@ -146,7 +314,7 @@ class CallQueue(object):
         # NOTE: the code below doesn't take into account that this method
         # runs on multiple threads.  However, the worst that can happen is
         # we log an extra warning or two, so this doesn't seem bad.
-        if self.queue_size_warning_count < 5 and self.queue.qsize() > 1000:
+        if self.queue_size_warning_count < 5 and queue_size > 1000:
             if self.queue_size_warning_count < 5:
                 logging.stacktrace("Queued called size too large")
                 self.queue_size_warning_count += 1
@@ -154,11 +322,15 @@ class CallQueue(object):
         return dc
 
     def process_next_idle(self):
-        dc = self.queue.get()
+        self.lock.acquire()
+        try:
+            priority, count, dc = heapq.heappop(self.heap)
+        finally:
+            self.lock.release()
         return dc.dispatch()
 
     def has_pending_idle(self):
-        return not self.queue.empty()
+        return len(self.heap) > 0
 
     def process_idles(self):
         # Note: used for testing purposes
@@ -166,35 +338,142 @@ class CallQueue(object):
             self.process_next_idle()
 
 
+# Thread pool lanes.  Each lane has its own queue and threads, so slow calls
+# in one lane can't hold up calls in the other.
+LANE_DEFAULT = 'default'    # quick calls that something is waiting on
+LANE_IO = 'io'              # slow, I/O heavy calls, like copying files
+
+class _ThreadLane(object):
+    """Queue and threads for a single ThreadPool lane."""
+    def __init__(self, name, min_threads, max_threads):
+        self.name = name
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.thread_counter = itertools.count()
+        self.idle_threads = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def get_stats(self):
+        if self.completed:
+            average_wait = self.total_wait / self.completed
+        else:
+            average_wait = 0.0
+        return {
+            'threads': len(self.threads),
+            'idle_threads': self.idle_threads,
+            'queued': self.queue.qsize(),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'average_wait': average_wait,
+            'max_wait': self.max_wait,
+        }
+
 class ThreadPool(object):
     """The thread pool is used to handle calls like gethostbyname()
     that block and there's no asynchronous workaround.  What we do
     instead is call them in a separate thread and return the result in
     a callback that executes in the event loop.
+
+    Calls are divided into lanes (see LANES).  Each lane starts with
+    min_threads threads and adds threads as calls queue up, up to
+    max_threads.  Threads that sit idle for IDLE_THREAD_TIMEOUT seconds exit
+    until we're back down to min_threads.
     """
-    THREADS = 3
+    # maps lane name -> (min_threads, max_threads)
+    LANES = {
+        LANE_DEFAULT: (2, 6),
+        LANE_IO: (0, 4),
+    }
+    IDLE_THREAD_TIMEOUT = 30
 
     def __init__(self, event_loop):
         self.event_loop = event_loop
-        self.queue = Queue.Queue()
-        self.threads = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.lanes = {}
+        for name, (min_threads, max_threads) in self.LANES.items():
+            self.lanes[name] = _ThreadLane(name, min_threads, max_threads)
 
     def init_threads(self):
-        while len(self.threads) < ThreadPool.THREADS:
-            t = threading.Thread(name='ThreadPool - %d' % len(self.threads),
-                                 target=thread_body,
-                                 args=[self.thread_loop])
-            t.setDaemon(True)
-            t.start()
-            self.threads.append(t)
-
-    def thread_loop(self):
+        self.lock.acquire()
+        try:
+            self.running = True
+            for lane in self.lanes.values():
+                while len(lane.threads) < lane.min_threads:
+                    self._start_thread(lane)
+                # start threads for any calls queued before we started
+                self._maybe_add_thread(lane)
+        finally:
+            self.lock.release()
+
+    def _start_thread(self, lane):
+        # Note: must be called with the lock held
+        name = 'ThreadPool (%s) - %d' % (lane.name, lane.thread_counter.next())
+        t = threading.Thread(name=name, target=thread_body,
+                             args=[self.thread_loop, lane])
+        t.setDaemon(True)
+        lane.threads.append(t)
+        t.start()
+
+    def _maybe_add_thread(self, lane):
+        # Note: must be called with the lock held
+        if (self.running and lane.queue.qsize() > lane.idle_threads and
+                len(lane.threads) < lane.max_threads):
+            self._start_thread(lane)
+
+    def _get_next_item(self, lane):
+        """Get the next item for a thread to work on.
+
+        :returns: the next item or None if the thread should exit
+        """
+        current = threading.currentThread()
         while True:
-            next_item = self.queue.get()
-            if next_item == "QUIT":
-                break
+            self.lock.acquire()
+            lane.idle_threads += 1
+            # Only use a timeout if we have extra threads.  Waiting with a
+            # timeout means polling, which we don't want to do forever.
+            if len(lane.threads) > lane.min_threads:
+                timeout = self.IDLE_THREAD_TIMEOUT
             else:
-                callback, errback, func, name, args, kwargs, = next_item
+                timeout = None
+            self.lock.release()
+            try:
+                next_item = lane.queue.get(timeout=timeout)
+            except Queue.Empty:
+                next_item = None
+            self.lock.acquire()
+            try:
+                lane.idle_threads -= 1
+                if next_item == "QUIT":
+                    if not self.running or current not in lane.threads:
+                        return None
+                    # left over from a previous close_threads() call
+                elif next_item is not None:
+                    lane.in_flight += 1
+                    return next_item
+                elif current not in lane.threads:
+                    # close_threads() was called while we were waiting
+                    return None
+                elif (lane.queue.empty() and
+                        len(lane.threads) > lane.min_threads):
+                    # we've been idle for a while, shrink the pool
+                    lane.threads.remove(current)
+                    return None
+            finally:
+                self.lock.release()
+
+    def thread_loop(self, lane):
+        while True:
+            next_item = self._get_next_item(lane)
+            if next_item is None:
+                break
+            callback, errback, func, name, args, kwargs, queued_at = next_item
+            self._record_wait(lane, name, clock() - queued_at)
             try:
                 result = func(*args, **kwargs)
             except KeyboardInterrupt:
@@ -210,16 +489,72 @@ class ThreadPool(object):
                 func = callback
                 name = 'Thread Pool Callback (%s)' % name
                 args = (result,)
+            self.lock.acquire()
+            lane.in_flight -= 1
+            lane.completed += 1
+            self.lock.release()
             if not self.event_loop.quit_flag:
                 self.event_loop.idle_queue.add_idle(func, name, args=args)
                 self.event_loop.wakeup()
 
+    def _record_wait(self, lane, name, wait):
+        self.lock.acquire()
+        try:
+            lane.total_wait += wait
+            lane.max_wait = max(lane.max_wait, wait)
+        finally:
+            self.lock.release()
+        if wait > 1.0:
+            logging.timing("%s waited %.3f secs for a thread (lane: %s)",
+                           name, wait, lane.name)
+
     def queue_call(self, callback, errback, function, name, *args, **kwargs):
-        self.queue.put((callback, errback, function, name, args, kwargs))
+        lane_name = kwargs.pop('lane', LANE_DEFAULT)
+        try:
+            lane = self.lanes[lane_name]
+        except KeyError:
+            raise ValueError("Unknown thread pool lane: %s" % lane_name)
+        lane.queue.put((callback, errback, function, name, args, kwargs,
+            clock()))
+        self.lock.acquire()
+        try:
+            self._maybe_add_thread(lane)
+        finally:
+            self.lock.release()
+
+    def has_pending_calls(self):
+        """Check if there are calls queued or in progress."""
+        for lane in self.lanes.values():
+            if not lane.queue.empty() or lane.in_flight > 0:
+                return True
+        return False
+
+    def get_stats(self):
+        """Get stats for each lane.
+
+        :returns: dict mapping lane names to dicts with the keys threads,
+            idle_threads, queued, in_flight, completed, average_wait and
+            max_wait
+        """
+        self.lock.acquire()
+        try:
+            return dict((name, lane.get_stats())
+                        for name, lane in self.lanes.items())
+        finally:
+            self.lock.release()
 
     def close_threads(self):
-        for x in xrange(len(self.threads)):
-            self.queue.put("QUIT")
+        self.lock.acquire()
+        try:
+            self.running = False
+            threads = []
+            for lane in self.lanes.values():
+                for x in xrange(len(lane.threads)):
+                    lane.queue.put("QUIT")
+                threads.extend(lane.threads)
+                lane.threads = []
+        finally:
+            self.lock.release()
         # Why is there a timeout on the join() here, what's wrong?  On
         # shutdown, the system waits for the eventloop to finish using 
         # eventloop.join() but eventloop calls close_threads() which wait
@@ -227,14 +562,204 @@ class ThreadPool(object):
         # in a blocking operation which is exactly the point of having them
         # so eventloop.join() in turn blocks.  So if it doesn't clean up
         # in time let the daemon flag in the Thread() do its job.  See #16584.
-        while len(self.threads) > 0:
-            x = self.threads.pop()
+        while len(threads) > 0:
+            x = threads.pop()
             try:
                 x.join(0.5)
             except StandardError:
                 pass
 
+class Poller(object):
+    """Waits for file descriptors to become ready.
+
+    Pollers keep track of which fds we want to read from/write to.  Fds can
+    either be added/removed one at a time, or all at once using set_fds().
+
+    This class implements the poller using select().  Subclasses use more
+    efficient system calls.
+    """
+    def __init__(self):
+        self.read_fds = set()
+        self.write_fds = set()
+        self.exc_fds = set()
+
+    def add_read(self, fd):
+        self.read_fds.add(fd)
+        self._update(fd)
+
+    def remove_read(self, fd):
+        self.read_fds.discard(fd)
+        self._update(fd)
+
+    def add_write(self, fd):
+        self.write_fds.add(fd)
+        self._update(fd)
+
+    def remove_write(self, fd):
+        self.write_fds.discard(fd)
+        self._update(fd)
+
+    def set_fds(self, readfds, writefds, excfds):
+        """Replace the fds that we are watching."""
+        readfds, writefds, excfds = set(readfds), set(writefds), set(excfds)
+        changed = ((self.read_fds ^ readfds) | (self.write_fds ^ writefds) |
+                (self.exc_fds ^ excfds))
+        self.read_fds, self.write_fds, self.exc_fds = \
+                readfds, writefds, excfds
+        for fd in changed:
+            self._update(fd)
+
+    def _update(self, fd):
+        """Called when the events we want for an fd change."""
+        pass
+
+    def poll(self, timeout):
+        """Wait for fds to become ready.
+
+        :param timeout: max time to wait in seconds, or None to wait forever
+        :returns: (read_fds_ready, write_fds_ready, exc_fds_ready)
+        :raises select.error: the system call failed
+        """
+        return select.select(list(self.read_fds), list(self.write_fds),
+                list(self.exc_fds), timeout)
+
+class _MaskPoller(Poller):
+    """Base class for pollers that use event masks, like poll() and epoll.
+
+    Subclasses must set the event constants in __init__ and implement
+    _register(), _unregister() and _poll().
+    """
+    def __init__(self):
+        Poller.__init__(self)
+        self.masks = {}
+
+    def _calc_mask(self, fd):
+        mask = 0
+        if fd in self.read_fds:
+            mask |= self.READ
+        if fd in self.write_fds:
+            mask |= self.WRITE
+        if fd in self.exc_fds:
+            mask |= self.EXC
+        return mask
+
+    def _update(self, fd):
+        mask = self._calc_mask(fd)
+        if mask:
+            # Always register the fd, even if the mask hasn't changed.  If
+            # the fd was closed and reopened, it might have silently dropped
+            # out of the kernel's list.
+            self.masks[fd] = mask
+            self._register(fd, mask)
+        elif fd in self.masks:
+            del self.masks[fd]
+            self._unregister(fd)
+
+    def poll(self, timeout):
+        read_ready, write_ready, exc_ready = [], [], []
+        for fd, events in self._poll(timeout):
+            # Like select(), we treat errors and hangups as the fd being
+            # ready.  That way the callback will see the error when it tries
+            # to use the socket.
+            if events & (self.READ | self.ERROR) and fd in self.read_fds:
+                read_ready.append(fd)
+            if events & (self.WRITE | self.ERROR) and fd in self.write_fds:
+                write_ready.append(fd)
+            if events & (self.EXC | self.ERROR) and fd in self.exc_fds:
+                exc_ready.append(fd)
+        return read_ready, write_ready, exc_ready
+
+class PollPoller(_MaskPoller):
+    """Poller that uses poll().  This avoids select()'s FD_SETSIZE limit,
+    but still passes every fd to the kernel for each call.
+    """
+    def __init__(self):
+        _MaskPoller.__init__(self)
+        self.READ = select.POLLIN
+        self.WRITE = select.POLLOUT
+        self.EXC = select.POLLPRI
+        self.ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+        self.poller = select.poll()
+
+    def _register(self, fd, mask):
+        self.poller.register(fd, mask)
+
+    def _unregister(self, fd):
+        try:
+            self.poller.unregister(fd)
+        except KeyError:
+            pass
+
+    def _poll(self, timeout):
+        if timeout is not None:
+            # poll() uses milliseconds.  Round up so that we don't spin
+            # when we're about to hit a timeout.
+            timeout = int(math.ceil(timeout * 1000))
+        return self.poller.poll(timeout)
+
+class EpollPoller(_MaskPoller):
+    """Poller that uses epoll.  The kernel keeps track of our fds, so
+    waiting takes time proportional to the number of ready fds, rather than
+    the number of fds that we're watching.
+    """
+    def __init__(self):
+        _MaskPoller.__init__(self)
+        self.READ = select.EPOLLIN
+        self.WRITE = select.EPOLLOUT
+        self.EXC = select.EPOLLPRI
+        self.ERROR = select.EPOLLERR | select.EPOLLHUP
+        self.epoll = select.epoll()
+
+    def _register(self, fd, mask):
+        try:
+            self.epoll.modify(fd, mask)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.epoll.register(fd, mask)
+
+    def _unregister(self, fd):
+        try:
+            self.epoll.unregister(fd)
+        except (IOError, ValueError):
+            # the fd was already closed, which removes it from the epoll
+            # set.
+            pass
+
+    def _poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        try:
+            return self.epoll.poll(timeout)
+        except IOError, e:
+            # make errors look like they came from select(), like the other
+            # pollers
+            raise select.error(e.errno, e.strerror)
+
+def make_poller(persistent_fds):
+    """Create the best Poller for this platform.
+
+    :param persistent_fds: True if fds will be added and removed one at a
+        time, False if they will be replaced with set_fds() each time through
+        the loop.  We only use epoll for persistent fds, since there's no
+        benefit if we have to update the kernel's list every time.
+    """
+    if persistent_fds and hasattr(select, 'epoll'):
+        return EpollPoller()
+    # poll() is buggy on OS X, so we stick with select() there
+    if hasattr(select, 'poll') and sys.platform != 'darwin':
+        return PollPoller()
+    return Poller()
+
 class SimpleEventLoop(signals.SignalEmitter):
+    """Basic event loop.
+
+    Subclasses should either implement calc_fds(), which returns the fds to
+    wait on for each time through the loop, or set persistent_fds to True
+    and add/remove fds from self.poller as they change.
+    """
+    persistent_fds = False
+
     def __init__(self):
         signals.SignalEmitter.__init__(self, 'thread-will-start',
                                        'thread-started',
@@ -244,6 +769,18 @@ class SimpleEventLoop(signals.SignalEmitter):
         self.quit_flag = False
         self.wake_sender, self.wake_receiver = util.make_dummy_socket_pair()
         self.loop_ready = threading.Event()
+        self.poller = make_poller(self.persistent_fds)
+        if self.persistent_fds:
+            self.poller.add_read(self.wake_receiver.fileno())
+
+    def update_poller(self):
+        """Update the fds that our poller waits on."""
+        if self.persistent_fds:
+            return
+        readfds, writefds, excfds = self.calc_fds()
+        readfds = list(readfds)
+        readfds.append(self.wake_receiver.fileno())
+        self.poller.set_fds(readfds, writefds, excfds)
 
     def loop(self):
         self.loop_ready.set()
@@ -254,14 +791,15 @@ class SimpleEventLoop(signals.SignalEmitter):
         while not self.quit_flag:
             self.emit('begin-loop')
             timeout = self.calc_timeout()
-            readfds, writefds, excfds = self.calc_fds()
-            readfds.append(self.wake_receiver.fileno())
+            self.update_poller()
             try:
                 read_fds_ready, write_fds_ready, exc_fds_ready = \
-                        select.select(readfds, writefds, excfds, timeout)
+                        self.poller.poll(timeout)
             except select.error, (err, detail):
                 if err == errno.EINTR:
                     logging.warning ("eventloop: %s", detail)
+                    read_fds_ready, write_fds_ready, exc_fds_ready = \
+                            [], [], []
                 else:
                     self.emit('end-loop')
                     raise
@@ -283,6 +821,8 @@ class SimpleEventLoop(signals.SignalEmitter):
         self.wake_receiver.recv(1024)
 
 class EventLoop(SimpleEventLoop):
+    persistent_fds = True
+
     def __init__(self):
         SimpleEventLoop.__init__(self)
         self.create_signal('event-finished')
@@ -301,17 +841,21 @@ class EventLoop(SimpleEventLoop):
 
     def add_read_callback(self, sock, callback):
         self.read_callbacks[sock.fileno()] = callback
+        self.poller.add_read(sock.fileno())
 
     def remove_read_callback(self, sock):
         del self.read_callbacks[sock.fileno()]
         self.removed_read_callbacks.add(sock.fileno())
+        self.poller.remove_read(sock.fileno())
 
     def add_write_callback(self, sock, callback):
         self.write_callbacks[sock.fileno()] = callback
+        self.poller.add_write(sock.fileno())
 
     def remove_write_callback(self, sock):
         del self.write_callbacks[sock.fileno()]
         self.removed_write_callbacks.add(sock.fileno())
+        self.poller.remove_write(sock.fileno())
 
     def call_in_thread(self, callback, errback, function, name,
                        *args, **kwargs):
@@ -335,10 +879,11 @@ class EventLoop(SimpleEventLoop):
             if self.quit_flag:
                 break
 
-    def calc_fds(self):
-        return (self.read_callbacks.keys(), self.write_callbacks.keys(), [])
-
     def calc_timeout(self):
+        if self.idle_queue.has_pending_idle():
+            # we ran out of time to process idles on the last time through
+            # the loop.  Don't wait around.
+            return 0
         return self.scheduler.next_timeout()
 
     def do_begin_loop(self):
@@ -366,23 +911,32 @@ class EventLoop(SimpleEventLoop):
         dealt with on this iteration of the event loop.  This includes
         all socket read/write callbacks, timeouts and idle calls.
 
+        We stop processing idle calls after IDLE_TIME_BUDGET, so that a
+        flood of idles doesn't block network callbacks and timeouts.  The
+        remaining idles run on the next iteration.
+
         "events" are implemented as functions that should be called
         with no arguments.
         """
         for callback in self.generate_callbacks(write_fds_ready,
                                                self.write_callbacks,
-                                               self.removed_write_callbacks):
+                                               self.removed_write_callbacks,
+                                               self.poller.remove_write):
             yield callback
         for callback in self.generate_callbacks(read_fds_ready,
                                                self.read_callbacks,
-                                               self.removed_read_callbacks):
+                                               self.removed_read_callbacks,
+                                               self.poller.remove_read):
             yield callback
         while self.scheduler.has_pending_timeout():
             yield self.scheduler.process_next_timeout
+        deadline = clock() + IDLE_TIME_BUDGET
         while self.idle_queue.has_pending_idle():
             yield self.idle_queue.process_next_idle
+            if clock() > deadline:
+                break
 
-    def generate_callbacks(self, ready_list, map_, removed):
+    def generate_callbacks(self, ready_list, map_, removed, poller_remove):
         for fd in ready_list:
             try:
                 function = map_[fd]
@@ -398,6 +952,7 @@ class EventLoop(SimpleEventLoop):
                     success = trapcall.trap_call(when, function)
                     if not success:
                         del map_[fd]
+                        poller_remove(fd)
                     return success
                 yield callback_event
 
@@ -456,12 +1011,18 @@ def add_timeout(delay, function, name, args=None, kwargs=None):
     _eventloop.wakeup()
     return dc
 
-def add_idle(function, name, args=None, kwargs=None):
+def add_idle(function, name, args=None, kwargs=None,
+        priority=PRIORITY_NORMAL):
     """Schedule a function to be called when we get some spare time.
     Returns a ``DelayedCall`` object that can be used to cancel the
     call.
+
+    :param priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+        Background work that the user isn't waiting on should use
+        PRIORITY_LOW.
     """
-    dc = _eventloop.idle_queue.add_idle(function, name, args, kwargs)
+    dc = _eventloop.idle_queue.add_idle(function, name, args, kwargs,
+            priority)
     _eventloop.wakeup()
     return dc
 
@@ -474,9 +1035,25 @@ def add_urgent_call(function, name, args=None, kwargs=None):
     _eventloop.wakeup()
     return dc
 
+def get_call_stats():
+    """Get latency/duration stats for idles, timeouts and urgent calls.
+
+    See CallStats.get_stats() for the format.
+    """
+    return call_stats.get_stats()
+
+def dump_call_stats(path):
+    """Write out latency/duration stats to a file."""
+    call_stats.dump(path)
+
 def call_in_thread(callback, errback, function, name, *args, **kwargs):
     """Schedule a function to be called in a separate thread.
 
+    The lane keyword argument selects which thread pool lane to use.  It
+    defaults to LANE_DEFAULT, which is for quick calls that something is
+    waiting on.  Slow calls, like file copies, should use LANE_IO.  lane is
+    not passed on to function.
+
     .. Warning::
 
        Do not put code that accesses the database or the UI here!
@@ -484,6 +1061,13 @@ def call_in_thread(callback, errback, function, name, *args, **kwargs):
     _eventloop.call_in_thread(
         callback, errback, function, name, *args, **kwargs)
 
+def get_thread_pool_stats():
+    """Get queue-wait and in-flight stats for the thread pool lanes.
+
+    See ThreadPool.get_stats() for the format.
+    """
+    return _eventloop.threadpool.get_stats()
+
 lt = None
 
 profile_file = None
@@ -32,6 +32,7 @@
 FIXME - talk about Feed architecture here
 """
 
+import hashlib
 import os
 import re
 import time
@@ -112,6 +113,44 @@ class _RateLimiter(object):
         # get ready for the next check() call
         self.last_time = time.time()
 
+def _calc_content_hash(html):
+    """Calculate a digest of the contents of a feed.
+
+    If a server sends us the same contents as last time, then we can skip
+    parsing the feed.
+    """
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+    return unicode(hashlib.sha1(html).hexdigest())
+
+# counts how often we can skip parsing a feed because its content hash
+# didn't change
+_content_hash_stats = {'checks': 0, 'hits': 0}
+
+def _check_content_hash(content_hash, old_hash):
+    """Check if a feed's content hash is the same as last time.
+
+    This also updates the counters for get_content_hash_stats().
+    """
+    _content_hash_stats['checks'] += 1
+    if old_hash is not None and content_hash == old_hash:
+        _content_hash_stats['hits'] += 1
+        return True
+    return False
+
+def get_content_hash_stats():
+    """Get stats on how often feed content hashes let us skip parsing.
+
+    :returns: dict with the number of checks, hits and the hit rate
+    """
+    checks = _content_hash_stats['checks']
+    hits = _content_hash_stats['hits']
+    if checks:
+        hit_rate = float(hits) / checks
+    else:
+        hit_rate = 0.0
+    return {'checks': checks, 'hits': hits, 'hit_rate': hit_rate}
+
 # Notes on character set encoding of feeds:
 #
 # The parsing libraries built into Python mostly use byte strings
@@ -231,7 +270,7 @@ def _on_config_change(obj, key, value):
 def run_feedparser(html, callback, errback):
     if _RUN_FEED_PARSER_INLINE:
         try:
-            rv = feedparserutil.parse(html)
+            rv = feedparserutil.parse_to_values(html)
         except StandardError, e:
             errback(e)
         else:
@@ -258,6 +297,9 @@ class FeedImpl(DDBObject):
         self.thumbURL = None
         self.initialUpdate = True
         self.updateFreq = app.config.get(prefs.CHECK_CHANNELS_EVERY_X_MN) * 60
+        # feedupdate uses these to decide which feeds to update first
+        self.last_update_finished = None
+        self.unchanged_rate = 0.0
 
     @classmethod
     def orphaned_view(cls):
@@ -550,6 +592,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         DDBObject.signal_change(self, needs_save=needs_save)
 
     def on_signal_change(self):
+        app.feed_counts.feed_changed(self)
         is_updating = bool(self.actualFeed.updating)
         if self.wasUpdating and not is_updating:
             self.emit('update-finished')
@@ -577,54 +620,26 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         if self.actualFeed:
             return self.actualFeed.clean_old_items()
 
-    def invalidate_counts(self):
-        for cached_count_attr in ('_num_available', '_num_unwatched',
-                '_num_downloaded', '_num_downloading'):
-            if cached_count_attr in self.__dict__:
-                del self.__dict__[cached_count_attr]
-
-    def recalc_counts(self):
-        self.invalidate_counts()
-        self.signal_change(needs_save=False)
-        if self.in_folder():
-            self.get_folder().signal_change(needs_save=False)
-
     def num_downloaded(self):
         """Returns the number of downloaded items in the feed.
         """
-        try:
-            return self._num_downloaded
-        except AttributeError:
-            self._num_downloaded = self.downloaded_items.count()
-            return self._num_downloaded
+        return app.feed_counts.get_count(self.id, 'downloaded')
 
     def num_downloading(self):
         """Returns the number of downloading items in the feed.
         """
-        try:
-            return self._num_downloading
-        except AttributeError:
-            self._num_downloading = self.downloading_items.count()
-            return self._num_downloading
+        return app.feed_counts.get_count(self.id, 'downloading')
 
     def num_unwatched(self):
         """Returns string with number of unwatched videos in feed
         """
-        try:
-            return self._num_unwatched
-        except AttributeError:
-            self._num_unwatched = self.unwatched_items.count()
-            return self._num_unwatched
+        return app.feed_counts.get_count(self.id, 'unwatched')
 
     def num_available(self):
         """Returns string with number of available videos in feed
         """
-        try:
-            return self._num_available
-        except AttributeError:
-            self._num_available = (self.available_items.count() -
-                    self.auto_pending_items.count())
-            return self._num_available
+        return (app.feed_counts.get_count(self.id, 'available') -
+                app.feed_counts.get_count(self.id, 'auto_pending'))
 
     def get_viewed(self):
         """Returns true iff this feed has been looked at
@@ -637,13 +652,10 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
         # get the list of available items before we reset the time
         available_items = list(self.available_items)
         self.last_viewed = datetime.now()
-        try:
-            del self._num_available
-        except AttributeError:
-            pass
+        # signal our change first, so that our folder sees our new counts
+        self.signal_change()
         if self.in_folder():
             self.get_folder().signal_change()
-        self.signal_change()
         for item in available_items:
             item.signal_change(needs_save=False)
 
@@ -1171,6 +1183,7 @@ class Feed(DDBObject, iconcache.IconCacheOwnerMixin):
             app.bulk_sql_manager.finish()
         self.remove_icon_cache()
         DDBObject.remove(self)
+        app.feed_counts.feed_removed(self)
         self.actualFeed.remove()
         if self.in_folder():
             self.get_folder().signal_change()
@@ -1219,7 +1232,7 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
         FeedImpl.setup_new(self, url, ufeed, title)
         self.schedule_update_events(0)
 
-    def _handle_new_entry(self, entry, fp_values, channel_title):
+    def _handle_new_entry(self, fp_values, channel_title):
         """Handle getting a new entry from a feed."""
         enclosure = fp_values.first_video_enclosure
         if ((self.url.startswith('file://') and enclosure
@@ -1237,6 +1250,15 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
     def remember_old_items(self):
         self.old_items = set(self.items)
 
+    def _entry_values_for_parsed(self, parsed):
+        """Get a FeedParserValues object for each entry in a parsed feed."""
+        try:
+            # run_feedparser() already calculated the values for us
+            return parsed['entry_values']
+        except KeyError:
+            return [FeedParserValues(self.add_scraped_thumbnail(entry))
+                    for entry in parsed.entries]
+
     def create_items_for_parsed(self, parsed):
         """Update the feed using parsed XML passed in"""
         app.bulk_sql_manager.start()
@@ -1276,10 +1298,8 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
             by_url_title_key = (item.url, item.entry_title)
             if by_url_title_key != (None, None):
                 items_byURLTitle[by_url_title_key] = item
-        for entry in parsed.entries:
+        for fp_values in self._entry_values_for_parsed(parsed):
             rate_limiter.check_for_sleep()
-            entry = self.add_scraped_thumbnail(entry)
-            fp_values = FeedParserValues(entry)
             new = True
             if fp_values.data['rss_id'] is not None:
                 id_ = fp_values.data['rss_id']
@@ -1312,7 +1332,7 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
                         except StandardError:
                             pass
             if new and fp_values.first_video_enclosure is not None:
-                self._handle_new_entry(entry, fp_values, channel_title)
+                self._handle_new_entry(fp_values, channel_title)
 
     def _allow_feed_to_override_title(self):
         """Should the RSS feed override the default title?
@@ -1343,7 +1363,6 @@ class RSSFeedImplBase(ThrottledUpdateFeedImpl):
                 self.ufeed.mark_as_viewed()
             self.ufeed.signal_change()
 
-        self.ufeed.recalc_counts()
         if hasattr(self, "old_items"):
             self.truncate_old_items()
             del self.old_items
@@ -1395,6 +1414,8 @@ class RSSFeedImpl(RSSFeedImplBase):
         self.initialHTML = initialHTML
         self.etag = etag
         self.modified = modified
+        self.content_hash = None
+        self.pending_content_hash = None
         self.download = None
 
     @returns_unicode
@@ -1429,7 +1450,8 @@ class RSSFeedImpl(RSSFeedImplBase):
         self.ufeed.confirm_db_thread()
         if not self.ufeed.id_exists():
             return
-        if len(parsed.entries) == len(parsed.feed) == 0:
+        entries = parsed.get('entry_values', parsed.entries)
+        if len(entries) == len(parsed.feed) == 0:
             logging.warn("Empty feed, not updating: %s", self.url)
             self.feedparser_finished()
             return
@@ -1437,6 +1459,8 @@ class RSSFeedImpl(RSSFeedImplBase):
         self.parsed = parsed
         self.remember_old_items()
         self.create_items_for_parsed(parsed)
+        self.content_hash = self.pending_content_hash
+        self.pending_content_hash = None
 
         try:
             updateFreq = self.parsed["feed"]["ttl"]
@@ -1499,6 +1523,7 @@ class RSSFeedImpl(RSSFeedImplBase):
         if info.get('status') == 304:
             logging.debug("RSSFeedImpl: _update_callback: "
                           "status 304 (%s)", self.ufeed)
+            feedupdate.mark_unchanged(self.ufeed)
             self.schedule_update_events(-1)
             self.updating = False
             self.ufeed.signal_change()
@@ -1517,6 +1542,18 @@ class RSSFeedImpl(RSSFeedImplBase):
             self.modified = unicodify(info['last-modified'])
         else:
             self.modified = None
+        content_hash = _calc_content_hash(html)
+        if _check_content_hash(content_hash, self.content_hash):
+            logging.debug("RSSFeedImpl: _update_callback: "
+                          "content unchanged (%s)", self.ufeed)
+            feedupdate.mark_unchanged(self.ufeed)
+            self.schedule_update_events(-1)
+            self.updating = False
+            # save the new etag and modified values
+            self.signal_change()
+            self.ufeed.signal_change()
+            return
+        self.pending_content_hash = content_hash
         self.call_feedparser(html)
 
     @returns_unicode
@@ -1539,10 +1576,12 @@ class RSSFeedImpl(RSSFeedImplBase):
         """
         FeedImpl.setup_restored(self)
         self.download = None
+        self.pending_content_hash = None
 
     def clean_old_items(self):
         self.modified = None
         self.etag = None
+        self.content_hash = None
         self.update()
 
 class RSSMultiFeedBase(RSSFeedImplBase):
@@ -1550,6 +1589,8 @@ class RSSMultiFeedBase(RSSFeedImplBase):
         RSSFeedImplBase.setup_new(self, url, ufeed, title)
         self.etag = {}
         self.modified = {}
+        self.content_hash = {}
+        self.pending_content_hash = {}
         self.download_dc = {}
         self.updating = 0
         self.urls = self.calc_urls()
@@ -1559,6 +1600,7 @@ class RSSMultiFeedBase(RSSFeedImplBase):
         """
         RSSFeedImplBase.setup_restored(self)
         self.download_dc = {}
+        self.pending_content_hash = {}
         self.updating = 0
         self.urls = self.calc_urls()
 
@@ -1601,6 +1643,9 @@ class RSSMultiFeedBase(RSSFeedImplBase):
             return
         start = clock()
         self.create_items_for_parsed(parsed)
+        content_hash = self.pending_content_hash.pop(url, None)
+        if content_hash is not None:
+            self.content_hash[url] = content_hash
         self.feedparser_finished(url)
         end = clock()
         if end - start > 1.0:
@@ -1669,6 +1714,17 @@ class RSSMultiFeedBase(RSSFeedImplBase):
             self.modified[url] = unicodify(info['last-modified'])
         else:
             self.modified[url] = None
+        content_hash = _calc_content_hash(html)
+        if _check_content_hash(content_hash, self.content_hash.get(url)):
+            logging.debug("RSSMultiFeedBase: _update_callback: "
+                          "content unchanged (%s)", self.ufeed)
+            feedupdate.mark_unchanged(self.ufeed)
+            self.schedule_update_events(-1)
+            self.updating -= 1
+            self.check_update_finished()
+            self.signal_change()
+            return
+        self.pending_content_hash[url] = content_hash
         self.call_feedparser(html, url)
 
     def on_remove(self):
@@ -1683,6 +1739,7 @@ class RSSMultiFeedBase(RSSFeedImplBase):
     def clean_old_items(self):
         self.modified = {}
         self.etag = {}
+        self.content_hash = {}
         self.update()
 
 class SavedSearchFeedImpl(RSSMultiFeedBase):
@@ -2125,7 +2182,8 @@ class DirectoryScannerImplBase(FeedImpl):
         known_files = fileutil.FileSet(row[0] for row in
                 models.Item.select(['filename'],
                     'filename IS NOT NULL AND '
-                    '(feed_id is NULL or feed_id != ?)', (self.ufeed_id,)))
+                    '(feed_id is NULL or feed_id != ?)', (self.ufeed_id,),
+                    reporting=True))
         for path in self.pending_paths_to_add:
             known_files.add_path(path)
         self._add_known_files(known_files)
@@ -2273,7 +2331,6 @@ class DirectoryWatchFeedImpl(DirectoryScannerImplBase):
     def _after_update(self):
         if self.firstUpdate:
             self.firstUpdate = False
-        self.ufeed.recalc_counts()
         self.signal_change()
 
 class DirectoryFeedImpl(DirectoryScannerImplBase):
@@ -2362,6 +2419,8 @@ class SearchFeedImpl(RSSMultiFeedBase):
         self.query = u''
         self.etag = {}
         self.modified = {}
+        self.content_hash = {}
+        self.pending_content_hash = {}
         self.ufeed.icon_cache.reset()
         self.thumbURL = None
         self.ufeed.icon_cache.request_update(is_vital=True)
@@ -2389,7 +2448,7 @@ class SearchFeedImpl(RSSMultiFeedBase):
         self.update()
         self.ufeed.signal_change()
 
-    def _handle_new_entry(self, entry, fp_values, channel_title):
+    def _handle_new_entry(self, fp_values, channel_title):
         """Handle getting a new entry from a feed."""
         url = fp_values.data['url']
         if url is not None:
@@ -2398,22 +2457,21 @@ class SearchFeedImpl(RSSMultiFeedBase):
                 for item in dl.item_list:
                     if ((item.get_feed_url() == 'dtv:searchDownloads'
                          and item.get_url() == url)):
-                        try:
-                            if entry["id"] == item.get_rss_id():
-                                item.set_feed(self.ufeed.id)
-                                if not fp_values.compare_to_item(item):
-                                    item.update_from_feed_parser_values(fp_values)
-                                return
-                        except KeyError:
-                            pass
-                        title = entry.get("title")
+                        rss_id = fp_values.data['rss_id']
+                        if (rss_id is not None and
+                                rss_id == item.get_rss_id()):
+                            item.set_feed(self.ufeed.id)
+                            if not fp_values.compare_to_item(item):
+                                item.update_from_feed_parser_values(fp_values)
+                            return
+                        title = fp_values.data['entry_title']
                         oldtitle = item.entry_title
                         if title == oldtitle:
                             item.set_feed(self.ufeed.id)
                             if not fp_values.compare_to_item(item):
                                 item.update_from_feed_parser_values(fp_values)
                             return
-        RSSMultiFeedBase._handle_new_entry(self, entry, fp_values, channel_title)
+        RSSMultiFeedBase._handle_new_entry(self, fp_values, channel_title)
 
     def update_finished(self):
         self.searching = False
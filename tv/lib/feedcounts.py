@@ -0,0 +1,411 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2005, 2006, 2007, 2008, 2009, 2010, 2011
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""``miro.feedcounts`` -- Running totals of the items in feeds and folders.
+
+The sidebar shows the unwatched and available counts for every feed and
+folder, and ChannelInfo also needs the downloaded and downloading counts.
+Running COUNT queries each time an item changes adds up quickly: marking all
+items watched with hundreds of feeds means thousands of queries.
+
+FeedCounts keeps the totals in memory instead.  They're loaded from the
+database the first time they're needed, then Item calls item_changed() and
+item_removed() to keep them up to date.  Items are checked against the count
+where clauses in python using viewpredicate, so most changes don't touch the
+database.  reconcile() checks the totals against the database every so often
+in case we missed something.
+"""
+
+import logging
+
+from miro import app
+from miro import eventloop
+from miro import models
+from miro import viewpredicate
+from miro.database import ObjectNotFoundError
+
+COUNT_NAMES = ('downloaded', 'downloading', 'available', 'auto_pending',
+        'unwatched')
+
+_RD_JOIN = {'remote_downloader AS rd': 'item.downloader_id=rd.id'}
+_FEED_JOIN = {'feed': 'item.feed_id=feed.id'}
+
+# maps count names to (where, joins) for the items in the count.  Item uses
+# these to build its feed_*_view() methods.
+FEED_COUNT_CLAUSES = {
+    'downloaded': (
+        "rd.state in ('finished', 'uploading', 'uploading-paused')",
+        _RD_JOIN),
+    'downloading': (
+        "rd.state in ('downloading', 'uploading') AND "
+        "rd.main_item_id=item.id",
+        _RD_JOIN),
+    'available': (
+        "NOT autoDownloaded AND downloadedTime IS NULL AND "
+        "NOT is_file_item AND " # FileItems are not available
+        "feed.last_viewed <= item.creationTime",
+        _FEED_JOIN),
+    'auto_pending': (
+        "feed.autoDownloadable AND NOT item.was_downloaded AND "
+        "(item.eligibleForAutoDownload OR feed.getEverything)",
+        _FEED_JOIN),
+    'unwatched': (
+        "not seen AND file_type !='other' AND "
+        "(is_file_item OR rd.state in ('finished', 'uploading', "
+        "'uploading-paused'))",
+        _RD_JOIN),
+}
+
+_COUNT_INDEXES = dict((name, i) for i, name in enumerate(COUNT_NAMES))
+
+def _empty_counts():
+    return [0] * len(COUNT_NAMES)
+
+class FeedCounts(object):
+    """Tracks how many items in each feed/folder are in each count.
+
+    We store a bit mask for each item that's in at least 1 count, which lets
+    us figure out which totals to change when the item changes.  Feed
+    attributes that the where clauses use (last_viewed, autoDownloadable,
+    getEverything) can change the counts of all the items in a feed, when
+    those change we reload the counts for the feed from the database.
+
+    When totals change, we call signal_change() on the feeds and folders in
+    an idle callback, so a lot of item changes only send 1 update per feed.
+    """
+
+    # how often to check our totals against the database, in seconds
+    RECONCILE_INTERVAL = 600
+
+    def __init__(self):
+        self.predicates = {}
+        for name, (where, joins) in FEED_COUNT_CLAUSES.items():
+            self.predicates[name] = viewpredicate.ViewPredicate('item',
+                    where, (), joins)
+        self.loaded = False
+        self.reconcile_dc = None
+        self._reset()
+
+    def _reset(self):
+        # maps feed ids -> list of totals in COUNT_NAMES order
+        self.feed_counts = {}
+        # maps folder ids -> list of totals
+        self.folder_counts = {}
+        # maps feed ids -> the feed attributes that affect counts
+        self.feed_states = {}
+        # maps feed ids -> {item id -> mask} for items in at least 1 count
+        self.feed_items = {}
+        # maps item ids -> feed id for items in feed_items
+        self.item_feeds = {}
+        # feeds that we need to reload from the database
+        self.stale_feeds = set()
+        # feeds/folders that we need to call signal_change() on
+        self.changed_feeds = set()
+        self.changed_folders = set()
+        self.signal_dc = None
+
+    def load(self):
+        """Load all totals from the database."""
+        self._reset()
+        for feed in models.Feed.make_view():
+            self.feed_states[feed.id] = self._feed_state(feed)
+            self.feed_counts[feed.id] = _empty_counts()
+        for item_id, (feed_id, mask) in self._query_masks().iteritems():
+            self._set_mask(item_id, feed_id, mask)
+        # nothing has changed yet, we just loaded our totals
+        self.changed_feeds = set()
+        self.changed_folders = set()
+        self.loaded = True
+        self._schedule_reconcile()
+
+    def _check_loaded(self):
+        if not self.loaded:
+            self.load()
+        elif self.stale_feeds:
+            self._reload_stale_feeds()
+
+    def get_count(self, feed_id, name):
+        """Get the number of items in a feed that are in a count.
+
+        :param name: name from COUNT_NAMES
+        """
+        self._check_loaded()
+        if feed_id not in self.feed_counts:
+            self._add_feed(feed_id)
+        try:
+            return self.feed_counts[feed_id][_COUNT_INDEXES[name]]
+        except KeyError:
+            return 0
+
+    def get_folder_count(self, folder_id, name):
+        """Get the number of items in a folder that are in a count."""
+        self._check_loaded()
+        try:
+            return self.folder_counts[folder_id][_COUNT_INDEXES[name]]
+        except KeyError:
+            return 0
+
+    def item_changed(self, item):
+        """Update our totals after an item has been changed or inserted."""
+        if not self.loaded or app.bulk_sql_manager.will_insert(item.id):
+            # we'll see the item when we load, or when its inserted
+            return
+        feed_id = item.feed_id
+        if feed_id is not None and feed_id not in self.feed_states:
+            self._add_feed(feed_id)
+        if feed_id is None or feed_id in self.stale_feeds:
+            # reloading a stale feed will pick up the item
+            mask = 0
+        else:
+            mask = self._calc_mask(item)
+        self._set_mask(item.id, feed_id, mask)
+
+    def item_removed(self, item):
+        if self.loaded:
+            self._set_mask(item.id, None, 0)
+
+    def feed_changed(self, feed):
+        """Update our totals after a feed has been changed."""
+        if not self.loaded:
+            return
+        new_state = self._feed_state(feed)
+        old_state = self.feed_states.get(feed.id)
+        if old_state is None:
+            self.feed_states[feed.id] = new_state
+            self.feed_counts[feed.id] = _empty_counts()
+            return
+        if new_state == old_state:
+            return
+        counts = self.feed_counts[feed.id]
+        self._add_to_folder(old_state[0], counts, -1)
+        self._add_to_folder(new_state[0], counts, 1)
+        self.feed_states[feed.id] = new_state
+        if new_state[1:] != old_state[1:]:
+            # the where clauses use these attributes, so any of the items
+            # could have changed
+            self.stale_feeds.add(feed.id)
+            self._mark_changed(feed.id)
+
+    def feed_removed(self, feed):
+        if not self.loaded or feed.id not in self.feed_states:
+            return
+        for item_id in self.feed_items.pop(feed.id, {}):
+            del self.item_feeds[item_id]
+        folder_id = self.feed_states.pop(feed.id)[0]
+        self._add_to_folder(folder_id, self.feed_counts.pop(feed.id), -1)
+        self.stale_feeds.discard(feed.id)
+        self.changed_feeds.discard(feed.id)
+
+    def reconcile(self):
+        """Check our totals against the database and fix any that are wrong.
+
+        :returns: the number of feeds that had wrong totals
+        """
+        if not self.loaded:
+            self.load()
+            return 0
+        self._reload_stale_feeds()
+        masks = self._query_masks()
+        bad_feeds = set()
+        for item_id, feed_id in self.item_feeds.items():
+            if item_id not in masks:
+                bad_feeds.add(feed_id)
+                self._set_mask(item_id, None, 0)
+        for item_id, (feed_id, mask) in masks.iteritems():
+            old_feed_id = self.item_feeds.get(item_id)
+            if old_feed_id is None:
+                old_mask = 0
+            else:
+                old_mask = self.feed_items[old_feed_id][item_id]
+            if (old_feed_id, old_mask) != (feed_id, mask):
+                bad_feeds.add(feed_id)
+                bad_feeds.add(old_feed_id)
+                self._set_mask(item_id, feed_id, mask)
+        bad_feeds.discard(None)
+        if bad_feeds:
+            logging.warn("feed counts were wrong for %d feeds",
+                    len(bad_feeds))
+        return len(bad_feeds)
+
+    def _schedule_reconcile(self):
+        if self.reconcile_dc is not None:
+            self.reconcile_dc.cancel()
+        self.reconcile_dc = eventloop.add_timeout(self.RECONCILE_INTERVAL,
+                self._reconcile_timeout, "reconcile feed counts")
+
+    def _reconcile_timeout(self):
+        self.reconcile_dc = None
+        self.reconcile()
+        self._schedule_reconcile()
+
+    def _feed_state(self, feed):
+        return (feed.folder_id, feed.last_viewed, feed.autoDownloadable,
+                feed.getEverything)
+
+    def _add_feed(self, feed_id):
+        try:
+            feed = models.Feed.get_by_id(feed_id)
+        except ObjectNotFoundError:
+            return
+        self.feed_states[feed_id] = self._feed_state(feed)
+        self.feed_counts[feed_id] = _empty_counts()
+        if self.loaded:
+            self.stale_feeds.add(feed_id)
+
+    def _reload_stale_feeds(self):
+        stale_feeds = self.stale_feeds
+        self.stale_feeds = set()
+        for feed_id in stale_feeds:
+            if feed_id not in self.feed_states:
+                continue
+            masks = self._query_masks(feed_id)
+            for item_id in self.feed_items.get(feed_id, {}).keys():
+                if item_id not in masks:
+                    self._set_mask(item_id, None, 0)
+            for item_id, (item_feed_id, mask) in masks.iteritems():
+                self._set_mask(item_id, item_feed_id, mask)
+
+    def _query_masks(self, feed_id=None):
+        """Get the count masks for items using SQL.
+
+        :returns: dict mapping item ids -> (feed id, mask) for items that
+            are in at least 1 count
+        """
+        masks = {}
+        for i, name in enumerate(COUNT_NAMES):
+            where, joins = FEED_COUNT_CLAUSES[name]
+            if feed_id is None:
+                where = 'item.feed_id IS NOT NULL AND (%s)' % where
+                values = ()
+            else:
+                where = 'item.feed_id=? AND (%s)' % where
+                values = (feed_id,)
+            rows = app.db.select(models.Item, ['item.id', 'item.feed_id'],
+                    where, values, joins=joins, convert=False)
+            for item_id, item_feed_id in rows:
+                if app.bulk_sql_manager.will_remove(item_id):
+                    continue
+                old_mask = masks.get(item_id, (None, 0))[1]
+                masks[item_id] = (item_feed_id, old_mask | (1 << i))
+        return masks
+
+    def _calc_mask(self, item):
+        mask = 0
+        for i, name in enumerate(COUNT_NAMES):
+            if self._item_in_count(item, name):
+                mask |= 1 << i
+        return mask
+
+    def _item_in_count(self, item, name):
+        where, joins = FEED_COUNT_CLAUSES[name]
+        predicate = self.predicates[name]
+        try:
+            if not predicate.matches(item):
+                return False
+        except viewpredicate.CantEvaluate:
+            return self._sql_item_in_count(item, where, (), joins)
+        if predicate.is_fully_compiled():
+            return True
+        return self._sql_item_in_count(item, predicate.residual_where,
+                predicate.residual_values, joins)
+
+    def _sql_item_in_count(self, item, where, values, joins):
+        sql_where = 'item.id=? AND (%s)' % (where,)
+        return app.db.query_count('item', sql_where, (item.id,) + values,
+                joins) > 0
+
+    def _set_mask(self, item_id, feed_id, mask):
+        """Change the mask for an item and update the totals."""
+        old_feed_id = self.item_feeds.get(item_id)
+        if old_feed_id is None:
+            old_mask = 0
+        else:
+            old_mask = self.feed_items[old_feed_id][item_id]
+        if (old_feed_id, old_mask) == (feed_id, mask):
+            return
+        if old_mask:
+            self._add_mask(old_feed_id, old_mask, -1)
+            del self.feed_items[old_feed_id][item_id]
+            del self.item_feeds[item_id]
+        if mask and feed_id in self.feed_counts:
+            self._add_mask(feed_id, mask, 1)
+            self.feed_items.setdefault(feed_id, {})[item_id] = mask
+            self.item_feeds[item_id] = feed_id
+
+    def _add_mask(self, feed_id, mask, delta):
+        changes = [0] * len(COUNT_NAMES)
+        for i in xrange(len(COUNT_NAMES)):
+            if mask & (1 << i):
+                changes[i] = delta
+        counts = self.feed_counts[feed_id]
+        for i, change in enumerate(changes):
+            counts[i] += change
+        self._add_to_folder(self.feed_states[feed_id][0], changes, 1)
+        self._mark_changed(feed_id)
+
+    def _add_to_folder(self, folder_id, counts, sign):
+        if folder_id is None:
+            return
+        folder_counts = self.folder_counts.setdefault(folder_id,
+                _empty_counts())
+        for i, count in enumerate(counts):
+            folder_counts[i] += sign * count
+        self.changed_folders.add(folder_id)
+        self._schedule_signal()
+
+    def _mark_changed(self, feed_id):
+        self.changed_feeds.add(feed_id)
+        folder_id = self.feed_states[feed_id][0]
+        if folder_id is not None:
+            self.changed_folders.add(folder_id)
+        self._schedule_signal()
+
+    def _schedule_signal(self):
+        if self.signal_dc is None:
+            self.signal_dc = eventloop.add_idle(self._signal_changes,
+                    "signal feed count changes")
+
+    def _signal_changes(self):
+        self.signal_dc = None
+        changed_feeds = self.changed_feeds
+        changed_folders = self.changed_folders
+        self.changed_feeds = set()
+        self.changed_folders = set()
+        for feed_id in changed_feeds:
+            try:
+                feed = models.Feed.get_by_id(feed_id)
+            except ObjectNotFoundError:
+                continue
+            feed.signal_change(needs_save=False)
+        for folder_id in changed_folders:
+            try:
+                folder = models.ChannelFolder.get_by_id(folder_id)
+            except ObjectNotFoundError:
+                continue
+            folder.signal_change(needs_save=False)
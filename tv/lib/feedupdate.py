@@ -30,21 +30,110 @@
 """feedupdate.py -- Handles updating feeds.
 
 Our basic strategy is to limit the number of feeds that are
-simultaniously updating at any given time.  Right now the limit is set
-to 3.
+simultaniously updating at any given time.  There's a global limit
+(FEED_UPDATE_MAX_CONCURRENT) and a limit for feeds on the same host
+(FEED_UPDATE_MAX_PER_HOST), so that a refresh of hundreds of feeds can
+run in parallel without hammering a single server.
+
+Feeds waiting to update are ordered by priority rather than first-come
+first-served.  Feeds that haven't been updated for a long time go first.
+Feeds that the server often tells us haven't changed (HTTP 304 responses,
+see mark_unchanged()) can wait longer, and feeds that the user has looked
+at recently get a bonus.
+
+The time of the last update and the unchanged rate are stored on the
+feed's FeedImpl, so they carry over when Miro restarts.
 """
 
+import heapq
+import urlparse
+from datetime import datetime, timedelta
+
+from miro import app
 from miro import eventloop
-from miro import datastructures
+from miro import prefs
+from miro.clock import clock
+
+# cap on how stale we consider a feed, in seconds.  This is also used for
+# feeds that we haven't updated yet.
+MAX_STALENESS = 24 * 60 * 60
+# how much less urgent a feed that never changes is.  A value of 0.5 means
+# that feeds that always return 304 are treated as half as stale.
+UNCHANGED_WEIGHT = 0.5
+# how quickly the unchanged rate follows new results
+UNCHANGED_RATE_DECAY = 0.3
+# feeds the user has viewed recently are treated as this much staler
+RECENTLY_VIEWED_BONUS = 60 * 60
+RECENTLY_VIEWED_WINDOW = timedelta(days=1)
+
+def _feed_host(feed):
+    """Get the host that we will contact to update a feed.
+
+    :returns: host name or None if the feed isn't updated over the network
+    """
+    try:
+        url = feed.actualFeed.url
+    except AttributeError:
+        return None
+    if not url:
+        return None
+    return urlparse.urlparse(url)[1].lower() or None
+
+def _seconds_since(when):
+    delta = datetime.now() - when
+    return max(delta.days * 24 * 60 * 60 + delta.seconds, 0)
 
-MAX_UPDATES = 3
+def _record_update(feed_impl, unchanged):
+    """Store how an update went on a FeedImpl."""
+    if unchanged:
+        result = 1.0
+    else:
+        result = 0.0
+    feed_impl.last_update_finished = datetime.now()
+    feed_impl.unchanged_rate += (result - feed_impl.unchanged_rate) * \
+            UNCHANGED_RATE_DECAY
+    feed_impl.signal_change()
+
+class _TimingStats(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        if self.count:
+            average = self.total / self.count
+        else:
+            average = 0.0
+        return {'count': self.count, 'average': average, 'max': self.max}
 
 class FeedUpdateQueue(object):
     def __init__(self):
-        self.update_queue = datastructures.Fifo()
+        # heap of (priority, sequence number, time queued, feed,
+        # update_callback) tuples
+        self.update_queue = []
+        self.sequence = 0
         self.timeouts = {}
         self.callback_handles = {}
         self.currently_updating = set()
+        # maps hosts -> number of feeds updating from them
+        self.host_counts = {}
+        # maps feed ids -> (host, start time) for updating feeds
+        self.update_info = {}
+        # ids of updating feeds whose content didn't change
+        self.unchanged = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.peak_queue_depth = 0
+        self.unchanged_count = 0
+        self.wait_stats = _TimingStats()
+        self.update_stats = _TimingStats()
 
     def schedule_update(self, delay, feed, update_callback):
         name = "Feed update (%s)" % feed.get_title()
@@ -61,29 +150,114 @@ class FeedUpdateQueue(object):
 
     def do_update(self, feed, update_callback):
         del self.timeouts[feed.id]
-        self.update_queue.enqueue((feed, update_callback))
+        self.sequence += 1
+        heapq.heappush(self.update_queue, (self.calc_priority(feed),
+            self.sequence, clock(), feed, update_callback))
+        self.peak_queue_depth = max(self.peak_queue_depth,
+                len(self.update_queue))
         self.run_update_queue()
 
+    def calc_priority(self, feed):
+        """Calculate the priority for a feed update.
+
+        Lower values get updated first.
+        """
+        feed_impl = feed.actualFeed
+        if feed_impl.last_update_finished is None:
+            staleness = MAX_STALENESS
+            unchanged_rate = 0.0
+        else:
+            staleness = min(_seconds_since(feed_impl.last_update_finished),
+                    MAX_STALENESS)
+            unchanged_rate = feed_impl.unchanged_rate
+        score = staleness * (1.0 - UNCHANGED_WEIGHT * unchanged_rate)
+        if self._recently_viewed(feed):
+            score += RECENTLY_VIEWED_BONUS
+        return -score
+
+    def _recently_viewed(self, feed):
+        try:
+            if not feed.visible:
+                return False
+            last_viewed = feed.last_viewed
+        except AttributeError:
+            return False
+        # hidden feeds like search feeds use datetime.max
+        return (last_viewed != datetime.max and
+                datetime.now() - last_viewed < RECENTLY_VIEWED_WINDOW)
+
+    def mark_unchanged(self, feed):
+        if feed in self.currently_updating:
+            self.unchanged.add(feed.id)
+
     def update_finished(self, feed):
         for callback_handle in self.callback_handles.pop(feed.id):
             feed.disconnect(callback_handle)
         self.currently_updating.remove(feed)
+        host, start_time = self.update_info.pop(feed.id)
+        if host is not None:
+            self.host_counts[host] -= 1
+            if self.host_counts[host] == 0:
+                del self.host_counts[host]
+        unchanged = feed.id in self.unchanged
+        self.unchanged.discard(feed.id)
+        if unchanged:
+            self.unchanged_count += 1
+        self.update_stats.record(clock() - start_time)
+        if feed.id_exists():
+            _record_update(feed.actualFeed, unchanged)
         # call run_update_queue in an idle to avoid re-updating the feed that
         # just finished.  That could cause weird effects since we are in the
         # update-finished callback right now.  See #16277
         eventloop.add_idle(self.run_update_queue, 'run feed update queue')
 
     def run_update_queue(self):
+        max_updates = app.config.get(prefs.FEED_UPDATE_MAX_CONCURRENT)
+        max_per_host = app.config.get(prefs.FEED_UPDATE_MAX_PER_HOST)
+        # updates we skipped because their host is busy
+        host_busy = []
         while (len(self.update_queue) > 0 and 
-               len(self.currently_updating) < MAX_UPDATES):
-            feed, update_callback = self.update_queue.dequeue()
+               len(self.currently_updating) < max_updates):
+            entry = heapq.heappop(self.update_queue)
+            priority, sequence, queued_time, feed, update_callback = entry
             if feed in self.currently_updating:
                 continue
-            handle = feed.connect('update-finished', self.update_finished)
-            handle2 = feed.connect('removed', self.update_finished)
-            self.callback_handles[feed.id] = (handle, handle2)
-            self.currently_updating.add(feed)
-            update_callback()
+            host = _feed_host(feed)
+            if (host is not None and
+                    self.host_counts.get(host, 0) >= max_per_host):
+                host_busy.append(entry)
+                continue
+            self.wait_stats.record(clock() - queued_time)
+            self._start_update(feed, host, update_callback)
+        for entry in host_busy:
+            heapq.heappush(self.update_queue, entry)
+
+    def _start_update(self, feed, host, update_callback):
+        handle = feed.connect('update-finished', self.update_finished)
+        handle2 = feed.connect('removed', self.update_finished)
+        self.callback_handles[feed.id] = (handle, handle2)
+        self.currently_updating.add(feed)
+        if host is not None:
+            self.host_counts[host] = self.host_counts.get(host, 0) + 1
+        self.update_info[feed.id] = (host, clock())
+        update_callback()
+
+    def get_stats(self):
+        """Get statistics about feed updates.
+
+        :returns: dict containing the current queue depth, the number of
+            updating feeds for each host and timing info for how long
+            updates waited in the queue and how long they took.
+        """
+        return {
+            'queue_depth': len(self.update_queue),
+            'peak_queue_depth': self.peak_queue_depth,
+            'updating': len(self.currently_updating),
+            'host_counts': self.host_counts.copy(),
+            'unchanged_count': self.unchanged_count,
+            'wait': self.wait_stats.as_dict(),
+            'update': self.update_stats.as_dict(),
+        }
 
 global_update_queue = FeedUpdateQueue()
 
@@ -96,3 +270,15 @@ def schedule_update(delay, feed, update_callback):
     the future.
     """
     global_update_queue.schedule_update(delay, feed, update_callback)
+
+def mark_unchanged(feed):
+    """Call this when an update finds that a feed hasn't changed.
+
+    Feeds that rarely change get a lower priority for future updates.
+    """
+    global_update_queue.mark_unchanged(feed)
+
+def get_stats():
+    """Get statistics about feed updates.  See FeedUpdateQueue.get_stats().
+    """
+    return global_update_queue.get_stats()
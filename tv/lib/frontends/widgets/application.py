@@ -1088,6 +1088,13 @@ class Application:
     def force_feedparser_processing(self):
         messages.ForceFeedparserProcessing().send_to_backend()
 
+    def dump_event_loop_stats(self):
+        """Devel method: write out timing stats for event loop callbacks."""
+        title = _("Select File to write Event Loop Stats to")
+        path = dialogs.ask_for_save_pathname(title, 'miro-eventloop-stats.txt')
+        if path is not None:
+            messages.DumpEventLoopStats(path).send_to_backend()
+
     def _printout_memory_stats(self, title):
         # base_classes is a list of base classes that we care about.  If you
         # want to check memory usage for a different class, add it to the
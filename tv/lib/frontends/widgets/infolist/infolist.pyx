@@ -319,7 +319,7 @@ cdef class InfoList:
                     infolist_node_free(node_array[i])
             PyMem_Free(node_array)
 
-    def update_infos(self, infos, resort):
+    def update_infos(self, infos, resort, redraw=True):
         """Update a list of objects
 
         if any of the infos are not already in the list, a KeyError will be
@@ -327,6 +327,8 @@ cdef class InfoList:
 
         :param infos: list of infos to update
         :param resort: should the list be resorted?
+        :param redraw: should the rows be redrawn?  Pass False if nothing
+        that gets displayed changed.
         """
 
         cdef InfoListNode** node_array # stores the nodes we will update
@@ -343,11 +345,13 @@ cdef class InfoList:
             # fetch first, in case of key error
             for 0 <= i < count:
                 node_array[i] = self._fetch_node(infos[i].id)
-            infolistplat_will_change_nodes(self.nodelist)
+            if redraw:
+                infolistplat_will_change_nodes(self.nodelist)
             for 0 <= i < count:
                 node = node_array[i]
                 infolist_node_set_info(node, infos[i])
-                infolistplat_node_changed(self.nodelist, node)
+                if redraw:
+                    infolistplat_node_changed(self.nodelist, node)
             if not resort:
                 return
             if self.sort_mode == INFOLIST_SORT_NORMAL:
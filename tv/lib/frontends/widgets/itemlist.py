@@ -350,6 +350,16 @@ DEFAULT_SORT = ArtistSort(False)
 
 SORT_KEY_MAP = dict((sort.KEY, sort) for sort in ItemSort.__subclasses__())
 
+class _ReversedKey(object):
+    """Wraps a sort key so that it sorts in the opposite order."""
+    __slots__ = ['key']
+
+    def __init__(self, key):
+        self.key = key
+
+    def __cmp__(self, other):
+        return cmp(other.key, self.key)
+
 class ItemList(object):
     """
     Attributes:
@@ -366,10 +376,24 @@ class ItemList(object):
     downloaded_only -- Are we only displaying the downloaded items?
     non_feed_only -- Are we only displaying file items?
     resort_on_update -- Should we re-sort the list when items change?
+
+    While searching, set_search_ranking() can put the best matches at the
+    top of the list.  The rest of the items use the normal sort.  Changing
+    the sort drops the ranking.
     """
 
+    # ItemInfo attributes that we don't display, sort or filter on.  If only
+    # these change, we don't need to redraw the item.
+    UNDISPLAYED_FIELDS = frozenset([
+        'search_ngrams', 'metadata_version', 'mdp_state',
+        'media_type_checked', 'subtitle_encoding', 'item_source',
+        'title_tag', 'permalink', 'commentslink', 'payment_link',
+        'file_url', 'thumbnail_url',
+    ])
+
     def __init__(self):
         self._sorter = DEFAULT_SORT
+        self._search_ranking = None
         self.model = widgetset.InfoListModel(self._sorter.sort_key,
                 self._sorter.reverse)
         self.video_only = self.audio_only = False
@@ -387,10 +411,39 @@ class ItemList(object):
 
     def set_sort(self, sorter):
         self._sorter = sorter
-        self.model.change_sort(sorter.sort_key, sorter.reverse)
+        self._search_ranking = None
+        self._update_model_sort()
 
     def resort(self):
-        self.set_sort(self._sorter)
+        self._update_model_sort()
+
+    def set_search_ranking(self, ranking):
+        """Put the best matches for a search at the top of the list.
+
+        :param ranking: dict mapping ids to their rank (see
+                        SearchFilter.calc_ranking()), or None to go back to
+                        the normal sort.
+        """
+        if ranking is None and self._search_ranking is None:
+            return
+        self._search_ranking = ranking
+        self._update_model_sort()
+
+    def _update_model_sort(self):
+        if self._search_ranking is None:
+            self.model.change_sort(self._sorter.sort_key,
+                    self._sorter.reverse)
+        else:
+            self.model.change_sort(self._ranked_sort_key, False)
+
+    def _ranked_sort_key(self, info):
+        try:
+            return (0, self._search_ranking[info.id])
+        except KeyError:
+            key = self._sorter.sort_key(info)
+            if self._sorter.reverse:
+                key = _ReversedKey(key)
+            return (1, key)
 
     def get_sort(self):
         return self._sorter
@@ -494,10 +547,20 @@ class ItemList(object):
                 self._hidden_items[item.id] = item
         self._insert_items(to_add)
 
-    def update_items(self, changed_items):
+    def update_items(self, changed_items, changed_fields=None):
+        """Update items in the list.
+
+        :param changed_items: ItemInfos for the changed items
+        :param changed_fields: dict mapping item ids to the names of the
+            attributes that changed, like ItemsChanged.changed_fields.
+            Items that aren't in it are redrawn.
+        """
+        if changed_fields is None:
+            changed_fields = {}
         to_add = []
         to_remove = []
         to_update = []
+        to_swap = []
         for info in changed_items:
             should_show = self._should_show_item(info)
             if info.id in self._hidden_items:
@@ -512,12 +575,20 @@ class ItemList(object):
                 if not should_show:
                     to_remove.append(info.id)
                     self._hidden_items[info.id] = info
+                elif self._only_undisplayed_changed(
+                        changed_fields.get(info.id)):
+                    to_swap.append(info)
                 else:
                     to_update.append(info)
         self._insert_items(to_add)
         self.model.update_infos(to_update, resort=self.resort_on_update)
+        # use the new infos, but don't redraw their rows
+        self.model.update_infos(to_swap, resort=False, redraw=False)
         self.model.remove_ids(to_remove)
 
+    def _only_undisplayed_changed(self, fields):
+        return fields is not None and fields <= self.UNDISPLAYED_FIELDS
+
     def remove_items(self, id_list):
         ids_in_model = []
         for id_ in id_list:
@@ -80,6 +80,11 @@ class ItemListTracker(signals.SignalEmitter):
     # maps (type, id) -> ItemListTracker objects
     _live_trackers = weakref.WeakValueDictionary()
 
+    # types whose items all come from the database.  We can search these
+    # using app.search_index.
+    DATABASE_ITEM_TYPES = ('downloading', 'videos', 'music', 'others',
+            'search', 'folder-contents', 'feed', 'playlist')
+
     @classmethod
     def create(cls, type_, id_):
         """Get a ItemListTracker 
@@ -115,9 +120,16 @@ class ItemListTracker(signals.SignalEmitter):
         self.item_list = itemlist.ItemList()
         self.id = id_
         self.is_tracking = False
-        self.search_filter = SearchFilter()
+        self.search_filter = self._make_search_filter()
         self.saw_initial_list = False
 
+    def _make_search_filter(self):
+        if (self.type in self.DATABASE_ITEM_TYPES and
+                app.search_index is not None):
+            return SharedIndexSearchFilter(app.search_index)
+        else:
+            return SearchFilter()
+
     def connect(self, name, func, *extra_args):
         if not self.is_tracking:
             self._start_tracking()
@@ -151,7 +163,14 @@ class ItemListTracker(signals.SignalEmitter):
         self.is_tracking = True
 
     def _send_track_items_message(self):
-        messages.TrackItems(self.type, self.id).send_to_backend()
+        sorter = self.item_list.get_sort()
+        if isinstance(sorter, itemlist.PlaylistSort):
+            # PlaylistSort keeps its positions in the frontend, so the
+            # backend can't use it.
+            messages.TrackItems(self.type, self.id).send_to_backend()
+        else:
+            messages.TrackItems(self.type, self.id, sorter.sort_key,
+                    sorter.reverse).send_to_backend()
 
     def _stop_tracking(self):
         if not self.is_tracking:
@@ -190,10 +209,11 @@ class ItemListTracker(signals.SignalEmitter):
             # before the ItemList message for our new one.
             return
         added, changed, removed = self.search_filter.filter_changes(
-                message.added, message.changed, message.removed)
+                message.added, message.changed, message.removed,
+                message.changed_fields)
         self.emit('items-will-change', added, changed, removed)
         self.item_list.add_items(added)
-        self.item_list.update_items(changed)
+        self.item_list.update_items(changed, message.changed_fields)
         self.item_list.remove_items(removed)
         #Note that the code in PlaybackPlaylist expects this signal order
         self.emit("items-removed-from-source", message.removed)
@@ -204,6 +224,7 @@ class ItemListTracker(signals.SignalEmitter):
         self.emit("items-will-change", added, [], removed)
         self.item_list.add_items(added)
         self.item_list.remove_items(removed)
+        self.item_list.set_search_ranking(self.search_filter.calc_ranking())
         self.emit("items-changed", added, [], removed)
 
 class PlaylistItemListTracker(ItemListTracker):
@@ -245,6 +266,15 @@ class ManualItemListTracker(ItemListTracker):
     def _send_track_items_message(self):
         messages.TrackItemsManually(self.id, self.info_list).send_to_backend()
 
+def _search_data_changed(info, changed_fields):
+    """Check if a change to an item could affect whether it matches a search.
+
+    :param info: ItemInfo for the changed item
+    :param changed_fields: dict mapping ids to the attributes that changed
+    """
+    fields = changed_fields.get(info.id)
+    return fields is None or 'search_ngrams' in fields
+
 class SearchFilter(object):
     """SearchFilter filter out non-matching items from item lists
     """
@@ -269,7 +299,7 @@ class SearchFilter(object):
         if not self.query:
             # special case, just send out the list and calculate the index
             # later
-            self._pending_changes.enqueue((items, [], []))
+            self._pending_changes.enqueue((items, [], [], {}))
             self._schedule_indexing()
             return items
         self._ensure_index_ready()
@@ -277,28 +307,52 @@ class SearchFilter(object):
         self.matching_ids = self.searcher.search(self.query)
         return [i for i in items if i.id in self.matching_ids]
 
-    def filter_changes(self, added, changed, removed):
+    def filter_changes(self, added, changed, removed, changed_fields=None):
         """Filter a list of incoming changes
 
         :param added: list of added ItemInfos
         :param changed: list of changed ItemInfos
         :param removed: list of removed ItemInfos ids
+        :param changed_fields: dict mapping ids to the attributes that
+                               changed (see messages.ItemsChanged)
 
         :returns: (added, changed, removed), updated based on our search
         """
+        if changed_fields is None:
+            changed_fields = {}
         if not self.query:
             # special case, just send out the list and calculate the index
             # later
-            self._pending_changes.enqueue((added, changed, removed))
+            self._pending_changes.enqueue((added, changed, removed,
+                changed_fields))
             self._schedule_indexing()
             return added, changed, removed
         self._ensure_index_ready()
 
         self._add_items(added)
-        self._update_items(changed)
+        self._update_items(changed, changed_fields)
         self._remove_ids(removed)
 
-        matches = self.searcher.search(self.query)
+        if (added or removed or
+                [i for i in changed if
+                    _search_data_changed(i, changed_fields)]):
+            matches = self.searcher.search(self.query)
+        else:
+            # things like download progress changed, but none of that
+            # affects which items match our search.
+            matches = self.matching_ids
+        rv = self._filter_changes_using_matches(added, changed, removed,
+                matches)
+        self.matching_ids = matches
+        return rv
+
+    def _filter_changes_using_matches(self, added, changed, removed,
+            matches):
+        """Filter a list of incoming changes.
+
+        :param matches: set of ids that match our search.  It must contain
+        all matching ids from added and changed.
+        """
         old_matches = self.matching_ids
 
         added_filtered = [i for i in added if i.id in matches]
@@ -312,7 +366,6 @@ class SearchFilter(object):
                     added_filtered.append(info)
             elif info.id in old_matches:
                 remove_filtered.add(info.id)
-        self.matching_ids = matches
         return added_filtered, changed_filtered, remove_filtered
 
     def set_search(self, query):
@@ -331,14 +384,24 @@ class SearchFilter(object):
         added_infos = [self.all_items[id_] for id_ in added]
         return added_infos, removed
 
+    def calc_ranking(self):
+        """Figure out which items best match the current search.
+
+        :returns: dict mapping the ids of the best matches to their rank
+                  (0 is the best), or None if we can't rank our matches.
+        """
+        return None
+
     def _add_items(self, items):
         for item in items:
             self.all_items[item.id] = item
             self.searcher.add_item(item)
 
-    def _update_items(self, items):
+    def _update_items(self, items, changed_fields):
         for item in items:
             self.all_items[item.id] = item
+            if not _search_data_changed(item, changed_fields):
+                continue
             try:
                 self.searcher.update_item(item)
             except KeyError:
@@ -365,9 +428,10 @@ class SearchFilter(object):
     def _ensure_index_ready(self):
         if len(self._pending_changes) > 0:
             while len(self._pending_changes) > 0:
-                (added, changed, removed) = self._pending_changes.dequeue()
+                (added, changed, removed,
+                        changed_fields) = self._pending_changes.dequeue()
                 self._add_items(added)
-                self._update_items(changed)
+                self._update_items(changed, changed_fields)
                 self._remove_ids(removed)
             self.matching_ids = self.searcher.search(self.query)
 
@@ -381,11 +445,79 @@ class SearchFilter(object):
         # find a chunk of items, process them, then schedule another call
         if len(self._pending_changes) == 0:
             return
-        (added, changed, removed) = self._pending_changes.dequeue()
+        (added, changed, removed,
+                changed_fields) = self._pending_changes.dequeue()
         self._add_items(added)
-        self._update_items(changed)
+        self._update_items(changed, changed_fields)
         self._remove_ids(removed)
         if len(self._pending_changes) > 0:
             self._schedule_indexing()
         else:
             self.matching_ids = self.searcher.search(self.query)
+
+class SharedIndexSearchFilter(SearchFilter):
+    """SearchFilter for lists of database items.
+
+    All database items are in app.search_index, so rather than building an
+    index for our items, we use that one.  We only need to check the items
+    in our list against it.
+
+    If the index can rank its results, the best RANKED_PAGE_SIZE matches get
+    put first while searching.
+    """
+    RANKED_PAGE_SIZE = 200
+
+    def __init__(self, search_index):
+        SearchFilter.__init__(self)
+        self.searcher = search_index
+
+    def _calc_matches(self, id_list):
+        if not self.query:
+            return set(id_list)
+        return set(self.searcher.filter_ids(id_list, self.query))
+
+    def filter_initial_list(self, items):
+        for item in items:
+            self.all_items[item.id] = item
+        matches = self._calc_matches([i.id for i in items])
+        self.matching_ids.update(matches)
+        return [i for i in items if i.id in matches]
+
+    def filter_changes(self, added, changed, removed, changed_fields=None):
+        if changed_fields is None:
+            changed_fields = {}
+        for item in itertools.chain(added, changed):
+            self.all_items[item.id] = item
+        for id_ in removed:
+            del self.all_items[id_]
+        to_check = [i.id for i in added]
+        unchanged_matches = set()
+        for info in changed:
+            if _search_data_changed(info, changed_fields):
+                to_check.append(info.id)
+            elif info.id in self.matching_ids:
+                unchanged_matches.add(info.id)
+        matches = self._calc_matches(to_check)
+        matches.update(unchanged_matches)
+        added_filtered, changed_filtered, remove_filtered = \
+                self._filter_changes_using_matches(added, changed, removed,
+                        matches)
+        self.matching_ids.difference_update(remove_filtered)
+        self.matching_ids.update(i.id for i in added_filtered)
+        return added_filtered, changed_filtered, remove_filtered
+
+    def set_search(self, query):
+        self.query = query
+        matches = self._calc_matches(self.all_items.keys())
+        added = matches - self.matching_ids
+        removed = self.matching_ids - matches
+        self.matching_ids = matches
+        added_infos = [self.all_items[id_] for id_ in added]
+        return added_infos, removed
+
+    def calc_ranking(self):
+        if not self.query or not self.searcher.RANKS_RESULTS:
+            return None
+        ranked_ids = self.searcher.search_ranked(self.query, 0,
+                self.RANKED_PAGE_SIZE, id_list=list(self.matching_ids))
+        return dict((id_, rank) for rank, id_ in enumerate(ranked_ids))
@@ -392,6 +392,7 @@ def get_menu():
                 MenuItem(_("Memory Stats"), "MemoryStats"),
                 MenuItem(_("Force Feedparser Processing"),
                     "ForceFeedparserProcessing"),
+                MenuItem(_("Event Loop Stats"), "EventLoopStats"),
                 ])
 
         mbar.menuitems.append(dev_menu)
@@ -733,6 +734,10 @@ def on_memory_stats():
 def on_memory_stats():
     app.widgetapp.force_feedparser_processing()
 
+@action_handler("EventLoopStats")
+def on_event_loop_stats():
+    app.widgetapp.dump_event_loop_stats()
+
 def generate_action_groups(menu_structure):
     """Takes a menu structure and returns a map of action group name to
     list of menu actions in that group.
@@ -242,22 +242,33 @@ class TransferOptions(object):
             self.invalid_url = True
             return
 
-    def build_handle(self, out_headers):
+    def build_handle(self, out_headers, handle=None):
         """Build a libCURL handle.  This should only be called inside the
         LibCURLManager thread.
+
+        :param handle: idle handle to reuse.  If None, we create a new one.
         """
         if self.etag is not None:
             out_headers['etag'] = self.etag
         if self.modified is not None:
             out_headers['If-Modified-Since'] = self.modified
 
-        handle = self._init_handle()
+        handle = self._init_handle(handle)
         self._setup_post(handle, out_headers)
         self._setup_headers(handle, out_headers)
         return handle
 
-    def _init_handle(self):
-        handle = pycurl.Curl()
+    def pool_key(self):
+        """Get the key used to pool libcurl handles for this transfer."""
+        return (self.scheme, self.host)
+
+    def _init_handle(self, handle=None):
+        if handle is None:
+            handle = pycurl.Curl()
+        else:
+            # reset() clears the options from the last transfer, but keeps
+            # the connection, DNS and TLS session caches around.
+            handle.reset()
         handle.setopt(pycurl.USERAGENT, user_agent())
         handle.setopt(pycurl.FOLLOWLOCATION, 1)
         handle.setopt(pycurl.MAXREDIRS, REDIRECTION_LIMIT)
@@ -456,11 +467,13 @@ class CurlTransfer(object):
                 self.proxy_auth = auth
             self._send_new_request()
 
-    def build_handle(self):
+    def build_handle(self, handle=None):
         """Build a libCURL handle.  This should only be called inside the
         LibCURLManager thread.
+
+        :param handle: idle handle to reuse.  If None, we create a new one.
         """
-        self.handle = self.options.build_handle(self.out_headers)
+        self.handle = self.options.build_handle(self.out_headers, handle)
         # don't authenticate SSL certificates see #15180
         self.handle.setopt(pycurl.SSL_VERIFYPEER, 0)
 
@@ -850,15 +863,35 @@ class LibCURLManager(eventloop.SimpleEventLoop):
       - Runs a thread for pycurl to use
       - Manages the libcurl multi object
       - Handles adding/removing CurlTransfers objects
+      - Keeps a pool of idle libcurl handles so that we can reuse
+        connections
     """
 
     def __init__(self):
         eventloop.SimpleEventLoop.__init__(self)
         self.multi = pycurl.CurlMulti()
+        self.share = self._make_share()
         self.transfer_map = {}
         self.transfers_to_add = Queue.Queue()
         self.transfers_to_remove = Queue.Queue()
         self.after_perform_callbacks = []
+        # maps TransferOptions.pool_key() -> list of idle handles
+        self.idle_handles = {}
+        self.handle_stats = {'created': 0, 'reused': 0, 'closed': 0}
+
+    def _make_share(self):
+        """Create a CurlShare object to share DNS lookups and TLS sessions
+        between our handles.
+        """
+        share = pycurl.CurlShare()
+        share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        try:
+            share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        except (AttributeError, pycurl.error):
+            # older versions of pycurl/libcurl don't support sharing SSL
+            # sessions.  We can still share the DNS cache.
+            logging.info("libcurl: can't share SSL sessions")
+        return share
 
     def start(self):
         self.thread = threading.Thread(target=utils.thread_body,
@@ -876,7 +909,49 @@ class LibCURLManager(eventloop.SimpleEventLoop):
         for transfer in self.transfer_map.values():
             self.multi.remove_handle(transfer.handle)
             transfer.handle.close()
+        for handles in self.idle_handles.values():
+            for handle in handles:
+                handle.close()
+        self.idle_handles = {}
         self.multi.close()
+        self.share.close()
+
+    def get_idle_handle(self, options):
+        """Get an idle handle to use for a transfer.
+
+        :returns: a pycurl.Curl object that was last used to connect to the
+            same host, or None if there isn't one.
+        """
+        try:
+            handle = self.idle_handles[options.pool_key()].pop()
+        except (KeyError, IndexError):
+            self.handle_stats['created'] += 1
+            return None
+        else:
+            self.handle_stats['reused'] += 1
+            return handle
+
+    def release_handle(self, transfer, handle):
+        """Put a handle back into the idle pool once a transfer is done with
+        it.
+        """
+        if handle is None:
+            return
+        if transfer.handle is handle:
+            transfer.handle = None
+        key = transfer.options.pool_key()
+        handles = self.idle_handles.setdefault(key, [])
+        if len(handles) < app.config.get(prefs.HTTP_KEEPALIVE_PER_HOST):
+            handles.append(handle)
+        else:
+            handle.close()
+            self.handle_stats['closed'] += 1
+
+    def get_handle_stats(self):
+        """Get stats about how often we were able to reuse handles."""
+        stats = self.handle_stats.copy()
+        stats['idle'] = sum(len(h) for h in self.idle_handles.values())
+        return stats
 
     def add_transfer(self, transfer):
         self.transfers_to_add.put(transfer)
@@ -924,11 +999,17 @@ class LibCURLManager(eventloop.SimpleEventLoop):
                 transfer = self.transfers_to_add.get_nowait()
             except Queue.Empty:
                 break
+            idle_handle = self.get_idle_handle(transfer.options)
             try:
-                transfer.build_handle()
+                transfer.build_handle(idle_handle)
             except NetworkError, e:
+                self.release_handle(transfer, transfer.handle)
                 transfer.call_errback(e)
                 continue
+            if idle_handle is None:
+                # reset() doesn't unshare a handle, so only new handles
+                # need this
+                transfer.handle.setopt(pycurl.SHARE, self.share)
             self.transfer_map[transfer.handle] = transfer
             self.multi.add_handle(transfer.handle)
 
@@ -938,24 +1019,32 @@ class LibCURLManager(eventloop.SimpleEventLoop):
             except Queue.Empty:
                 break
             transfer.on_cancel(remove_file)
+            handle = transfer.handle
             try:
-                del self.transfer_map[transfer.handle]
+                del self.transfer_map[handle]
             except KeyError:
                 continue
-            self.multi.remove_handle(transfer.handle)
+            self.multi.remove_handle(handle)
+            self.release_handle(transfer, handle)
 
     def check_finished(self):
         queued, finished, errors = self.multi.info_read()
         for handle in finished:
             try:
-                self.pop_transfer(handle).on_finished()
+                transfer = self.pop_transfer(handle)
+                transfer.on_finished()
             except StandardError:
                 logging.stacktrace("Error calling on_finished()")
+            else:
+                self.release_handle(transfer, handle)
         for handle, code, message in errors:
             try:
-                self.pop_transfer(handle).on_error(code, handle)
+                transfer = self.pop_transfer(handle)
+                transfer.on_error(code, handle)
             except StandardError:
                 logging.stacktrace("Error calling on_error()")
+            else:
+                self.release_handle(transfer, handle)
 
     def pop_transfer(self, handle):
         transfer = self.transfer_map.pop(handle)
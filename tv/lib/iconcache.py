@@ -57,7 +57,8 @@ class IconCacheUpdater:
                    and item.url == item.dbItem.get_thumbnail_url()):
                 is_vital = False
         if self.running_count < RUNNING_MAX:
-            eventloop.add_idle(item.request_icon, "Icon Request")
+            eventloop.add_idle(item.request_icon, "Icon Request",
+                    priority=eventloop.PRIORITY_LOW)
             self.running_count += 1
         else:
             if is_vital:
@@ -78,7 +79,8 @@ class IconCacheUpdater:
             self.running_count -= 1
             return
 
-        eventloop.add_idle(item.request_icon, "Icon Request")
+        eventloop.add_idle(item.request_icon, "Icon Request",
+                priority=eventloop.PRIORITY_LOW)
 
     @eventloop.as_idle
     def clear_vital(self):
@@ -35,12 +35,10 @@ import locale
 import os.path
 import traceback
 import logging
-import re
 
 from miro.gtcache import gettext as _
 from miro.util import (check_u, returns_unicode, check_f, returns_filename,
-                       quote_unicode_url, stringify, get_first_video_enclosure,
-                       entity_replace)
+                       stringify)
 from miro.plat.utils import filename_to_unicode, unicode_to_filename
 
 from miro.download_utils import (clean_filename, next_free_filename,
@@ -54,6 +52,7 @@ from miro import iconcache
 from miro import databaselog
 from miro import downloader
 from miro import eventloop
+from miro import feedcounts
 from miro import prefs
 from miro.plat import resources
 from miro import util
@@ -65,260 +64,11 @@ from miro import signals
 from miro import search
 from miro import models
 from miro import metadata
+from miro.feedparserutil import (FeedParserValues, KNOWN_MIME_TYPES,
+                                 MIME_SUBSITUTIONS)
 
 _charset = locale.getpreferredencoding()
 
-KNOWN_MIME_TYPES = (u'audio', u'video')
-KNOWN_MIME_SUBTYPES = (
-    u'mov', u'wmv', u'mp4', u'mp3',
-    u'mpg', u'mpeg', u'avi', u'x-flv',
-    u'x-msvideo', u'm4v', u'mkv', u'm2v', u'ogg'
-    )
-MIME_SUBSITUTIONS = {
-    u'QUICKTIME': u'MOV',
-}
-
-def _check_for_image(path, element):
-    """Given an element (which is really a dict), traverses
-    the path in the element and if that turns out to be an image,
-    then it returns True.
-
-    Otherwise it returns False.
-    """
-    for part in path:
-        try:
-            element = element[part]
-        except (KeyError, TypeError):
-            return False
-    if ((isinstance(element, basestring)
-         and element.endswith((".jpg", ".jpeg", ".png", ".gif")))):
-        return True
-    return False
-
-class FeedParserValues(object):
-    """Helper class to get values from feedparser entries
-
-    FeedParserValues objects inspect the FeedParserDict for the entry
-    attribute for various attributes using in Item (entry_title,
-    rss_id, url, etc...).
-    """
-    def __init__(self, entry):
-        self.entry = entry
-        self.first_video_enclosure = get_first_video_enclosure(entry)
-
-        self.data = {
-            'license': entry.get("license"),
-            'rss_id': entry.get('id'),
-            'entry_title': self._calc_title(),
-            'thumbnail_url': self._calc_thumbnail_url(),
-            'entry_description': self._calc_raw_description(),
-            'link': self._calc_link(),
-            'payment_link': self._calc_payment_link(),
-            'comments_link': self._calc_comments_link(),
-            'url': self._calc_url(),
-            'enclosure_size': self._calc_enclosure_size(),
-            'enclosure_type': self._calc_enclosure_type(),
-            'enclosure_format': self._calc_enclosure_format(),
-            'releaseDateObj': self._calc_release_date(),
-        }
-
-    def update_item(self, item):
-        for key, value in self.data.items():
-            setattr(item, key, value)
-
-    def compare_to_item(self, item):
-        for key, value in self.data.items():
-            if getattr(item, key) != value:
-                return False
-        return True
-
-    def compare_to_item_enclosures(self, item):
-        compare_keys = (
-            'url', 'enclosure_size', 'enclosure_type',
-            'enclosure_format'
-            )
-        for key in compare_keys:
-            if getattr(item, key) != self.data[key]:
-                return False
-        return True
-
-    def _calc_title(self):
-        if hasattr(self.entry, "title"):
-            # The title attribute shouldn't use entities, but some in
-            # the wild do (#11413).  In that case, try to fix them.
-            title = entity_replace(self.entry.title)
-            # Strip tags from the title.
-            p = re.compile('<.*?>')
-            return p.sub('', title)
-
-        if ((self.first_video_enclosure
-             and 'url' in self.first_video_enclosure)):
-            return self.first_video_enclosure['url'].decode("ascii",
-                                                                "replace")
-        return None
-
-    def _calc_thumbnail_url(self):
-        """Returns a link to the thumbnail of the video.  """
-        # Try to get the thumbnail specific to the video enclosure
-        if self.first_video_enclosure is not None:
-            url = self._get_element_thumbnail(self.first_video_enclosure)
-            if url is not None:
-                return url
-
-        # Try to get any enclosure thumbnail
-        if "enclosures" in self.entry:
-            for enclosure in self.entry["enclosures"]:
-                url = self._get_element_thumbnail(enclosure)
-                if url is not None:
-                    return url
-
-        # Try to get the thumbnail for our entry
-        return self._get_element_thumbnail(self.entry)
-
-    def _get_element_thumbnail(self, element):
-        # handles <thumbnail><href>http:...
-        if _check_for_image(("thumbnail", "href"), element):
-            return element["thumbnail"]["href"]
-        if _check_for_image(("thumbnail",), element):
-            return element["thumbnail"]
-
-        return None
-
-    def _calc_raw_description(self):
-        """Check the enclosure to see if it has a description first.
-        If not, then grab the description from the entry.
-
-        Both first_video_enclosure and entry are FeedParserDicts,
-        which does some fancy footwork with normalizing feed entry
-        data.
-        """
-        rv = None
-        if self.first_video_enclosure:
-            rv = self.first_video_enclosure.get("text", None)
-        if not rv and self.entry:
-            rv = self.entry.get("description", None)
-        if not rv:
-            return u''
-        return rv
-
-    def _calc_link(self):
-        if hasattr(self.entry, "link"):
-            link = self.entry.link
-            if isinstance(link, dict):
-                try:
-                    link = link['href']
-                except KeyError:
-                    return u""
-            if link is None:
-                return u""
-            if isinstance(link, unicode):
-                return link
-            try:
-                return link.decode('ascii', 'replace')
-            except UnicodeDecodeError:
-                return link.decode('ascii', 'ignore')
-        return u""
-
-    def _calc_payment_link(self):
-        try:
-            return self.first_video_enclosure.payment_url.decode(
-                'ascii', 'replace')
-        except (AttributeError, UnicodeDecodeError):
-            try:
-                return self.entry.payment_url.decode('ascii','replace')
-            except (AttributeError, UnicodeDecodeError):
-                return u""
-
-    def _calc_comments_link(self):
-        return self.entry.get('comments', u"")
-
-    def _calc_url(self):
-        if (self.first_video_enclosure is not None and
-                'url' in self.first_video_enclosure):
-            url = self.first_video_enclosure['url'].replace('+', '%20')
-            return quote_unicode_url(url)
-        else:
-            return u''
-
-    def _calc_enclosure_size(self):
-        enc = self.first_video_enclosure
-        if enc is not None and "torrent" not in enc.get("type", ""):
-            try:
-                return int(enc['length'])
-            except (KeyError, ValueError):
-                return None
-
-    def _calc_enclosure_type(self):
-        if ((self.first_video_enclosure
-             and self.first_video_enclosure.has_key('type'))):
-            return self.first_video_enclosure['type']
-        else:
-            return None
-
-    def _calc_enclosure_format(self):
-        enclosure = self.first_video_enclosure
-        if enclosure:
-            try:
-                extension = enclosure['url'].split('.')[-1]
-                extension = extension.lower().encode('ascii', 'replace')
-            except (SystemExit, KeyboardInterrupt):
-                raise
-            except KeyError:
-                extension = u''
-            # Hack for mp3s, "mpeg audio" isn't clear enough
-            if extension.lower() == u'mp3':
-                return u'.mp3'
-            if enclosure.get('type'):
-                enc = enclosure['type'].decode('ascii', 'replace')
-                if "/" in enc:
-                    mtype, subtype = enc.split('/', 1)
-                    mtype = mtype.lower()
-                    if mtype in KNOWN_MIME_TYPES:
-                        format = subtype.split(';')[0].upper()
-                        if mtype == u'audio':
-                            format += u' AUDIO'
-                        if format.startswith(u'X-'):
-                            format = format[2:]
-                        return (u'.%s' %
-                                MIME_SUBSITUTIONS.get(format, format).lower())
-
-            if extension in KNOWN_MIME_SUBTYPES:
-                return u'.%s' % extension
-        return None
-
-    def _calc_release_date(self):
-        # FIXME - this is awful.  need to handle site-specific things
-        # a different way.
-        release_date = None
-
-        # if this is not a youtube url, then we try to use
-        # updated_parsed from either the enclosure or the entry
-        if "youtube.com" not in self._calc_url():
-            try:
-                release_date = self.first_video_enclosure.updated_parsed
-            except AttributeError:
-                try:
-                    release_date = self.entry.updated_parsed
-                except AttributeError:
-                    pass
-
-        # if this is a youtube url and/or there was no updated_parsed,
-        # then we try to use the published_parsed from either the
-        # enclosure or the entry
-        if release_date is None:
-            try:
-                release_date = self.first_video_enclosure.published_parsed
-            except AttributeError:
-                try:
-                    release_date = self.entry.published_parsed
-                except AttributeError:
-                    pass
-
-        if release_date is not None:
-            return datetime(*release_date[0:7])
-
-        return datetime.min
-
 class FileFeedParserValues(FeedParserValues):
     """FeedParserValues for FileItems"""
     def __init__(self, filename, title=None, description=None):
@@ -415,6 +165,10 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
     def signal_change(self, needs_save=True):
         app.item_info_cache.item_changed(self)
         DDBObject.signal_change(self, needs_save)
+        app.feed_counts.item_changed(self)
+
+    def on_db_insert(self):
+        app.feed_counts.item_changed(self)
 
     @classmethod
     def auto_pending_view(cls):
@@ -591,46 +345,31 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
     def folder_contents_view(cls, folder_id):
         return cls.make_view('parent_id=?', (folder_id,))
 
+    @classmethod
+    def _feed_count_view(cls, feed_id, count_name):
+        where, joins = feedcounts.FEED_COUNT_CLAUSES[count_name]
+        return cls.make_view('feed_id=? AND (%s)' % where, (feed_id,),
+                joins=dict(joins))
+
     @classmethod
     def feed_downloaded_view(cls, feed_id):
-        return cls.make_view("feed_id=? AND "
-                "rd.state in ('finished', 'uploading', 'uploading-paused')",
-                (feed_id,),
-                joins={'remote_downloader AS rd': 'item.downloader_id=rd.id'})
+        return cls._feed_count_view(feed_id, 'downloaded')
 
     @classmethod
     def feed_downloading_view(cls, feed_id):
-        return cls.make_view("feed_id=? AND "
-                "rd.state in ('downloading', 'uploading') AND "
-                "rd.main_item_id=item.id",
-                (feed_id,),
-                joins={'remote_downloader AS rd': 'item.downloader_id=rd.id'})
+        return cls._feed_count_view(feed_id, 'downloading')
 
     @classmethod
     def feed_available_view(cls, feed_id):
-        return cls.make_view("feed_id=? AND NOT autoDownloaded "
-                "AND downloadedTime IS NULL AND "
-                "NOT is_file_item AND " # FileItems are not available
-                "feed.last_viewed <= item.creationTime",
-                (feed_id,),
-                joins={'feed': 'item.feed_id=feed.id'})
+        return cls._feed_count_view(feed_id, 'available')
 
     @classmethod
     def feed_auto_pending_view(cls, feed_id):
-        return cls.make_view('feed_id=? AND feed.autoDownloadable AND '
-                'NOT item.was_downloaded AND '
-                '(item.eligibleForAutoDownload OR feed.getEverything)',
-                (feed_id,),
-                joins={'feed': 'item.feed_id=feed.id'})
+        return cls._feed_count_view(feed_id, 'auto_pending')
 
     @classmethod
     def feed_unwatched_view(cls, feed_id):
-        return cls.make_view("feed_id=? AND not seen AND "
-                "file_type !='other' AND "
-                "(is_file_item OR rd.state in ('finished', 'uploading', "
-                "'uploading-paused'))",
-                (feed_id,),
-                joins={'remote_downloader AS rd': 'item.downloader_id=rd.id'})
+        return cls._feed_count_view(feed_id, 'unwatched')
 
     @classmethod
     def children_view(cls, parent_id):
@@ -928,9 +667,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
                 # thread/signal_change()
                 self.title = filename_to_unicode(filename)
 
-    def recalc_feed_counts(self):
-        self.get_feed().recalc_counts()
-
     def get_viewed(self):
         """Returns True iff this item has never been viewed in the
         interface.
@@ -1068,7 +804,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
             self.duration = None
             self.isContainerItem = None
             self.signal_change()
-        self.recalc_feed_counts()
 
     def has_downloader(self):
         return self.downloader_id is not None and self.downloader is not None
@@ -1202,7 +937,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
                 for item in self.downloader.item_list:
                     if item != self:
                         item.mark_item_seen(False)
-            self.recalc_feed_counts()
         else:
             self.lastWatched = datetime.now()
             self.signal_change()
@@ -1233,7 +967,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
                 for item in self.downloader.item_list:
                     if item != self:
                         item.mark_item_unseen(False)
-            self.recalc_feed_counts()
 
     # TODO: played/seen count updates need to trigger recalculation of auto
     # ratings somewhere
@@ -1311,7 +1044,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
             else:
                 self.downloader.start()
         self.signal_change()
-        self.recalc_feed_counts()
 
     def pause(self):
         if self.downloader:
@@ -1328,7 +1060,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
         # FIXME - this is cheating and abusing the was_downloaded flag
         self.was_downloaded = True
         self.signal_change()
-        self.recalc_feed_counts()
 
     def is_eligible_for_auto_download(self):
         self.confirm_db_thread()
@@ -1756,7 +1487,6 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
         for other in Item.make_view('downloader_id IS NULL AND url=?',
                 (self.url,)):
             other.set_downloader(self.downloader)
-        self.recalc_feed_counts()
 
     def check_media_file(self):
         """Begin metadata extraction for this item; runs mutagen synchonously,
@@ -1908,6 +1638,7 @@ class Item(DDBObject, iconcache.IconCacheOwnerMixin, metadata.Store):
                 item.remove()
         self._remove_from_playlists()
         DDBObject.remove(self)
+        app.feed_counts.item_removed(self)
         # need to call this after DDBObject.remove(), so that the item info is
         # there for ItemInfoFetcher to see.
         app.item_info_cache.item_removed(self)
@@ -2260,7 +1991,8 @@ class IncompleteMovieDataUpdator(object):
             movie_data_updator.disconnect(self.handle)
         else:
             eventloop.add_idle(self.do_some_updates,
-                    'update incomplete movie data')
+                    'update incomplete movie data',
+                    priority=eventloop.PRIORITY_LOW)
 
 class DeletedFileChecker(object):
     """Utility class that manages calling Item.check_deleted().
@@ -2293,7 +2025,8 @@ class DeletedFileChecker(object):
         it only schedules one callback.
         """
         if self.started and not self.check_scheduled:
-            eventloop.add_idle(self.run_checks, 'checking items deleted')
+            eventloop.add_idle(self.run_checks, 'checking items deleted',
+                    priority=eventloop.PRIORITY_LOW)
             self.check_scheduled = True
 
     def run_checks(self):
@@ -42,24 +42,139 @@ Miro is running and between runs.  This results in 2 speedups:
     need to build IconCache objects and Feed objects in order to create
     ItemInfos).
 
-The general strategy is to just dumbly pickle the data and if we notice any
-errors, or if the DB version changes, throw away the cache and rebuild.  We
-use a lot of direct SQL queries in this code, borrowing app.db's cursor.  This
-is slightly naughty, but results in fast peformance.
+The general strategy is to just dumbly serialize the data and if we notice
+any errors, or if the DB version changes, throw away the cache and rebuild.
+We use a lot of direct SQL queries in this code, borrowing app.db's cursor.
+This is slightly naughty, but results in fast peformance.
+
+ItemInfos are stored in a compact format built with the marshal module (see
+encode_info() and decode_info()), which is much smaller and faster to load
+than pickling them.
 """
 
 import cPickle
+import datetime
 import itertools
 import logging
+import marshal
+import threading
 
 from miro import app
 from miro import dbupgradeprogress
 from miro import eventloop
 from miro import itemsource
+from miro import messages
 from miro import models
 from miro import schema
 from miro import signals
 
+# Version of the format we use for the item_info_cache table.  Bump this if
+# you change encode_info().
+FORMAT_VERSION = 1
+
+# Attributes that we store for each ItemInfo, in order.  The search data is
+# big, so we recalculate it instead.
+_CACHED_ATTRIBUTES = tuple(name for name in messages.ItemInfo.attribute_names
+        if name not in ('description_stripped', 'search_ngrams'))
+_INTERNED_INDEXES = tuple(i for i, name in enumerate(_CACHED_ATTRIBUTES)
+        if name in messages.ItemInfo.interned_attribute_names)
+_DEVICE_INDEX = _CACHED_ATTRIBUTES.index('device')
+
+# marshal handles these types natively.  Everything else gets stored as a
+# (tag, data) tuple.
+_NATIVE_TYPES = frozenset([type(None), bool, int, long, float, str, unicode])
+_CONTAINER_TYPES = frozenset([tuple, list, dict])
+_TAG_TUPLE, _TAG_DATETIME, _TAG_ITEM_INFO, _TAG_PICKLE = range(4)
+
+def _encode_value(value):
+    value_type = type(value)
+    if value_type in _NATIVE_TYPES:
+        return value
+    elif value_type is list:
+        return [_encode_value(v) for v in value]
+    elif value_type is dict:
+        return dict((_encode_value(k), _encode_value(v))
+                for k, v in value.iteritems())
+    elif value_type is tuple:
+        return (_TAG_TUPLE, tuple(_encode_value(v) for v in value))
+    elif value_type is datetime.datetime and value.tzinfo is None:
+        return (_TAG_DATETIME, (value.year, value.month, value.day,
+            value.hour, value.minute, value.second, value.microsecond))
+    elif value_type is messages.ItemInfo:
+        return (_TAG_ITEM_INFO, _encode_info_data(value))
+    else:
+        # subclasses of the native types (FilenameType for example),
+        # DownloadInfo objects, etc.
+        return (_TAG_PICKLE, cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+
+def _decode_value(value):
+    value_type = type(value)
+    if value_type is tuple:
+        tag, data = value
+        if tag == _TAG_DATETIME:
+            return datetime.datetime(*data)
+        elif tag == _TAG_ITEM_INFO:
+            return _decode_info_data(data)
+        elif tag == _TAG_PICKLE:
+            return cPickle.loads(data)
+        elif tag == _TAG_TUPLE:
+            return tuple(_decode_value(v) for v in data)
+        else:
+            raise ValueError("Unknown tag: %r" % tag)
+    elif value_type is list:
+        return [_decode_value(v) for v in value]
+    elif value_type is dict:
+        return dict((_decode_value(k), _decode_value(v))
+                for k, v in value.iteritems())
+    else:
+        return value
+
+def _encode_info_data(info):
+    values = []
+    unset = [] # indexes of attributes that aren't set
+    for i, name in enumerate(_CACHED_ATTRIBUTES):
+        try:
+            value = getattr(info, name)
+        except AttributeError:
+            value = None
+            unset.append(i)
+        values.append(_encode_value(value))
+    # like ItemInfo.__getstate__(), we don't store the device
+    values[_DEVICE_INDEX] = None
+    return (values, unset)
+
+def _decode_info_data(data):
+    values, unset = data
+    values = [v if type(v) not in _CONTAINER_TYPES else _decode_value(v)
+            for v in values]
+    for i in _INTERNED_INDEXES:
+        values[i] = messages.intern_string(values[i])
+    info = messages.ItemInfo.__new__(messages.ItemInfo)
+    for name, value in zip(_CACHED_ATTRIBUTES, values):
+        setattr(info, name, value)
+    for i in unset:
+        delattr(info, _CACHED_ATTRIBUTES[i])
+    info.calc_search_data()
+    return info
+
+def encode_info(info):
+    """Encode an ItemInfo for the item_info_cache table."""
+    return marshal.dumps((FORMAT_VERSION, _encode_info_data(info)))
+
+def decode_info(data):
+    """Decode data created with encode_info().
+
+    Raises ValueError if the data is invalid or uses a different format
+    version.
+    """
+    try:
+        version, info_data = marshal.loads(data)
+    except (EOFError, TypeError):
+        raise ValueError("Invalid item info data")
+    if version != FORMAT_VERSION:
+        raise ValueError("Unknown item info format: %r" % version)
+    return _decode_info_data(info_data)
+
 class ItemInfoCache(signals.SignalEmitter):
     """ItemInfoCache stores the latest ItemInfo objects for each item
 
@@ -75,11 +190,19 @@ class ItemInfoCache(signals.SignalEmitter):
         added (obj, item_info) -- an item info object was created
         changed (obj, item_info) -- an item info object was updated
         removed (obj, item_info) -- an item info object was removed
+
+    When we use the item_info_cache table, we only read the rows at startup.
+    A separate thread decodes them in chunks, so startup can continue in the
+    meantime.  If the backend needs an ItemInfo that the thread hasn't
+    gotten to yet, we decode it right away.  This way, the first lists the
+    frontend asks for get served without waiting for the rest.
     """
 
     # how often should we save cache data to the DB? (in seconds)
     SAVE_INTERVAL = 30
     VERSION_KEY = 'item_info_cache_db_version'
+    # how many rows the load thread decodes at once
+    LOAD_CHUNK_SIZE = 500
 
     def __init__(self):
         signals.SignalEmitter.__init__(self)
@@ -88,6 +211,11 @@ class ItemInfoCache(signals.SignalEmitter):
         self.create_signal('removed')
         self.id_to_info = None
         self.loaded = False
+        # maps item id -> data from item_info_cache that we haven't decoded
+        # yet.  _pending_lock protects this, and moving ItemInfos from it to
+        # id_to_info.
+        self._pending_blobs = {}
+        self._pending_lock = threading.Lock()
 
     def load(self):
         # call _reset_changes() first.  This way if we throw an exception
@@ -111,16 +239,18 @@ class ItemInfoCache(signals.SignalEmitter):
             self._infos_added = self.id_to_info.copy()
             self.schedule_save_to_db()
         self.loaded = True
+        if self._pending_blobs:
+            self._start_load_thread()
 
     def version(self):
         return "%s-%s" % (schema.VERSION,
                           itemsource.DatabaseItemSource.VERSION)
 
     def _info_to_blob(self, info):
-        return buffer(cPickle.dumps(info))
+        return buffer(encode_info(info))
 
     def _blob_to_info(self, blob):
-        info = cPickle.loads(str(blob))
+        info = decode_info(str(blob))
         # Download stats are no longer valid, reset them
         info.leechers = None
         info.seeders = None
@@ -138,17 +268,118 @@ class ItemInfoCache(signals.SignalEmitter):
         """
         saved_db_version = app.db.get_variable(self.VERSION_KEY)
         if saved_db_version == self.version():
-            quick_load_values = {}
             app.db.cursor.execute("SELECT id, pickle FROM item_info_cache")
-            for row in app.db.cursor:
-                quick_load_values[row[0]] = self._blob_to_info(row[1])
+            rows = app.db.cursor.fetchall()
             # double check that we have the right number of rows
-            if len(quick_load_values) == self._db_item_count():
-                self.id_to_info = quick_load_values
+            if len(rows) == self._db_item_count():
+                if rows:
+                    # Decode a row now, so that if the data is bad in
+                    # general, we can use _failsafe_load() instead.
+                    self._blob_to_info(rows[0][1])
+                self._pending_blobs = dict(rows)
+                self.id_to_info = {}
+
+    def _start_load_thread(self):
+        # Decode the newest items first, those are the most likely to be
+        # displayed.
+        id_list = sorted(self._pending_blobs, reverse=True)
+        thread = threading.Thread(name='ItemInfoCache Load Thread',
+                                  target=self._load_thread,
+                                  args=(id_list,))
+        thread.setDaemon(True)
+        thread.start()
+
+    def _load_thread(self, id_list):
+        """Decode the rows in _pending_blobs.
+
+        This runs in a separate thread, so we can't touch the database.  If
+        a row can't be decoded, we leave it in _pending_blobs and
+        _finish_loading() takes care of it in the backend thread.
+        """
+        try:
+            for start in xrange(0, len(id_list), self.LOAD_CHUNK_SIZE):
+                chunk_ids = id_list[start:start+self.LOAD_CHUNK_SIZE]
+                self._pending_lock.acquire()
+                try:
+                    chunk = [(id_, self._pending_blobs[id_])
+                            for id_ in chunk_ids
+                            if id_ in self._pending_blobs]
+                finally:
+                    self._pending_lock.release()
+                decoded = []
+                for id_, blob in chunk:
+                    try:
+                        decoded.append((id_, self._blob_to_info(blob)))
+                    except (StandardError, cPickle.UnpicklingError):
+                        pass
+                self._pending_lock.acquire()
+                try:
+                    for id_, info in decoded:
+                        # the backend thread may have decoded it already
+                        if id_ in self._pending_blobs:
+                            del self._pending_blobs[id_]
+                            self.id_to_info[id_] = info
+                finally:
+                    self._pending_lock.release()
+        finally:
+            eventloop.add_idle(self._finish_loading,
+                    'finish loading item info cache')
+
+    def _finish_loading(self):
+        """Load any ItemInfos that haven't been decoded yet."""
+        if app.item_info_cache is not self:
+            # we've been replaced by a new ItemInfoCache (this happens in the
+            # unittests)
+            return
+        for id_ in self._pending_blobs.keys():
+            self._ensure_loaded(id_)
+
+    def _ensure_loaded(self, id_):
+        """Make sure the ItemInfo for id_ is in id_to_info if we have it.
+
+        If id_ is still waiting to be decoded, we decode it now.
+
+        :returns: True if id_to_info has an ItemInfo for id_
+        """
+        self._pending_lock.acquire()
+        try:
+            if id_ in self.id_to_info:
+                return True
+            blob = self._pending_blobs.pop(id_, None)
+        finally:
+            self._pending_lock.release()
+        if blob is None:
+            return False
+        try:
+            info = self._blob_to_info(blob)
+        except (StandardError, cPickle.UnpicklingError), e:
+            logging.warn("Error loading item info for %s: %s", id_, e)
+            item = models.Item.get_by_id(id_)
+            info = itemsource.DatabaseItemSource._item_info_for(item)
+            # fix the data in the DB
+            self._infos_changed[id_] = info
+            self.schedule_save_to_db()
+        self.id_to_info[id_] = info
+        return True
+
+    def _discard_pending(self, id_):
+        """Stop waiting to decode the ItemInfo for id_.
+
+        Use this when we're going to replace the ItemInfo anyways.
+
+        :returns: True if we had an ItemInfo for id_
+        """
+        self._pending_lock.acquire()
+        try:
+            if id_ in self.id_to_info:
+                return True
+            return self._pending_blobs.pop(id_, None) is not None
+        finally:
+            self._pending_lock.release()
 
     def _db_item_count(self):
-        app.db.cursor.execute("SELECT COUNT(*) from item")
-        return app.db.cursor.fetchone()[0]
+        return models.Item.select(['COUNT(*)'], convert=False,
+                reporting=True)[0][0]
 
     def _failsafe_load(self):
         """Load ItemInfos using Item objects.
@@ -216,6 +447,7 @@ class ItemInfoCache(signals.SignalEmitter):
 
         This method is optimized to avoid constructing Item objects.
         """
+        self._finish_loading()
         return self.id_to_info.values()
 
     def get_info(self, id_):
@@ -223,6 +455,8 @@ class ItemInfoCache(signals.SignalEmitter):
         try:
             return self.id_to_info[id_]
         except KeyError:
+            if self._ensure_loaded(id_):
+                return self.id_to_info[id_]
             app.controller.failed_soft("getting item info",
                     "KeyError: %d" % id_, with_exception=True)
             item = models.Item.get_by_id(id_)
@@ -246,10 +480,11 @@ class ItemInfoCache(signals.SignalEmitter):
             # signal_change() called in Item.setup_restored(), while we were
             # doing a failsafe load
             return
-        if item.id not in self.id_to_info:
+        if not self._discard_pending(item.id):
             # signal_change() called inside setup_new(), just ignor it
             return
-        info = itemsource.DatabaseItemSource._item_info_for(item)
+        info = itemsource.DatabaseItemSource._item_info_for(item,
+                self.id_to_info.get(item.id))
         self.id_to_info[item.id] = info
         if item.id in self._infos_added:
             # no need to update if we insert the new values
@@ -265,6 +500,7 @@ class ItemInfoCache(signals.SignalEmitter):
             # doing a failsafe load
             del self.id_to_info[item.id]
             return
+        self._ensure_loaded(item.id)
         info = self.id_to_info.pop(item.id)
 
         if item.id in self._infos_added:
@@ -141,7 +141,7 @@ class DatabaseItemSource(ItemSource):
     # bump this whenever you change the ItemInfo class, or change one of the
     # functions that ItemInfo uses to get it's attributes (for example
     # Item.get_description()).
-    VERSION = 33
+    VERSION = 34
 
     def __init__(self, view):
         ItemSource.__init__(self)
@@ -153,7 +153,13 @@ class DatabaseItemSource(ItemSource):
         self.tracker.connect('removed', self._on_tracker_removed)
 
     @staticmethod
-    def _item_info_for(item):
+    def _item_info_for(item, old_info=None):
+        """Build an ItemInfo for item.
+
+        :param old_info: the last ItemInfo we built for item.  If given, the
+                         calculated ItemInfo attributes whose inputs didn't
+                         change are copied from it (see ItemInfo.__init__).
+        """
         info = {
             'feed_id': item.feed_id,
             'feed_name': item.get_source(),
@@ -239,7 +245,7 @@ class DatabaseItemSource(ItemSource):
                 info['up_down_ratio'] = (float(info['up_total']) /
                                               info['down_total'])
 
-        return messages.ItemInfo(item.id, **info)
+        return messages.ItemInfo(item.id, old_info, **info)
 
     def fetch_all(self):
         return [self._get_info(id_) for id_ in self.view]
@@ -511,7 +517,7 @@ class SharingItemHandler(ItemHandler):
         if info.is_playing != is_playing:
             # modifying the ItemInfo in-place messes up the Tracker's
             # object-changed logic, so make a copy
-            info = messages.ItemInfo(info.id, **info.__dict__)
+            info = messages.ItemInfo(info.id, **info.as_dict())
             info.is_playing = is_playing
             info.item_source.emit("changed", info)
 
@@ -720,7 +726,7 @@ class DeviceItemHandler(ItemHandler):
             # object-changed logic, so make a copy
             info_cache = app.device_manager.info_cache[info.device.mount]
             info = info_cache[info.id] = messages.ItemInfo(
-                info.id, **info.__dict__)
+                info.id, **info.as_dict())
             database = info.device.database
             info.is_playing = is_playing
             database[info.file_type][info.id][u'is_playing'] = is_playing
@@ -30,6 +30,7 @@
 """``miro.messagehandler``` -- Backend message handler
 """
 
+import collections
 import logging
 import time
 import os
@@ -118,11 +119,18 @@ class ViewTracker(object):
         for obj in changed:
             info = self.info_factory(obj)
             if (obj.id not in self._last_sent_info or
-                info.__dict__ != self._last_sent_info[obj.id].__dict__):
+                self._info_attributes(info) !=
+                self._info_attributes(self._last_sent_info[obj.id])):
                 retval.append(info)
                 self._last_sent_info[obj.id] = info
         return retval
 
+    def _info_attributes(self, info):
+        """Get the attributes of an info object, so we can check if it
+        changed.
+        """
+        return info.__dict__
+
     def _make_removed_list(self, removed_set):
         for id_ in removed_set:
             del self._last_sent_info[id_]
@@ -344,6 +352,32 @@ class SourceTrackerBase(ViewTracker):
     def __init__(self):
         ViewTracker.__init__(self)
         self.sent_initial_list = False
+        self.sort_key = None
+        self.sort_reverse = False
+
+    def set_sort(self, sort_key, reverse):
+        """Set how the frontend sorts our items (see messages.TrackItems).
+        """
+        self.sort_key = sort_key
+        self.sort_reverse = reverse
+
+    def reset_changes(self):
+        ViewTracker.reset_changes(self)
+        # maps ids to the attributes that changed for items in our next
+        # ItemsChanged message
+        self.changed_fields = {}
+
+    def _make_changed_list(self, changed):
+        retval = []
+        for info in changed:
+            if info.id in self._last_sent_info:
+                fields = info.diff(self._last_sent_info[info.id])
+                if not fields:
+                    continue
+                self.changed_fields[info.id] = fields
+            retval.append(info)
+            self._last_sent_info[info.id] = info
+        return retval
 
     def get_sources(self):
         return [self.source]
@@ -365,17 +399,97 @@ class SourceTrackerBase(ViewTracker):
 
     def make_changed_message(self, added, changed, removed):
         return messages.ItemsChanged(self.type, self.id, added, changed,
-                                     removed)
+                                     removed, self.changed_fields)
 
     def send_messages(self):
         ViewTracker.send_messages(self)
 
 class DatabaseSourceTrackerBase(SourceTrackerBase):
+    # Number of items to send in the ItemList message.  The rest get sent in
+    # pages from idle callbacks as ItemsChanged messages, so that opening a
+    # huge view doesn't stall the frontend adding them all at once.  We only
+    # do this if we know the frontend's sort, so that the first page is what
+    # it displays first.  None sends the entire list at once.
+    page_size = 500
+
+    def __init__(self):
+        # ids of items that we haven't sent yet, in the order we will send
+        # them.  The set is used for lookups and to skip ids that were
+        # removed before we got to them.
+        self._pending_order = collections.deque()
+        self._pending_ids = set()
+        self._page_callback = None
+        SourceTrackerBase.__init__(self)
 
     def get_sources(self):
         return [itemsource.DatabaseItemSource(view) for view in
                 self.get_object_views()]
 
+    def send_initial_list(self):
+        self._cancel_pages()
+        if self.page_size is None or self.sort_key is None:
+            SourceTrackerBase.send_initial_list(self)
+            return
+        infos = []
+        for source in self.trackers:
+            infos.extend(source.fetch_all())
+        infos.sort(key=self.sort_key, reverse=self.sort_reverse)
+        self._pending_order.extend(info.id for info in
+                infos[self.page_size:])
+        self._pending_ids.update(self._pending_order)
+        infos = infos[:self.page_size]
+        self._last_sent_info.update([(info.id, info) for info in infos])
+        messages.ItemList(self.type, self.id, infos).send_to_frontend()
+        self.sent_initial_list = True
+        if self._pending_order:
+            self._schedule_next_page()
+
+    def _schedule_next_page(self):
+        self._page_callback = eventloop.add_idle(self._send_next_page,
+                'send item list page')
+
+    def _cancel_pages(self):
+        if self._page_callback is not None:
+            self._page_callback.cancel()
+            self._page_callback = None
+        self._pending_order.clear()
+        self._pending_ids.clear()
+
+    def _send_next_page(self):
+        self._page_callback = None
+        count = 0
+        while self._pending_order and count < self.page_size:
+            id_ = self._pending_order.popleft()
+            if id_ not in self._pending_ids:
+                # removed while it was waiting
+                continue
+            self._pending_ids.remove(id_)
+            # the infos go out in the next ItemsChanged message, along with
+            # any other changes that are pending.
+            self.on_object_added(None,
+                    itemsource.DatabaseItemSource.get_by_id(id_))
+            count += 1
+        if self._pending_order:
+            self._schedule_next_page()
+
+    def on_object_changed(self, tracker, obj):
+        if obj.id in self._pending_ids:
+            # we'll fetch the up-to-date info when we send its page
+            return
+        SourceTrackerBase.on_object_changed(self, tracker, obj)
+
+    def on_object_id_removed(self, tracker, id_):
+        if id_ in self._pending_ids:
+            # the frontend never saw this item, so don't tell it about the
+            # removal
+            self._pending_ids.remove(id_)
+            return
+        SourceTrackerBase.on_object_id_removed(self, tracker, id_)
+
+    def unlink(self):
+        self._cancel_pages()
+        SourceTrackerBase.unlink(self)
+
     def get_object_views(self):
         return [self.view]
 
@@ -445,7 +559,8 @@ class ManualItemTracker(DatabaseSourceTrackerBase):
         removed = self._make_removed_list(removed_set)
         if changed or removed:
             messages.ItemsChanged(self.type, self.id, [], changed,
-                    removed).send_to_frontend()
+                    removed, self.changed_fields).send_to_frontend()
+            self.changed_fields = {}
         self.sent_initial_list = True
 
     def get_object_views(self):
@@ -460,6 +575,9 @@ class DownloadingItemsTracker(DatabaseSourceTrackerBase):
 
 class SharingBackendItemsTracker(DatabaseSourceTrackerBase):
     type = u'sharing-backend'
+    # the sharing server builds its database from the initial list
+    page_size = None
+
     def __init__(self, id_):
         self.id = id_
         if self.id is None:
@@ -1316,6 +1434,8 @@ New ids: %s""", playlist_item_ids, message.item_ids)
             self.item_trackers[key] = item_tracker
         else:
             item_tracker = self.item_trackers[key]
+        if isinstance(message, messages.TrackItems):
+            item_tracker.set_sort(message.sort_key, message.reverse)
         item_tracker.send_initial_list()
 
     def handle_track_items_manually(self, message):
@@ -1896,6 +2016,9 @@ New ids: %s""", playlist_item_ids, message.item_ids)
             fi.genre = item_info.genre
             fi.signal_change()
 
+    def handle_dump_event_loop_stats(self, message):
+        eventloop.dump_call_stats(message.path)
+
     def handle_force_feedparser_processing(self, message):
         # For all our RSS feeds, force an update
         for f in feed.Feed.make_view():
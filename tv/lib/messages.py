@@ -40,6 +40,7 @@ This module defines the messages that are passed between the two threads.
 """
 
 import logging
+import threading
 
 from miro.gtcache import gettext as _
 from miro.folder import ChannelFolder, PlaylistFolder
@@ -145,10 +146,17 @@ class TrackItems(BackendMessage):
 
     id should be the id of a feed/playlist. For new, downloading and library
     it is ignored.
+
+    sort_key and reverse tell the backend how the frontend sorts the items.
+    If sort_key is given, the backend can send the initial list in pages,
+    starting with the items that sort first.  sort_key gets called in the
+    backend thread, so it should only look at the ItemInfo that it's passed.
     """
-    def __init__(self, typ, id_):
+    def __init__(self, typ, id_, sort_key=None, reverse=False):
         self.type = typ
         self.id = id_
+        self.sort_key = sort_key
+        self.reverse = reverse
 
 class TrackItemsManually(BackendMessage):
     """Track a manually specified list of items.
@@ -898,6 +906,12 @@ class ForceFeedparserProcessing(BackendMessage):
     """
     pass
 
+class DumpEventLoopStats(BackendMessage):
+    """Write out timing stats for the backend event loop's callbacks
+    """
+    def __init__(self, path):
+        self.path = path
+
 # Frontend Messages
 
 class JettisonTabs(FrontendMessage):
@@ -1166,55 +1180,116 @@ class ItemInfo(object):
     :param has_drm: True/False if known; None if unknown (usually means no)
     """
 
-    html_stripper = util.HTMLStripper()
+    # We keep an ItemInfo around for every item, so we use __slots__ to save
+    # memory.  If you add an attribute, it needs to go in attribute_names.
+    attribute_names = (
+        # set by the item sources
+        'id', 'feed_id', 'feed_name', 'feed_url', 'state', 'release_date',
+        'size', 'duration', 'resume_time', 'permalink', 'commentslink',
+        'payment_link', 'has_shareable_url', 'can_be_saved',
+        'pending_manual_dl', 'pending_auto_dl', 'item_viewed', 'downloaded',
+        'is_external', 'video_watched', 'video_path', 'thumbnail',
+        'thumbnail_url', 'file_format', 'license', 'file_url',
+        'is_container_item', 'is_playable', 'file_type', 'subtitle_encoding',
+        'media_type_checked', 'seeding_status', 'mime_type', 'date_added',
+        'last_played', 'last_watched', 'downloaded_time', 'children',
+        'expiration_date', 'download_info', 'leechers', 'seeders',
+        'connections', 'up_rate', 'down_rate', 'up_total', 'down_total',
+        'up_down_ratio', 'remote', 'device', 'source_type', 'play_count',
+        'skip_count', 'auto_rating', 'is_playing', 'item_source', 'host',
+        'port',
+        # metadata
+        'name', 'title_tag', 'description', 'album', 'album_artist',
+        'artist', 'track', 'album_tracks', 'year', 'genre', 'rating',
+        'cover_art', 'has_drm', 'show', 'episode_id', 'episode_number',
+        'season_number', 'kind', 'metadata_version', 'mdp_state',
+        # calculated in __init__
+        'description_stripped', 'search_ngrams', 'name_sort_key',
+        'album_sort_key', 'artist_sort_key', 'album_artist_sort_key',
+        'description_oneline', 'display_date', 'display_duration',
+        'display_duration_short', 'display_size', 'display_date_added',
+        'display_last_played', 'display_track', 'display_year',
+        'display_torrent_details', 'display_drm', 'display_kind',
+        'display_eta', 'display_rate',
+    )
+    __slots__ = attribute_names + ('__weakref__',)
+
+    # string attributes that many ItemInfos share the same values for.  We
+    # make all of those ItemInfos reference the same string object.  The
+    # interned strings are never freed, so only list attributes that have a
+    # small, fixed set of values here, not things like artist or feed names.
+    interned_attribute_names = (
+        'state', 'file_format', 'file_type', 'mime_type', 'seeding_status',
+        'source_type', 'subtitle_encoding', 'kind',
+    )
 
     def __repr__(self):
         return "<ItemInfo %r>" % self.id
 
     def __getstate__(self):
-        d = self.__dict__.copy()
+        d = self.as_dict()
         d['device'] = None
         del d['description_stripped']
         del d['search_ngrams']
         return d
 
     def __setstate__(self, d):
-        self.__dict__.update(d)
-        self.description_stripped = ItemInfo.html_stripper.strip(
-                self.description)
-        self.search_ngrams = search.calc_ngrams(self)
-
-    def __init__(self, id_, **kwargs):
+        for name, value in d.iteritems():
+            setattr(self, name, value)
+        self.calc_search_data()
+
+    def __init__(self, id_, old_info=None, **kwargs):
+        """Create an ItemInfo
+
+        :param id_: object id
+        :param old_info: ItemInfo for the same item that this one replaces.
+                         Calculated attributes whose inputs are the same as in
+                         old_info get copied from it rather than recalculated.
+        :param kwargs: values for the attributes set by the item sources
+        """
         self.id = id_
 
-        self.__dict__.update(kwargs) # we're just a thin wrapper around some
-                                     # data
+        # we're just a thin wrapper around some data
+        for name, value in kwargs.iteritems():
+            setattr(self, name, value)
+        self.intern_strings()
 
         # stuff we can calculate from other attributes
         if not hasattr(self, 'description_stripped'):
-            self.description_stripped = ItemInfo.html_stripper.strip(
-                self.description)
+            self._copy_or_calc(old_info, 'description_stripped',
+                    'description', _strip_html)
         if not hasattr(self, 'search_ngrams'):
-            self.search_ngrams = search.calc_ngrams(self)
-        self.name_sort_key = util.name_sort_key(self.name)
-        self.album_sort_key = util.name_sort_key(self.album)
-        self.artist_sort_key = util.name_sort_key(self.artist)
+            self.search_ngrams = search.calc_ngrams(self, old_info)
+        self._copy_or_calc(old_info, 'name_sort_key', 'name',
+                util.name_sort_key)
+        self._copy_or_calc(old_info, 'album_sort_key', 'album',
+                util.name_sort_key)
+        self._copy_or_calc(old_info, 'artist_sort_key', 'artist',
+                util.name_sort_key)
         if self.album_artist:
-            self.album_artist_sort_key = util.name_sort_key(self.album_artist)
+            self._copy_or_calc(old_info, 'album_artist_sort_key',
+                    'album_artist', util.name_sort_key)
         else:
             self.album_artist_sort_key = self.artist_sort_key
         # pre-calculate things that get displayed in list view
         self.description_oneline = (
                 self.description_stripped[0].replace('\n', '$'))
-        self.display_date = displaytext.date_slashes(self.release_date)
-        self.display_duration = displaytext.duration(self.duration)
-        self.display_duration_short = displaytext.short_time_string(
-                self.duration)
-        self.display_size = displaytext.size_string(self.size)
-        self.display_date_added = displaytext.date_slashes(self.date_added)
-        self.display_last_played = displaytext.date_slashes(self.last_played)
-        self.display_track = displaytext.integer(self.track)
-        self.display_year = displaytext.integer(self.year)
+        self._copy_or_calc(old_info, 'display_date', 'release_date',
+                displaytext.date_slashes)
+        self._copy_or_calc(old_info, 'display_duration', 'duration',
+                displaytext.duration)
+        self._copy_or_calc(old_info, 'display_duration_short', 'duration',
+                displaytext.short_time_string)
+        self._copy_or_calc(old_info, 'display_size', 'size',
+                displaytext.size_string)
+        self._copy_or_calc(old_info, 'display_date_added', 'date_added',
+                displaytext.date_slashes)
+        self._copy_or_calc(old_info, 'display_last_played', 'last_played',
+                displaytext.date_slashes)
+        self._copy_or_calc(old_info, 'display_track', 'track',
+                displaytext.integer)
+        self._copy_or_calc(old_info, 'display_year', 'year',
+                displaytext.integer)
         self.display_torrent_details = self.calc_torrent_details()
         self.display_drm = self.has_drm and _("Locked") or u""
         # FIXME: display_kind changes here need also be applied in itemedit
@@ -1239,6 +1314,58 @@ class ItemInfo(object):
         else:
             self.display_rate = self.display_eta = ''
 
+    def _copy_or_calc(self, old_info, name, input_name, func):
+        """Set an attribute that's calculated from another attribute.
+
+        If old_info has the same value for input_name as we do, copy the
+        attribute from it.  Otherwise calculate it with func.
+        """
+        value = getattr(self, input_name)
+        if old_info is not None and getattr(old_info, input_name) == value:
+            setattr(self, name, getattr(old_info, name))
+        else:
+            setattr(self, name, func(value))
+
+    def as_dict(self):
+        """Get a dict that maps attribute names to values.
+
+        ItemInfo uses __slots__, so use this instead of __dict__.
+        """
+        d = {}
+        for name in ItemInfo.attribute_names:
+            try:
+                d[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return d
+
+    def diff(self, other):
+        """Get the names of the attributes that differ between this
+        ItemInfo and other.
+
+        :returns: set of attribute names
+        """
+        return set(name for name in ItemInfo.attribute_names
+                   if getattr(self, name, None) != getattr(other, name, None))
+
+    def calc_search_data(self):
+        """Calculate description_stripped and search_ngrams.
+
+        These take up a lot of space, so we don't save them in the item info
+        cache.
+        """
+        self.description_stripped = _strip_html(self.description)
+        self.search_ngrams = search.calc_ngrams(self)
+
+    def intern_strings(self):
+        """Make our shared string attributes reference the canonical copy of
+        their value.
+        """
+        for name in ItemInfo.interned_attribute_names:
+            value = getattr(self, name, None)
+            if value is not None:
+                setattr(self, name, intern_string(value))
+
     def calc_torrent_details(self):
         if not self.download_info or not self.download_info.torrent:
             return ''
@@ -1260,6 +1387,37 @@ class ItemInfo(object):
              "ratio": self.up_down_ratio})
         return details
 
+_thread_local = threading.local()
+
+def _strip_html(text):
+    """Strip HTML from text.
+
+    HTMLStripper isn't threadsafe and ItemInfos get created outside the
+    backend thread (see ItemInfoCache), so each thread gets its own.
+    """
+    try:
+        html_stripper = _thread_local.html_stripper
+    except AttributeError:
+        html_stripper = _thread_local.html_stripper = util.HTMLStripper()
+    return html_stripper.strip(text)
+
+_interned_strings = {}
+
+def intern_string(value):
+    """Get the canonical copy of a string.
+
+    This is like the intern() builtin, but it also works for unicode.  The
+    canonical copies are never freed, so only use this for strings that
+    have a small number of different values.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return intern(value)
+    elif value_type is unicode:
+        return _interned_strings.setdefault(value, value)
+    else:
+        return value
+
 class DownloadInfo(object):
     """Tracks the download state of an item.
 
@@ -1290,6 +1448,15 @@ class DownloadInfo(object):
             self.short_reason_failed = u""
         self.eta = downloader.get_eta()
 
+    def __eq__(self, other):
+        # compare by value, so that ItemInfo.diff() only reports
+        # download_info when something about the download changed
+        return (isinstance(other, DownloadInfo) and
+                self.__dict__ == other.__dict__)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
 class PendingDownloadInfo(DownloadInfo):
     """DownloadInfo object for pending downloads (downloads queued,
     but not started because we've reached some limit)
@@ -1446,13 +1613,21 @@ class ItemsChanged(FrontendMessage):
                   The order will be the order they were added.
     :param changed: set containing an ItemInfo for each changed item.
     :param removed: set containing ids for each item that was removed
+    :param changed_fields: dict mapping the ids of changed items to the set
+                           of ItemInfo attribute names that changed.  Items
+                           without an entry should be treated as if every
+                           attribute changed.
     """
-    def __init__(self, typ, id_, added, changed, removed):
+    def __init__(self, typ, id_, added, changed, removed,
+                 changed_fields=None):
         self.type = typ
         self.id = id_
         self.added = added
         self.changed = changed
         self.removed = removed
+        if changed_fields is None:
+            changed_fields = {}
+        self.changed_fields = changed_fields
 
     def __str__(self):
         return ('<miro.messages.ItemsChanged %s:%s '
@@ -37,6 +37,7 @@ This class also defines the base Exception classes used by httpclient.
 
 """
 
+import collections
 import errno
 import logging
 import socket
@@ -113,40 +114,93 @@ def trap_call(object, function, *args, **kwargs):
 
 class NetworkBuffer(object):
     """Responsible for storing incomming network data and doing some basic
-    parsing of it.  I think this is about as fast as we can do things in pure
-    python, someday we may want to make it C...
+    parsing of it.
+
+    Data is stored as a deque of the chunks that were added, plus an offset
+    into the first chunk.  Reading only copies the bytes that are returned,
+    so the cost of a read doesn't depend on how much data is buffered.
     """
     def __init__(self):
-        self.chunks = []
+        self.chunks = collections.deque()
+        # bytes of chunks[0] that have already been read
+        self.offset = 0
         self.length = 0
+        # number of chunks at the start of the buffer that we know don't
+        # contain a newline.  This keeps readline() from re-scanning data
+        # when it's called repeatedly while a line is coming in.
+        self._scanned_chunks = 0
 
     def addData(self, data):
-        self.chunks.append(data)
-        self.length += len(data)
-
-    def _mergeChunks(self):
-        self.chunks = [''.join(self.chunks)]
+        if data:
+            self.chunks.append(data)
+            self.length += len(data)
 
     def has_data(self):
         return self.length > 0
 
     def discard_data(self):
-        self.chunks = []
+        self.chunks.clear()
+        self.offset = 0
         self.length = 0
+        self._scanned_chunks = 0
+
+    def _take(self, size, consume=True):
+        """Get size bytes from the start of the buffer.
+
+        size must be <= self.length.
+        """
+        parts = []
+        remaining = size
+        offset = self.offset
+        for chunk in self.chunks:
+            if remaining <= 0:
+                break
+            available = len(chunk) - offset
+            if available <= remaining:
+                if offset:
+                    parts.append(chunk[offset:])
+                else:
+                    parts.append(chunk)
+                remaining -= available
+            else:
+                parts.append(chunk[offset:offset+remaining])
+                remaining = 0
+            offset = 0
+        if len(parts) == 1:
+            rv = parts[0]
+        else:
+            rv = ''.join(parts)
+        if consume:
+            self._skip(size)
+        return rv
+
+    def _skip(self, size):
+        """Drop size bytes from the start of the buffer."""
+        self.length -= size
+        while size > 0:
+            available = len(self.chunks[0]) - self.offset
+            if available <= size:
+                self.chunks.popleft()
+                self.offset = 0
+                self._scanned_chunks = max(0, self._scanned_chunks - 1)
+                size -= available
+            else:
+                self.offset += size
+                size = 0
 
     def read(self, size=None):
         """Read at most size bytes from the data that has been added to the
         buffer.  """
 
-        self._mergeChunks()
-        if size is not None:
-            rv = self.chunks[0][:size]
-            self.chunks[0] = self.chunks[0][len(rv):]
-        else:
-            rv = self.chunks[0]
-            self.chunks = []
-        self.length -= len(rv)
-        return rv
+        if size is None or size > self.length:
+            size = self.length
+        return self._take(size)
+
+    def peek(self, size=None):
+        """Like read(), but leave the data in the buffer."""
+        if size is None or size > self.length:
+            size = self.length
+        return self._take(size, consume=False)
 
     def readline(self):
         """Like a file readline, with several difference:  
@@ -155,28 +209,50 @@ class NetworkBuffer(object):
         * Both "\r\n" and "\n" act as a line ender
         """
 
-        self._mergeChunks()
-        split = self.chunks[0].split("\n", 1)
-        if len(split) == 2:
-            self.chunks[0] = split[1]
-            self.length = len(self.chunks[0])
-            if split[0].endswith("\r"):
-                return split[0][:-1]
+        line_length = 0
+        for i, chunk in enumerate(self.chunks):
+            if i == 0:
+                start = self.offset
             else:
-                return split[0]
+                start = 0
+            if i >= self._scanned_chunks:
+                pos = chunk.find("\n", start)
+                if pos >= 0:
+                    line_length += pos - start
+                    break
+                self._scanned_chunks = i + 1
+            line_length += len(chunk) - start
         else:
             return None
+        line = self._take(line_length)
+        self._skip(1)
+        if line.endswith("\r"):
+            return line[:-1]
+        else:
+            return line
 
     def unread(self, data):
         """Put back read data.  This make is like the data was never read at
         all.
         """
-        self.chunks.insert(0, data)
+        if not data:
+            return
+        if self.offset:
+            self.chunks[0] = self.chunks[0][self.offset:]
+            self.offset = 0
+        self.chunks.appendleft(data)
         self.length += len(data)
+        self._scanned_chunks = 0
 
     def getValue(self):
-        self._mergeChunks()
-        return self.chunks[0]
+        value = self.peek()
+        # store the value as a single chunk, so the next call is fast
+        self.chunks = collections.deque()
+        if value:
+            self.chunks.append(value)
+        self.offset = 0
+        self._scanned_chunks = 0
+        return value
 
 class _Packet(object):
     """A packet of data for the AsyncSocket class
@@ -327,7 +403,7 @@ class AsyncSocket(object):
             self.connectionErrback = None
         eventloop.call_in_thread(onAddressLookup, handleGetAddrInfoException,
                                  socket.getaddrinfo,
-                                 "getAddrInfo - %s:%s" % (host, port),
+                                 "getAddrInfo (%s:%s)" % (host, port),
                                  host, port)
 
     def accept_connection(self, family, host, port, callback, errback):
@@ -125,6 +125,36 @@ PODCASTS_DEFAULT_VIEW       = Pref(key='podcastsDefaultView', default=0, platfor
 # This doesn't need to be defined on the platform, but it can be overridden there if the platform wants to.
 SHOW_ERROR_DIALOG           = Pref(key='showErrorDialog',       default=True,  platformSpecific=True)
 
+# SQLite tuning.  WAL journaling is opt-in.  When it's on, checkpoints run
+# every SQLITE_CHECKPOINT_INTERVAL seconds in a separate thread (0 leaves
+# them to sqlite) and heavy read-only queries use a second connection.
+SQLITE_WAL_MODE = \
+    Pref(key='sqliteWALMode', default=False, platformSpecific=False)
+SQLITE_SYNCHRONOUS = \
+    Pref(key='sqliteSynchronous', default=u'FULL', platformSpecific=False,
+         possible_values=[u'OFF', u'NORMAL', u'FULL'],
+         failsafe_value=u'FULL')
+SQLITE_CHECKPOINT_INTERVAL = \
+    Pref(key='sqliteCheckpointInterval', default=30, platformSpecific=False)
+
+# How we index items for searching: u'ngram' matches substrings of words,
+# u'fts' uses SQLite full-text search, which matches word prefixes and ranks
+# the results (see searchindex.py)
+SEARCH_INDEX_BACKEND = \
+    Pref(key='searchIndexBackend', default=u'ngram', platformSpecific=False,
+         possible_values=[u'ngram', u'fts'], failsafe_value=u'ngram')
+
+# how many feeds can update at once, overall and from a single host
+FEED_UPDATE_MAX_CONCURRENT = \
+    Pref(key='feedUpdateMaxConcurrent', default=6, platformSpecific=False)
+FEED_UPDATE_MAX_PER_HOST = \
+    Pref(key='feedUpdateMaxPerHost', default=2, platformSpecific=False)
+
+# how many worker processes to run feedparser in.  0 means one for each CPU,
+# up to workerprocess.MAX_DEFAULT_WORKERS.
+WORKER_PROCESS_COUNT = \
+    Pref(key='workerProcessCount', default=0, platformSpecific=False)
+
 # this is the name of the last search engine used
 LAST_SEARCH_ENGINE = \
     Pref(key='LastSearchEngine', default=u"all", platformSpecific=False)
@@ -242,6 +272,10 @@ HTTP_PROXY_AUTHORIZATION_USERNAME = \
     Pref(key='HttpProxyAuthorizationUsername',   default=u"", platformSpecific=True)
 HTTP_PROXY_AUTHORIZATION_PASSWORD = \
     Pref(key='HttpProxyAuthorizationPassword',   default=u"", platformSpecific=True)
+# Number of idle libcurl handles to keep around for each host.  Reusing a
+# handle lets us skip the DNS lookup, TCP connect and TLS handshake.
+HTTP_KEEPALIVE_PER_HOST = \
+    Pref(key='HttpKeepAlivePerHost', default=4, platformSpecific=False)
 
 # These are normally read from resources/app.config.
 SHORT_APP_NAME = \
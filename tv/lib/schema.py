@@ -332,6 +332,10 @@ class ObjectSchema(object):
     * ``table_name`` -- SQL table name to store the class in
     * ``fields`` -- list of (name, SchemaItem) pairs.  One item for
       each attribute that should be stored to disk.
+    * ``lazy_fields`` -- names of fields that aren't restored with the rest
+      of the object.  They get loaded the first time they're accessed.  Use
+      this for large columns that we rarely need.  Fields used by
+      get_ddb_class() can't be lazy.
     """
 
     @classmethod
@@ -343,6 +347,7 @@ class ObjectSchema(object):
         return cls.klass
 
     indexes = ()
+    lazy_fields = ()
 
 class MultiClassObjectSchema(ObjectSchema):
     """ObjectSchema where rows will be restored to different python
@@ -481,6 +486,8 @@ class ItemSchema(MultiClassObjectSchema):
             ('item_file_type', ('file_type',)),
     )
 
+    lazy_fields = ('entry_description', 'description')
+
 class FeedSchema(DDBObjectSchema):
     klass = Feed
     table_name = 'feed'
@@ -517,6 +524,8 @@ class FeedImplSchema(DDBObjectSchema):
         ('thumbURL', SchemaURL(noneOk=True)),
         ('updateFreq', SchemaInt()),
         ('initialUpdate', SchemaBool()),
+        ('last_update_finished', SchemaDateTime(noneOk=True)),
+        ('unchanged_rate', SchemaFloat()),
     ]
 
 class RSSFeedImplSchema(FeedImplSchema):
@@ -526,6 +535,7 @@ class RSSFeedImplSchema(FeedImplSchema):
         ('initialHTML', SchemaBinary(noneOk=True)),
         ('etag', SchemaString(noneOk=True)),
         ('modified', SchemaString(noneOk=True)),
+        ('content_hash', SchemaString(noneOk=True)),
     ]
 
 class SavedSearchFeedImplSchema(FeedImplSchema):
@@ -534,6 +544,7 @@ class SavedSearchFeedImplSchema(FeedImplSchema):
     fields = FeedImplSchema.fields + [
         ('etag', SchemaDict(SchemaString(),SchemaString(noneOk=True))),
         ('modified', SchemaDict(SchemaString(),SchemaString(noneOk=True))),
+        ('content_hash', SchemaDict(SchemaString(),SchemaString())),
     ]
 
     @staticmethod
@@ -544,6 +555,10 @@ class SavedSearchFeedImplSchema(FeedImplSchema):
     def handle_malformed_modified(row):
         return {}
 
+    @staticmethod
+    def handle_malformed_content_hash(row):
+        return {}
+
 class ScraperFeedImplSchema(FeedImplSchema):
     klass = ScraperFeedImpl
     table_name = 'scraper_feed_impl'
@@ -610,6 +625,8 @@ class RemoteDownloaderSchema(DDBObjectSchema):
         ('downloader_state', ('state',)),
     )
 
+    lazy_fields = ('metainfo',)
+
     @staticmethod
     def handle_malformed_status(row):
         return {}
@@ -782,7 +799,7 @@ class ViewStateSchema(DDBObjectSchema):
     def handle_malformed_selection(value):
         return None
 
-VERSION = 160
+VERSION = 163
 object_schemas = [
     IconCacheSchema, ItemSchema, FeedSchema,
     FeedImplSchema, RSSFeedImplSchema, SavedSearchFeedImplSchema,
@@ -31,7 +31,8 @@
 
 To make incremental search fast, we index the n-grams for each item.
 """
-import collections
+import array
+import bisect
 import os
 import re
 
@@ -45,6 +46,7 @@ SLASHKILLER = re.compile(r'\\.')
 WORDMATCHER = re.compile("\w+", re.UNICODE)
 NGRAM_MAX = 5
 SEARCHOBJECTS = {}
+_EMPTY_POSTING = array.array('i')
 
 def _get_boolean_search(search_string):
     if not SEARCHOBJECTS.has_key(search_string):
@@ -113,9 +115,17 @@ def _calc_search_text(item_info):
         match_against.append(filename_to_unicode(filename))
     return (' '.join(match_against)).lower()
 
-def calc_ngrams(item_info):
-    """Get the N-grams that we want to index for a ItemInfo object"""
-    words = WORDMATCHER.findall(_calc_search_text(item_info))
+def calc_ngrams(item_info, old_info=None):
+    """Get the N-grams that we want to index for a ItemInfo object
+
+    If old_info is an ItemInfo with the same search text, we return its
+    N-grams rather than calculating them again.
+    """
+    search_text = _calc_search_text(item_info)
+    if (old_info is not None and
+            _calc_search_text(old_info) == search_text):
+        return old_info.search_ngrams
+    words = WORDMATCHER.findall(search_text)
     return ngrams.breakup_list(words, 1, NGRAM_MAX)
 
 def _ngrams_for_term(term):
@@ -176,64 +186,158 @@ def list_matches(item_infos, search_text):
         if match:
             yield info
 
+def _contains(posting, id_):
+    """Check if a posting list contains an item id."""
+    i = bisect.bisect_left(posting, id_)
+    return i < len(posting) and posting[i] == id_
+
+def _intersect(posting1, posting2):
+    """Intersect 2 posting lists.
+
+    :returns: sorted array containing the ids in both lists
+    """
+    if len(posting1) > len(posting2):
+        posting1, posting2 = posting2, posting1
+    if len(posting1) * 8 < len(posting2):
+        # posting1 is much shorter, binary search for each of its ids.
+        rv = array.array('i')
+        lo = 0
+        hi = len(posting2)
+        for id_ in posting1:
+            lo = bisect.bisect_left(posting2, id_, lo, hi)
+            if lo == hi:
+                break
+            if posting2[lo] == id_:
+                rv.append(id_)
+        return rv
+    else:
+        return array.array('i', sorted(set(posting1).intersection(posting2)))
+
+def _intersect_all(postings):
+    """Intersect a list of posting lists, starting with the shortest."""
+    postings = sorted(postings, key=len)
+    rv = postings[0]
+    for posting in postings[1:]:
+        if not rv:
+            break
+        rv = _intersect(rv, posting)
+    return rv
+
 class ItemSearcher(object):
-    """Index Item objects so that they can be searched quickly """
+    """Index ItemInfo objects so that they can be searched quickly
+
+    We keep an inverted index that maps each N-gram to a posting list: a
+    sorted array of the ids of the items that contain it.  Arrays take up
+    much less room than sets and can be intersected using binary searches.
+
+    Inserting into a sorted array is slow, so changes to a posting list are
+    queued up and merged in the next time that we need it.
+    """
 
     def __init__(self):
-        # map N-grams -> set of item ids
-        self._ngram_map = collections.defaultdict(set)
-        # map item id -> set of N-grams
+        # maps N-grams -> sorted array of item ids
+        self._postings = {}
+        # maps N-grams -> set of item ids to add to/remove from the posting
+        # list
+        self._pending_adds = {}
+        self._pending_removes = {}
+        # map item id -> list of N-grams
         self._ngrams_for_item = {}
 
     def add_item(self, item_info):
         """Add an item info to the index."""
-        self._add_item(item_info)
+        self._add_item(item_info.id, item_info.search_ngrams)
 
     def update_item(self, item_info):
         """Update the index based on an item info changing.
 
         Raises a KeyError if item_info is not currently in the index
         """
-        self._remove_item(item_info.id)
-        self._add_item(item_info)
+        old_ngrams = self._get_item_ngrams(item_info.id)
+        if set(old_ngrams) == set(item_info.search_ngrams):
+            # this happens a lot, for example while an item is downloading.
+            # Just update the reference to the N-gram list.
+            self._ngrams_for_item[item_info.id] = item_info.search_ngrams
+        else:
+            self._remove_item(item_info.id, old_ngrams)
+            self._add_item(item_info.id, item_info.search_ngrams)
 
     def remove_item(self, item_id):
         """Remove an item from the index.
 
         Raises a KeyError if item_info is not currently in the index
         """
-        self._remove_item(item_id)
-
-    def _add_item(self, item_info):
-        for ngram in item_info.search_ngrams:
-            self._ngram_map[ngram].add(item_info.id)
-        self._ngrams_for_item[item_info.id] = set(item_info.search_ngrams)
-
-    def _remove_item(self, item_id):
-        for ngram in self._ngrams_for_item.pop(item_id):
-            self._ngram_map[ngram].discard(item_id)
+        self._remove_item(item_id, self._get_item_ngrams(item_id))
+
+    def _get_item_ngrams(self, item_id):
+        return self._ngrams_for_item[item_id]
+
+    def _add_item(self, item_id, ngram_list):
+        for ngram in ngram_list:
+            try:
+                self._pending_removes[ngram].discard(item_id)
+            except KeyError:
+                pass
+            try:
+                self._pending_adds[ngram].add(item_id)
+            except KeyError:
+                self._pending_adds[ngram] = set([item_id])
+        # Note that we don't copy ngram_list.  It belongs to the ItemInfo, so
+        # this doesn't use any extra memory.
+        self._ngrams_for_item[item_id] = ngram_list
+
+    def _remove_item(self, item_id, ngram_list):
+        for ngram in ngram_list:
+            try:
+                self._pending_adds[ngram].discard(item_id)
+            except KeyError:
+                pass
+            try:
+                self._pending_removes[ngram].add(item_id)
+            except KeyError:
+                self._pending_removes[ngram] = set([item_id])
+        del self._ngrams_for_item[item_id]
+
+    def _get_posting(self, ngram):
+        """Get the posting list for an N-gram.
+
+        Don't modify the array that gets returned.
+        """
+        adds = self._pending_adds.pop(ngram, None)
+        removes = self._pending_removes.pop(ngram, None)
+        posting = self._postings.get(ngram, _EMPTY_POSTING)
+        if adds or removes:
+            ids = set(posting)
+            if removes:
+                ids.difference_update(removes)
+            if adds:
+                ids.update(adds)
+            if ids:
+                posting = self._postings[ngram] = array.array('i',
+                        sorted(ids))
+            else:
+                posting = _EMPTY_POSTING
+                self._postings.pop(ngram, None)
+            self._posting_changed(ngram)
+        return posting
 
-    def _ngrams_for_term(self, term):
-        """Given a term, return a list of N-grams that we should search for.
+    def _posting_changed(self, ngram):
+        """Called when we merge changes into the posting list for ngram."""
+        pass
 
-        If the term is shorter than NGRAM_MAX, this is just the term itself.
-        If it's longer, we split it up into a bunch of N-grams to search for.
-        """
-        if len(term) <= NGRAM_MAX:
-            return [term]
-        else:
-            # Note that we only need to use the longest N-grams, since shorter
-            # N-grams will just be substrings of those.
-            return ngrams.breakup_word(term, NGRAM_MAX, NGRAM_MAX)
+    def _merge_pending_changes(self):
+        """Merge all queued changes into our posting lists."""
+        for ngram in set(self._pending_adds).union(self._pending_removes):
+            self._get_posting(ngram)
 
     def _term_search(self, term):
-        grams = self._ngrams_for_term(term)
-        # note that we need to copy the value from _ngram_map.  We don't want
-        # our calls to intersection_update to change it.
-        rv = set(self._ngram_map[grams[0]])
-        for gram in grams[1:]:
-            rv.intersection_update(self._ngram_map[gram])
-        return rv
+        return _intersect_all([self._get_posting(gram)
+            for gram in _ngrams_for_term(term)])
+
+    def _positive_search(self, parsed_search):
+        """Get the posting list for the positive terms of a search."""
+        return _intersect_all([self._term_search(term)
+            for term in parsed_search.positive_terms])
 
     def search(self, search_text):
         """Search through the index items.
@@ -245,13 +349,32 @@ class ItemSearcher(object):
         parsed_search = _get_boolean_search(search_text)
 
         if parsed_search.positive_terms:
-            first_term = parsed_search.positive_terms[0]
-            matching_ids = self._term_search(first_term)
-            for term in parsed_search.positive_terms[1:]:
-                matching_ids.intersection_update(self._term_search(term))
+            matching_ids = set(self._positive_search(parsed_search))
         else:
             matching_ids = set(self._ngrams_for_item.keys())
 
         for term in parsed_search.negative_terms:
             matching_ids.difference_update(self._term_search(term))
         return matching_ids
+
+    def filter_ids(self, id_list, search_text):
+        """Find which ids in a list match a search.
+
+        This is faster than search() when id_list is small compared to the
+        number of items in the index.  If the search doesn't have any
+        positive terms, then ids for items that aren't in the index match.
+
+        :param id_list: item ids to check
+        :param search_text: search_text to search with
+
+        :returns: list of the ids that match the search
+        """
+        parsed_search = _get_boolean_search(search_text)
+        rv = list(id_list)
+        if parsed_search.positive_terms:
+            posting = self._positive_search(parsed_search)
+            rv = [id_ for id_ in rv if _contains(posting, id_)]
+        for term in parsed_search.negative_terms:
+            posting = self._term_search(term)
+            rv = [id_ for id_ in rv if not _contains(posting, id_)]
+        return rv
@@ -0,0 +1,727 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2005, 2006, 2007, 2008, 2009, 2010, 2011
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""``miro.searchindex`` -- Search index for all items in the database.
+
+Rather than having each item list build its own search index, we keep one
+index for all database items and share it between them.  The index is
+saved to disk, so we don't have to rebuild it when Miro starts.
+
+There are 2 kinds of indexes, the SEARCH_INDEX_BACKEND pref selects which
+one we use (see create_search_index()).  Both support the same methods:
+
+    load() -- load the index and start tracking item changes
+    save() -- save any changes to disk
+    close() -- save the index and release any resources it uses
+    search(search_text) -- get the set of item ids that match a search
+    filter_ids(id_list, search_text) -- get the ids from id_list that match
+    search_ranked(search_text, offset, limit, id_list) -- get a page of
+        matching ids, with the best matches first
+
+RANKS_RESULTS tells whether search_ranked() really knows which matches are
+best.
+
+SearchIndex is an N-gram index that matches the same items as
+search.item_matches().  It's stored in the main database, using 2 tables:
+
+    search_index_posting -- maps each N-gram to the ids of the items that
+        contain it
+    search_index_item -- maps each item id to its N-grams.  We only need
+        these when an item changes, so we read them as needed.
+
+FTSSearchIndex uses SQLite full-text search.  It matches word prefixes
+rather than any part of a word, but ranks its results and doesn't need to
+keep anything in memory.  It's stored in a separate database file, so that
+the frontend can search it using its own connection.
+
+Like the item_info_cache table, if the data looks wrong, or if the DB
+version changes, we throw it away and rebuild it.
+"""
+
+import array
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from miro import app
+from miro import eventloop
+from miro import models
+from miro import prefs
+from miro import search
+from miro.plat.utils import filename_to_unicode
+
+def create_search_index():
+    """Create the search index that the SEARCH_INDEX_BACKEND pref asks for.
+    """
+    if app.config.get(prefs.SEARCH_INDEX_BACKEND) == u'fts':
+        if find_fts_module() is not None:
+            return FTSSearchIndex()
+        logging.warn("SQLite full-text search not available, using N-gram "
+                "search index")
+    return SearchIndex()
+
+def _page(id_list, offset, limit):
+    """Slice a page out of a list of ids for search_ranked()."""
+    if limit is None:
+        return id_list[offset:]
+    else:
+        return id_list[offset:offset+limit]
+
+def _posting_to_blob(posting):
+    if sys.byteorder == 'big':
+        posting = array.array('i', posting)
+        posting.byteswap()
+    return buffer(posting.tostring())
+
+def _blob_to_posting(blob):
+    posting = array.array('i')
+    posting.fromstring(str(blob))
+    if sys.byteorder == 'big':
+        posting.byteswap()
+    return posting
+
+class SearchIndex(search.ItemSearcher):
+    """Index all database items so that they can be searched.
+
+    SearchIndex connects to app.item_info_cache's signals to stay up to date.
+
+    The backend updates the index, but the frontend searches it, so the
+    public methods are protected by a lock.
+    """
+
+    # how often should we save the index to the DB? (in seconds)
+    SAVE_INTERVAL = 30
+    VERSION_KEY = 'search_index_db_version'
+    # Version of the format we use to store the index.  Bump this if you
+    # change it.
+    FORMAT_VERSION = 1
+    # we don't know which matches are better than others
+    RANKS_RESULTS = False
+
+    def __init__(self):
+        search.ItemSearcher.__init__(self)
+        self._lock = threading.Lock()
+        self._save_dc = None
+        self._callback_handles = []
+        self._reset_changes()
+
+    def _reset_changes(self):
+        self._changed_ngrams = set()
+        self._changed_items = set()
+        self._deleted_items = set()
+
+    def version(self):
+        return "%s-%s-%s" % (app.item_info_cache.version(), search.NGRAM_MAX,
+                self.FORMAT_VERSION)
+
+    def load(self):
+        """Load the index and start tracking changes to items.
+
+        Call this after app.item_info_cache is loaded.
+        """
+        try:
+            loaded = self._quick_load()
+        except StandardError, e:
+            logging.warn("Error loading search index: %s", e)
+            loaded = False
+        if not loaded:
+            self._rebuild()
+        app.db.set_variable(self.VERSION_KEY, self.version())
+        cache = app.item_info_cache
+        self._callback_handles = [
+            cache.connect('added', self._on_info_added),
+            cache.connect('changed', self._on_info_changed),
+            cache.connect('removed', self._on_info_removed),
+        ]
+
+    def disconnect(self):
+        for handle in self._callback_handles:
+            app.item_info_cache.disconnect(handle)
+        self._callback_handles = []
+
+    def _quick_load(self):
+        """Load the index from the DB.
+
+        :returns: True if the data we loaded was good
+        """
+        try:
+            saved_version = app.db.get_variable(self.VERSION_KEY)
+        except KeyError:
+            # we haven't saved the index yet
+            return False
+        if saved_version != self.version():
+            return False
+        app.db.cursor.execute("SELECT id FROM search_index_item")
+        item_ids = [row[0] for row in app.db.cursor.fetchall()]
+        if len(item_ids) != self._db_item_count():
+            return False
+        app.db.cursor.execute("SELECT ngram, item_ids "
+                "FROM search_index_posting")
+        postings = {}
+        for ngram, blob in app.db.cursor:
+            postings[ngram] = _blob_to_posting(blob)
+        self._postings = postings
+        # we read the N-grams for each item as needed, see _get_item_ngrams()
+        self._ngrams_for_item = dict.fromkeys(item_ids)
+        return True
+
+    def _db_item_count(self):
+        return models.Item.select(['COUNT(*)'], convert=False,
+                reporting=True)[0][0]
+
+    def _rebuild(self):
+        """Rebuild the index using app.item_info_cache."""
+        logging.info("Rebuilding search index")
+        search.ItemSearcher.__init__(self)
+        self._reset_changes()
+        app.db.cursor.execute("DELETE FROM search_index_posting")
+        app.db.cursor.execute("DELETE FROM search_index_item")
+        for info in app.item_info_cache.all_infos():
+            self._add_item(info.id, info.search_ngrams)
+        self._merge_pending_changes()
+        self.schedule_save_to_db()
+
+    def _get_item_ngrams(self, item_id):
+        ngram_list = self._ngrams_for_item[item_id]
+        if ngram_list is None:
+            app.db.cursor.execute("SELECT ngrams FROM search_index_item "
+                    "WHERE id=?", (item_id,))
+            row = app.db.cursor.fetchone()
+            if row is None:
+                raise KeyError(item_id)
+            ngram_list = self._ngrams_for_item[item_id] = row[0].split()
+        return ngram_list
+
+    def _add_item(self, item_id, ngram_list):
+        search.ItemSearcher._add_item(self, item_id, ngram_list)
+        self._deleted_items.discard(item_id)
+        self._changed_items.add(item_id)
+        self.schedule_save_to_db()
+
+    def _remove_item(self, item_id, ngram_list):
+        search.ItemSearcher._remove_item(self, item_id, ngram_list)
+        self._changed_items.discard(item_id)
+        self._deleted_items.add(item_id)
+        self.schedule_save_to_db()
+
+    def _posting_changed(self, ngram):
+        self._changed_ngrams.add(ngram)
+
+    def add_item(self, item_info):
+        self._lock.acquire()
+        try:
+            search.ItemSearcher.add_item(self, item_info)
+        finally:
+            self._lock.release()
+
+    def update_item(self, item_info):
+        self._lock.acquire()
+        try:
+            search.ItemSearcher.update_item(self, item_info)
+        finally:
+            self._lock.release()
+
+    def remove_item(self, item_id):
+        self._lock.acquire()
+        try:
+            search.ItemSearcher.remove_item(self, item_id)
+        finally:
+            self._lock.release()
+
+    def search(self, search_text):
+        self._lock.acquire()
+        try:
+            return search.ItemSearcher.search(self, search_text)
+        finally:
+            self._lock.release()
+
+    def filter_ids(self, id_list, search_text):
+        self._lock.acquire()
+        try:
+            return search.ItemSearcher.filter_ids(self, id_list, search_text)
+        finally:
+            self._lock.release()
+
+    def search_ranked(self, search_text, offset=0, limit=None, id_list=None):
+        """Get a page of ids for items that match a search.
+
+        We don't know anything about relevance, so newer items come first.
+
+        :param id_list: if given, only return ids from this list
+        """
+        if id_list is None:
+            matches = self.search(search_text)
+        else:
+            matches = self.filter_ids(id_list, search_text)
+        return _page(sorted(matches, reverse=True), offset, limit)
+
+    def _on_info_added(self, cache, info):
+        self.add_item(info)
+
+    def _on_info_changed(self, cache, info):
+        try:
+            self.update_item(info)
+        except KeyError:
+            app.controller.failed_soft("updating search index",
+                    "Tried to update item not in index: %s" % info.id,
+                    with_exception=True)
+            self.add_item(info)
+
+    def _on_info_removed(self, cache, info):
+        try:
+            self.remove_item(info.id)
+        except KeyError:
+            app.controller.failed_soft("updating search index",
+                    "Tried to remove item not in index: %s" % info.id,
+                    with_exception=True)
+
+    def schedule_save_to_db(self):
+        if self._save_dc is None:
+            self._save_dc = eventloop.add_timeout(self.SAVE_INTERVAL,
+                    self.save, 'save search index')
+
+    def save(self):
+        if self._save_dc is not None:
+            self._save_dc.cancel()
+            self._save_dc = None
+        # calculate the rows while holding the lock, but write them after we
+        # release it so we don't block searches.
+        self._lock.acquire()
+        try:
+            self._merge_pending_changes()
+            posting_rows = []
+            deleted_ngrams = []
+            for ngram in self._changed_ngrams:
+                posting = self._postings.get(ngram)
+                if posting is not None:
+                    posting_rows.append((ngram, _posting_to_blob(posting)))
+                else:
+                    deleted_ngrams.append((ngram,))
+            item_rows = [(id_, u' '.join(self._ngrams_for_item[id_]))
+                    for id_ in self._changed_items]
+            deleted_items = [(id_,) for id_ in self._deleted_items]
+            changes = (self._changed_ngrams, self._changed_items,
+                    self._deleted_items)
+            self._reset_changes()
+        finally:
+            self._lock.release()
+
+        app.db.cursor.execute("BEGIN TRANSACTION")
+        try:
+            app.db.cursor.executemany("REPLACE INTO search_index_posting "
+                    "(ngram, item_ids) VALUES (?, ?)", posting_rows)
+            app.db.cursor.executemany("DELETE FROM search_index_posting "
+                    "WHERE ngram=?", deleted_ngrams)
+            app.db.cursor.executemany("REPLACE INTO search_index_item "
+                    "(id, ngrams) VALUES (?, ?)", item_rows)
+            app.db.cursor.executemany("DELETE FROM search_index_item "
+                    "WHERE id=?", deleted_items)
+        except StandardError:
+            app.db.cursor.execute("ROLLBACK TRANSACTION")
+            self._restore_changes(*changes)
+            raise
+        else:
+            app.db.cursor.execute("COMMIT TRANSACTION")
+
+    def close(self):
+        self.save()
+
+    def _restore_changes(self, changed_ngrams, changed_items, deleted_items):
+        """Remember changes that we failed to save."""
+        self._lock.acquire()
+        try:
+            self._changed_ngrams.update(changed_ngrams)
+            # items may have been changed/deleted since we tried to save
+            for id_ in changed_items:
+                if id_ not in self._deleted_items:
+                    self._changed_items.add(id_)
+            for id_ in deleted_items:
+                if id_ not in self._changed_items:
+                    self._deleted_items.add(id_)
+        finally:
+            self._lock.release()
+
+def create_sql():
+    """Get the SQL needed to create the tables for the search index."""
+    return [
+        "CREATE TABLE search_index_posting"
+        "(ngram TEXT PRIMARY KEY, item_ids BLOB)",
+        "CREATE TABLE search_index_item(id INTEGER PRIMARY KEY, ngrams TEXT)",
+    ]
+
+# FTS modules to try, best first
+_FTS_MODULES = ('fts4(%s, tokenize=unicode61)', 'fts4(%s)', 'fts3(%s)')
+# columns in our FTS table and how much a match in each one counts for when
+# ranking results
+_FTS_COLUMNS = (
+    ('name', 10.0),
+    ('artist', 5.0),
+    ('album', 5.0),
+    ('genre', 2.0),
+    ('feed_name', 2.0),
+    ('filename', 2.0),
+    ('description', 1.0),
+)
+_FTS_WEIGHTS = tuple(weight for name, weight in _FTS_COLUMNS)
+
+def find_fts_module():
+    """Find the best FTS module that our version of SQLite supports.
+
+    :returns: FTS module string to use in CREATE VIRTUAL TABLE, with a %s
+        for the column list, or None if SQLite doesn't support FTS.
+    """
+    connection = sqlite3.connect(':memory:')
+    try:
+        for module in _FTS_MODULES:
+            try:
+                connection.execute("CREATE VIRTUAL TABLE fts_test USING %s"
+                        % (module % 'a'))
+            except sqlite3.OperationalError:
+                continue
+            else:
+                return module
+        return None
+    finally:
+        connection.close()
+
+def _fts_rank(matchinfo):
+    """Calculate how well a row matched an FTS query.
+
+    matchinfo is the default output of the matchinfo() function.  For each
+    phrase and column, we add the column's weight times the fraction of the
+    phrase's hits (in all rows) that were in this row.
+    """
+    info = array.array('I')
+    info.fromstring(str(matchinfo))
+    phrase_count, column_count = info[0], info[1]
+    rank = 0.0
+    for phrase in xrange(phrase_count):
+        for column in xrange(column_count):
+            pos = 2 + 3 * (phrase * column_count + column)
+            if info[pos]:
+                rank += _FTS_WEIGHTS[column] * info[pos] / info[pos+1]
+    return rank
+
+def _fts_phrase(term):
+    """Convert a search term into an FTS phrase.
+
+    The last word is a prefix query, so that results show up as the user is
+    typing.
+
+    :returns: phrase string, or None if term doesn't contain any words
+    """
+    words = search.WORDMATCHER.findall(term)
+    if not words:
+        return None
+    return u'"%s*"' % u' '.join(words)
+
+def _fts_values(item_info):
+    """Get the values for our FTS columns from an ItemInfo."""
+    if item_info.video_path:
+        filename = filename_to_unicode(
+                os.path.basename(item_info.video_path))
+    else:
+        filename = None
+    values = {
+        'name': item_info.name,
+        'artist': item_info.artist,
+        'album': item_info.album,
+        'genre': item_info.genre,
+        'feed_name': item_info.feed_name,
+        'filename': filename,
+        'description': item_info.description_stripped[0],
+    }
+    return [values[name] or u'' for name, weight in _FTS_COLUMNS]
+
+class FTSSearchIndex(object):
+    """Index all database items using SQLite full-text search.
+
+    The index lives in its own database file (or in memory if the main
+    database does), with a connection that both the backend and frontend
+    threads use, guarded by a lock.
+
+    Changes to items get queued up and written in a single transaction the
+    next time we search, or when we save.
+
+    We only store the version when we close(), and we delete it in load().
+    If Miro crashes, we won't find it and we rebuild the index.
+    """
+
+    # how often should we write pending changes to disk? (in seconds)
+    SAVE_INTERVAL = 30
+    VERSION_KEY = 'version'
+    # Version of the format we use to store the index.  Bump this if you
+    # change it.
+    FORMAT_VERSION = 1
+    # if filter_ids() gets more than this many ids, it fetches all the
+    # results and filters them in python
+    FILTER_ID_LIMIT = 200
+    RANKS_RESULTS = True
+
+    def __init__(self, path=None):
+        self.path = path
+        self.connection = None
+        self._lock = threading.Lock()
+        # maps item ids -> FTS values to write, or None to delete them
+        self._pending_changes = {}
+        self._save_dc = None
+        self._callback_handles = []
+
+    def version(self):
+        return "%s-%s" % (app.item_info_cache.version(), self.FORMAT_VERSION)
+
+    def _default_path(self):
+        if app.db.path == ':memory:':
+            return ':memory:'
+        return os.path.join(os.path.dirname(app.db.path),
+                'searchindex.sqlite')
+
+    def load(self):
+        """Load the index and start tracking changes to items.
+
+        Call this after app.item_info_cache is loaded.
+        """
+        if self.path is None:
+            self.path = self._default_path()
+        try:
+            self._open_connection()
+            loaded = self._check_saved_data()
+        except sqlite3.DatabaseError, e:
+            logging.warn("Error loading FTS search index: %s", e)
+            self._delete_database()
+            self._open_connection()
+            loaded = False
+        if not loaded:
+            self._rebuild()
+        self.connection.execute("DELETE FROM search_index_variables "
+                "WHERE name=?", (self.VERSION_KEY,))
+        cache = app.item_info_cache
+        self._callback_handles = [
+            cache.connect('added', self._on_info_changed),
+            cache.connect('changed', self._on_info_changed),
+            cache.connect('removed', self._on_info_removed),
+        ]
+
+    def _open_connection(self):
+        self.connection = sqlite3.connect(self.path, isolation_level=None,
+                check_same_thread=False)
+        # This is just a cache of data from the main database.  If we lose
+        # it, we can rebuild it.
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.create_function('miro_rank', 1, _fts_rank)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS "
+                "search_index_variables(name TEXT PRIMARY KEY, value TEXT)")
+
+    def _delete_database(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.path != ':memory:' and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _check_saved_data(self):
+        """Check if the index we have stored is good to use."""
+        row = self.connection.execute("SELECT value "
+                "FROM search_index_variables WHERE name=?",
+                (self.VERSION_KEY,)).fetchone()
+        if row is None or row[0] != self.version():
+            return False
+        count = self.connection.execute("SELECT COUNT(*) "
+                "FROM item_fts").fetchone()[0]
+        return count == models.Item.select(['COUNT(*)'], convert=False,
+                reporting=True)[0][0]
+
+    def _rebuild(self):
+        """Rebuild the index using app.item_info_cache."""
+        logging.info("Rebuilding FTS search index")
+        self.connection.execute("DROP TABLE IF EXISTS item_fts")
+        columns = ', '.join(name for name, weight in _FTS_COLUMNS)
+        self.connection.execute("CREATE VIRTUAL TABLE item_fts USING %s" %
+                (find_fts_module() % columns))
+        self._pending_changes = {}
+        self._write_values(((info.id, _fts_values(info))
+            for info in app.item_info_cache.all_infos()), [])
+
+    def disconnect(self):
+        for handle in self._callback_handles:
+            app.item_info_cache.disconnect(handle)
+        self._callback_handles = []
+
+    def close(self):
+        self.disconnect()
+        self.save()
+        self.connection.execute("REPLACE INTO search_index_variables "
+                "(name, value) VALUES (?, ?)",
+                (self.VERSION_KEY, self.version()))
+        self.connection.close()
+        self.connection = None
+
+    def _on_info_changed(self, cache, info):
+        self._queue_change(info.id, _fts_values(info))
+
+    def _on_info_removed(self, cache, info):
+        self._queue_change(info.id, None)
+
+    def _queue_change(self, id_, values):
+        self._lock.acquire()
+        try:
+            self._pending_changes[id_] = values
+        finally:
+            self._lock.release()
+        self.schedule_save_to_db()
+
+    def schedule_save_to_db(self):
+        if self._save_dc is None:
+            self._save_dc = eventloop.add_timeout(self.SAVE_INTERVAL,
+                    self.save, 'save FTS search index')
+
+    def save(self):
+        if self._save_dc is not None:
+            self._save_dc.cancel()
+            self._save_dc = None
+        self._lock.acquire()
+        try:
+            self._write_pending_changes()
+        finally:
+            self._lock.release()
+
+    def _write_pending_changes(self):
+        # Note: _lock must be held when this is called.
+        if not self._pending_changes:
+            return
+        rows = [(id_, values) for (id_, values) in
+                self._pending_changes.iteritems() if values is not None]
+        self._write_values(rows, self._pending_changes.keys())
+        self._pending_changes = {}
+
+    def _write_values(self, rows, deleted_ids):
+        columns = ', '.join(name for name, weight in _FTS_COLUMNS)
+        placeholders = ', '.join('?' for column in _FTS_COLUMNS)
+        insert_sql = "INSERT INTO item_fts (docid, %s) VALUES (?, %s)" % (
+                columns, placeholders)
+        self.connection.execute("BEGIN TRANSACTION")
+        try:
+            self.connection.executemany("DELETE FROM item_fts WHERE docid=?",
+                    ((id_,) for id_ in deleted_ids))
+            self.connection.executemany(insert_sql,
+                    ([id_] + values for (id_, values) in rows))
+        except StandardError:
+            self.connection.execute("ROLLBACK TRANSACTION")
+            raise
+        else:
+            self.connection.execute("COMMIT TRANSACTION")
+
+    def _where_clause(self, search_text):
+        """Build the WHERE clause for a search.
+
+        :returns: (sql, values).  sql is None if nothing can match.
+        """
+        parsed_search = search._get_boolean_search(search_text)
+        clauses = []
+        values = []
+        phrases = [_fts_phrase(term) for term in parsed_search.positive_terms]
+        if None in phrases:
+            # one of the terms doesn't have any words in it
+            return None, []
+        if phrases:
+            clauses.append("item_fts MATCH ?")
+            values.append(u' '.join(phrases))
+        for term in parsed_search.negative_terms:
+            phrase = _fts_phrase(term)
+            if phrase is not None:
+                clauses.append("docid NOT IN "
+                        "(SELECT docid FROM item_fts WHERE item_fts MATCH ?)")
+                values.append(phrase)
+        if clauses:
+            return ' AND '.join(clauses), values
+        else:
+            return '1', values
+
+    def _select_ids(self, search_text, extra_clause='', order_by='',
+            limit=''):
+        where, values = self._where_clause(search_text)
+        if where is None:
+            return []
+        sql = "SELECT docid FROM item_fts WHERE %s%s%s%s" % (where,
+                extra_clause, order_by, limit)
+        self._lock.acquire()
+        try:
+            self._write_pending_changes()
+            return [row[0] for row in self.connection.execute(sql, values)]
+        finally:
+            self._lock.release()
+
+    def search(self, search_text):
+        return set(self._select_ids(search_text))
+
+    def filter_ids(self, id_list, search_text):
+        """Find which ids in a list match a search.
+
+        Unlike SearchIndex.filter_ids(), ids for items that aren't in the
+        index never match.
+        """
+        if len(id_list) > self.FILTER_ID_LIMIT:
+            matches = self.search(search_text)
+        else:
+            id_string = ', '.join(str(int(id_)) for id_ in id_list)
+            matches = set(self._select_ids(search_text,
+                extra_clause=' AND docid IN (%s)' % id_string))
+        return [id_ for id_ in id_list if id_ in matches]
+
+    def search_ranked(self, search_text, offset=0, limit=None, id_list=None):
+        """Get a page of ids for items that match a search.
+
+        The best matches come first.  For equal matches, newer items come
+        first.
+
+        :param id_list: if given, only return ids from this list
+        """
+        parsed_search = search._get_boolean_search(search_text)
+        if parsed_search.positive_terms:
+            order_by = (' ORDER BY miro_rank(matchinfo(item_fts)) DESC, '
+                    'docid DESC')
+        else:
+            order_by = ' ORDER BY docid DESC'
+        if id_list is not None and len(id_list) > self.FILTER_ID_LIMIT:
+            # rank everything and filter afterwards, like filter_ids() does
+            wanted = set(id_list)
+            ranked = [id_ for id_ in self._select_ids(search_text,
+                order_by=order_by) if id_ in wanted]
+            return _page(ranked, offset, limit)
+        extra_clause = ''
+        if id_list is not None:
+            extra_clause = ' AND docid IN (%s)' % ', '.join(
+                    str(int(id_)) for id_ in id_list)
+        if limit is None:
+            limit = -1
+        return self._select_ids(search_text, extra_clause=extra_clause,
+                order_by=order_by,
+                limit=' LIMIT %d OFFSET %d' % (limit, offset))
@@ -567,7 +567,8 @@ class SharingItemTrackerImpl(signals.SignalEmitter):
         eventloop.call_in_thread(self.client_connect_callback,
                                  self.client_connect_error_callback,
                                  self.client_connect,
-                                 'DAAP client connect')
+                                 'DAAP client connect',
+                                 lane=eventloop.LANE_IO)
         signals.SignalEmitter.__init__(self)
         for sig in 'added', 'changed', 'removed':
             self.create_signal(sig)
@@ -628,7 +629,8 @@ class SharingItemTrackerImpl(signals.SignalEmitter):
         eventloop.call_in_thread(self.client_disconnect_callback,
                                  self.client_disconnect_error_callback,
                                  client.disconnect,
-                                 'DAAP client connect')
+                                 'DAAP client disconnect',
+                                 lane=eventloop.LANE_IO)
 
     def client_disconnect_error_callback(self, unused):
         pass
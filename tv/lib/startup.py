@@ -57,6 +57,7 @@ from miro import dbupgradeprogress
 from miro import dialogs
 from miro import downloader
 from miro import eventloop
+from miro import feedcounts
 from miro import fileutil
 from miro import guide
 from miro import httpauth
@@ -81,6 +82,7 @@ from miro import tabs
 from miro import theme
 from miro import util
 from miro import searchengines
+from miro import searchindex
 from miro import storedatabase
 from miro import conversions
 from miro import devices
@@ -270,6 +272,7 @@ def finish_startup(obj, thread):
     logging.info("Restoring database...")
     start = time.time()
     app.db = storedatabase.LiveStorage()
+    app.feed_counts = feedcounts.FeedCounts()
     try:
         app.db.upgrade_database()
     except databaseupgrade.DatabaseTooNewError:
@@ -303,6 +306,8 @@ def finish_startup(obj, thread):
     app.metadata_progress_updater = metadataprogress.MetadataProgressUpdater()
     app.item_info_cache = iteminfocache.ItemInfoCache()
     app.item_info_cache.load()
+    app.search_index = searchindex.create_search_index()
+    app.search_index.load()
     dbupgradeprogress.upgrade_end()
 
     logging.info("Loading video converters...")
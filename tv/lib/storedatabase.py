@@ -55,6 +55,7 @@ import datetime
 import traceback
 import time
 import os
+import threading
 import sys
 from cStringIO import StringIO
 
@@ -74,6 +75,7 @@ from miro import fileutil
 from miro import iteminfocache
 from miro import messages
 from miro import schema
+from miro import searchindex
 from miro import prefs
 from miro import util
 from miro.gtcache import gettext as _
@@ -128,6 +130,11 @@ class LiveStorage:
     1. Loads the initial object list (and runs database upgrades)
     2. Handles updating the database based on changes to DDBObjects.
     """
+    # How many compiled statements sqlite3 should keep around.  We use a
+    # different UPDATE statement for each set of columns that we change, so
+    # we need more than the default of 100.
+    CACHED_STATEMENTS = 500
+
     def __init__(self, path=None, object_schemas=None, schema_version=None):
         if path is None:
             path = app.config.get(prefs.SQLITE_PATHNAME)
@@ -158,10 +165,21 @@ class LiveStorage:
         self._schema_version = schema_version
         self._schema_map = {}
         self._schema_column_map = {}
+        # maps ObjectSchema -> (eager fields, lazy fields)
+        self._restore_fields = {}
         self._all_schemas = []
         self._object_map = {} # maps object id -> DDBObjects in memory
         self._ids_loaded = set()
         self._statements_in_transaction = []
+        # maps object id -> (ObjectSchema, {column name: value}) for UPDATEs
+        # that we haven't run yet
+        self._pending_updates = {}
+        # maps (table name, column names) -> UPDATE statement
+        self._update_sql_cache = {}
+        # WAL mode helpers, see open_connection()
+        self._wal_enabled = False
+        self._checkpointer = None
+        self._reporting_connection = None
         eventloop.connect("event-finished", self.on_event_finished)
         for oschema in object_schemas:
             self._all_schemas.append(oschema)
@@ -171,6 +189,10 @@ class LiveStorage:
                     klass.track_attribute_changes(field_name)
             for name, schema_item in oschema.fields:
                 self._schema_column_map[oschema, name] = schema_item
+            self._restore_fields[oschema] = (
+                    [f for f in oschema.fields
+                        if f[0] not in oschema.lazy_fields],
+                    [f for f in oschema.fields if f[0] in oschema.lazy_fields])
         self._converter = SQLiteConverter()
 
         self.open_connection()
@@ -184,16 +206,71 @@ class LiveStorage:
         logging.info("opening database %s", path)
         self.connection = sqlite3.connect(path,
                 isolation_level=None,
-                detect_types=sqlite3.PARSE_DECLTYPES)
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                cached_statements=self.CACHED_STATEMENTS)
         self.cursor = self.connection.cursor()
+        self._connection_path = path
         try:
-            self.cursor.execute("PRAGMA journal_mode=PERSIST");
+            self._wal_enabled = self._setup_journal_mode(path)
         except sqlite3.DatabaseError:
-            msg = "Error running 'PRAGMA journal_mode=PERSIST'"
+            msg = "Error setting up the database journal mode"
             self._show_corrupt_db_dialog()
             self._handle_load_error(msg)
             # rerun the command with our fresh database
-            self.cursor.execute("PRAGMA journal_mode=PERSIST");
+            self._wal_enabled = self._setup_journal_mode(path)
+        self._start_checkpointer()
+
+    def _setup_journal_mode(self, path):
+        """Set the journal mode and synchronous level of our connection.
+
+        We use WAL journaling if the SQLITE_WAL_MODE pref is set, otherwise
+        PERSIST.
+
+        :returns: True if the database is now in WAL mode
+        """
+        wal_enabled = False
+        if app.config.get(prefs.SQLITE_WAL_MODE) and path != ":memory:":
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            mode = self.cursor.fetchone()[0]
+            if mode.lower() == 'wal':
+                wal_enabled = True
+            else:
+                logging.warn("Couldn't switch database to WAL mode "
+                        "(journal mode is %s)", mode)
+        if not wal_enabled:
+            self.cursor.execute("PRAGMA journal_mode=PERSIST")
+        self.cursor.execute("PRAGMA synchronous=%s" %
+                app.config.get(prefs.SQLITE_SYNCHRONOUS))
+        return wal_enabled
+
+    def _start_checkpointer(self):
+        if not self._wal_enabled or self._checkpointer is not None:
+            return
+        interval = app.config.get(prefs.SQLITE_CHECKPOINT_INTERVAL)
+        if interval <= 0:
+            # let sqlite checkpoint when we commit
+            return
+        # Turn off automatic checkpoints, otherwise sqlite runs them in the
+        # backend thread as part of a COMMIT.
+        self.cursor.execute("PRAGMA wal_autocheckpoint=0")
+        self._checkpointer = CheckpointThread(self._connection_path,
+                interval)
+        self._checkpointer.start()
+
+    def _close_connections(self):
+        """Close our main connection and any helper connections.
+
+        The main connection gets closed last.  When the last connection
+        closes, sqlite checkpoints the WAL file back into the database, so
+        it's safe to copy/move the database file after this.
+        """
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+            self._checkpointer = None
+        if self._reporting_connection is not None:
+            self._reporting_connection.close()
+            self._reporting_connection = None
+        self.connection.close()
 
     def close(self, ignore_vacuum_error=True):
         logging.info("closing database")
@@ -214,7 +291,7 @@ class LiveStorage:
                     logging.info(msg, sdbe)
                 else:
                     raise
-        self.connection.close()
+        self._close_connections()
 
     def get_backup_directory(self):
         """This returns the backup directory path.
@@ -462,16 +539,28 @@ class LiveStorage:
             obj.reset_changed_attributes()
 
     def update_obj(self, obj):
-        """Update a DDBObject on disk."""
+        """Update a DDBObject on disk.
+
+        The UPDATE isn't run right away.  Instead we remember the changed
+        values and run all pending updates the next time we execute a SQL
+        statement or finish the transaction.  Updates that change the same
+        columns are run together with executemany().
+
+        Since the UPDATE happens later, we can't raise an error here if the
+        object's row is missing.  Instead _run_pending_updates() calls
+        failed_soft() when an UPDATE changes the wrong number of rows.
+        """
 
         obj_schema = self._schema_map[obj.__class__]
-        setters = []
-        values = []
+        column_values = {}
         for name, schema_item in obj_schema.fields:
             if (isinstance(schema_item, schema.SchemaSimpleItem) and
                     name not in obj.changed_attributes):
                 continue
-            setters.append('%s=?' % name)
+            if name not in obj.__dict__:
+                # lazy column that we haven't loaded, so it can't have
+                # changed
+                continue
             value = getattr(obj, name)
             try:
                 schema_item.validate(value)
@@ -479,27 +568,63 @@ class LiveStorage:
                 if util.chatter:
                     logging.warn("error validating %s for %s", name, obj)
                 raise
-            values.append(self._converter.to_sql(obj_schema, name,
-                schema_item, value))
+            column_values[name] = self._converter.to_sql(obj_schema, name,
+                schema_item, value)
         obj.reset_changed_attributes()
-        if values:
-            sql = "UPDATE %s SET %s WHERE id=%s" % (obj_schema.table_name,
-                    ', '.join(setters), obj.id)
-            self._execute(sql, values, is_update=True)
-            if (self.cursor.rowcount != 1 and not
+        if column_values and not self._quitting_from_operational_error:
+            try:
+                pending = self._pending_updates[obj.id][1]
+            except KeyError:
+                self._pending_updates[obj.id] = (obj_schema, column_values)
+            else:
+                # object updated twice, merge the changes
+                pending.update(column_values)
+
+    def _update_sql(self, obj_schema, columns):
+        """Get the UPDATE statement to change a set of columns.
+
+        We bind the id rather than putting it in the SQL, so that the
+        statement is the same for all objects and sqlite can reuse it.
+        """
+        key = (obj_schema.table_name, columns)
+        try:
+            return self._update_sql_cache[key]
+        except KeyError:
+            sql = "UPDATE %s SET %s WHERE id=?" % (obj_schema.table_name,
+                    ', '.join('%s=?' % name for name in columns))
+            self._update_sql_cache[key] = sql
+            return sql
+
+    def _run_pending_updates(self):
+        """Run the UPDATE statements queued up by update_obj()."""
+        if not self._pending_updates:
+            return
+        pending_updates = self._pending_updates
+        self._pending_updates = {}
+        batches = {}
+        for id_, (obj_schema, column_values) in pending_updates.iteritems():
+            columns = tuple(sorted(column_values))
+            values = [column_values[name] for name in columns]
+            values.append(id_)
+            batches.setdefault((obj_schema, columns), []).append(values)
+        for (obj_schema, columns), value_list in batches.iteritems():
+            sql = self._update_sql(obj_schema, columns)
+            self._execute(sql, value_list, is_update=True, many=True)
+            if (self.cursor.rowcount != len(value_list) and not
                     self._quitting_from_operational_error):
-                if self.cursor.rowcount == 0:
-                    raise KeyError("Updating non-existent row (id: %s)" %
-                            obj.id)
-                else:
-                    raise ValueError("Update changed multiple rows "
-                            "(id: %s, count: %s)" %
-                            (obj.id, self.cursor.rowcount))
+                details = ("UPDATE changed %s rows, expected %s "
+                        "(table: %s, ids: %s)" % (self.cursor.rowcount,
+                            len(value_list), obj_schema.table_name,
+                            [row[-1] for row in value_list]))
+                app.controller.failed_soft('storedatabase.update_obj',
+                        details)
 
     def remove_obj(self, obj):
         """Remove a DDBObject from disk."""
 
         schema = self._schema_map[obj.__class__]
+        # code that handles the removal may still look at the lazy columns
+        self.load_lazy_columns([obj])
         sql = "DELETE FROM %s WHERE id=?" % (schema.table_name)
         self._execute(sql, (obj.id,), is_update=True)
         self.forget_object(obj)
@@ -517,6 +642,7 @@ class LiveStorage:
         for obj in objects:
             if obj_schema != self._schema_map[obj.__class__]:
                 raise ValueError("Incompatible types for bulk remove")
+        self.load_lazy_columns(objects)
         # we can only feed sqlite so many variables at once, send it chunks of
         # 900 ids at once
         for objects_chunk in split_values_for_sqlite(objects):
@@ -559,6 +685,13 @@ class LiveStorage:
     def table_name(self, klass):
         return self._schema_map[klass].table_name
 
+    def column_names(self, table_name):
+        """Get the names of the columns for a table."""
+        for oschema in self._all_schemas:
+            if oschema.table_name == table_name:
+                return [name for name, schema_item in oschema.fields]
+        raise KeyError(table_name)
+
     def object_from_class_table(self, obj, klass):
         return self._schema_map[klass] is self._schema_map[obj.__class__]
 
@@ -608,13 +741,40 @@ class LiveStorage:
         sql.write("SELECT %s.id " % table_name)
         sql.write(self._get_query_bottom(table_name, where, joins,
             order_by, limit))
+        self._run_pending_updates()
         self.cursor.execute(sql.getvalue(), values)
         return (row[0] for row in self.cursor.fetchall())
 
+    def query_ids_in(self, table_name, id_list, where, values=None,
+            joins=None):
+        """Get the ids from id_list that match a where clause.
+
+        id_list is split into chunks that sqlite can handle, so it can be
+        any size.
+        """
+        if values is None:
+            values = ()
+        rv = []
+        for id_list_chunk in split_values_for_sqlite(id_list):
+            chunk_where = "%s.id IN (%s)" % (table_name,
+                    ', '.join('?' for i in xrange(len(id_list_chunk))))
+            if where is not None:
+                chunk_where += " AND (%s)" % where
+            rv.extend(self.query_ids(table_name, chunk_where,
+                tuple(id_list_chunk) + tuple(values), joins=joins))
+        return rv
+
     def _restore_objects(self, schema, id_set):
-        column_names = ['%s.%s' % (schema.table_name, f[0])
-                for f in schema.fields]
+        """Restore a set of objects from the database.
 
+        Columns listed in the schema's lazy_fields aren't selected.  Instead,
+        each chunk of objects gets a LazyColumnLoader that loads them the
+        first time one of the objects needs them.
+        """
+        fields, lazy_fields = self._restore_fields[schema]
+        column_names = ['%s.%s' % (schema.table_name, f[0]) for f in fields]
+
+        self._run_pending_updates()
         # we can only feed sqlite so many variables at once, send it chunks of
         # 900 ids at once
         id_list = tuple(id_set)
@@ -625,15 +785,74 @@ class LiveStorage:
                 ', '.join('?' for i in xrange(len(id_list_chunk)))))
 
             self.cursor.execute(sql.getvalue(), id_list_chunk)
+            if lazy_fields:
+                loader = LazyColumnLoader(self, schema, id_list_chunk)
+            else:
+                loader = None
+            for row in self.cursor.fetchall():
+                self._restore_object_from_row(schema, row, fields, loader)
+
+    def load_lazy_columns(self, objects):
+        """Make sure the lazy columns for a list of objects are loaded."""
+        loaders = {}
+        for obj in objects:
+            loader = obj.__dict__.get('_lazy_column_loader')
+            if loader is not None:
+                loaders.setdefault(loader, []).append(obj)
+        for loader, loader_objects in loaders.iteritems():
+            loader.load(loader_objects)
+
+    def _load_lazy_columns(self, schema, objects):
+        """Load the lazy columns for a list of objects.
+
+        Used by LazyColumnLoader.  objects must all use schema.  Values that
+        were already set on the objects are left alone.
+        """
+        lazy_fields = self._restore_fields[schema][1]
+        fields = [('id', self._schema_column_map[schema, 'id'])] + lazy_fields
+        column_names = [f[0] for f in fields]
+        object_map = dict((obj.id, obj) for obj in objects)
+
+        self._run_pending_updates()
+        for id_list_chunk in split_values_for_sqlite(object_map.keys()):
+            sql = StringIO()
+            sql.write("SELECT %s " % (', '.join(column_names),))
+            sql.write("FROM %s WHERE id IN (%s)" % (schema.table_name,
+                ', '.join('?' for i in xrange(len(id_list_chunk)))))
+            self.cursor.execute(sql.getvalue(), id_list_chunk)
             for row in self.cursor.fetchall():
-                self._restore_object_from_row(schema, row)
+                values = self._convert_restored_row(schema, fields, row)
+                obj = object_map[values['id']]
+                for name, value in values.iteritems():
+                    obj.__dict__.setdefault(name, value)
+        for obj in objects:
+            obj.__dict__.pop('_lazy_column_loader', None)
+
+    def _restore_object_from_row(self, schema, db_row, fields=None,
+            loader=None):
+        if fields is None:
+            fields = schema.fields
+        restored_data = self._convert_restored_row(schema, fields, db_row)
+        if loader is not None:
+            restored_data['_lazy_column_loader'] = loader
+        klass = schema.get_ddb_class(restored_data)
+        return klass(restored_data=restored_data)
+
+    def _convert_restored_row(self, schema, fields, db_row):
+        """Convert the values in a row from the database.
 
-    def _restore_object_from_row(self, schema, db_row):
+        If any values are malformed, but the schema knows how to handle it,
+        we also update the database with the fixed values.
+
+        :param fields: (name, SchemaItem) pairs for the columns in db_row.
+            This must start with the id column.
+        :returns: dict mapping names to converted values
+        """
         restored_data = {}
         columns_to_update = []
         values_to_update = []
         for (name, schema_item), value in \
-                itertools.izip(schema.fields, db_row):
+                itertools.izip(fields, db_row):
             try:
                 value = self._converter.from_sql(schema, name, schema_item,
                         value)
@@ -657,12 +876,10 @@ class LiveStorage:
         if columns_to_update:
             # We are using some values that are different than what's stored
             # in disk.  Update the database to make things match.
-            setters = ['%s=?' % c for c in columns_to_update]
-            sql = "UPDATE %s SET %s WHERE id=%s" % (schema.table_name,
-                    ', '.join(setters), restored_data['id'])
+            sql = self._update_sql(schema, tuple(columns_to_update))
+            values_to_update.append(restored_data['id'])
             self._execute(sql, values_to_update)
-        klass = schema.get_ddb_class(restored_data)
-        return klass(restored_data=restored_data)
+        return restored_data
 
     def persistent_object_count(self):
         return len(self._object_map)
@@ -684,13 +901,23 @@ class LiveStorage:
         self._execute(sql.getvalue(), values, is_update=True)
 
     def select(self, klass, columns, where, values, joins=None, limit=None,
-            convert=True):
+            convert=True, reporting=False):
+        """Run a SELECT statement and return the rows.
+
+        Set reporting to True for heavy, read-only queries.  In WAL mode
+        they run on a separate read-only connection, which keeps them from
+        trashing the page cache of our main connection.
+        """
         schema = self._schema_map[klass]
         sql = StringIO()
         sql.write('SELECT %s ' % ', '.join(columns))
         sql.write(self._get_query_bottom(schema.table_name, where, joins, None,
             limit))
-        results = self._execute(sql.getvalue(), values)
+        results = None
+        if reporting:
+            results = self._execute_reporting(sql.getvalue(), values)
+        if results is None:
+            results = self._execute(sql.getvalue(), values)
         if not convert:
             return results
         schema_items = [self._schema_column_map[schema, c] for c in columns]
@@ -704,10 +931,59 @@ class LiveStorage:
             rows.append(converted_row)
         return rows
 
+    def _get_reporting_cursor(self):
+        """Get a cursor for the read-only reporting connection.
+
+        Returns None if reporting queries should use the main connection.
+        That's the case unless we're in WAL mode, and also when we have
+        uncommitted changes, since the other connection wouldn't see them.
+        """
+        if (not self._wal_enabled or self._statements_in_transaction or
+                self._pending_updates):
+            return None
+        if self._reporting_connection is None:
+            connection = sqlite3.connect(self._connection_path,
+                    isolation_level=None,
+                    detect_types=sqlite3.PARSE_DECLTYPES)
+            try:
+                connection.execute("PRAGMA query_only=1")
+            except sqlite3.DatabaseError:
+                # older sqlite versions don't support query_only.  We only
+                # send SELECTs to the connection anyways.
+                pass
+            self._reporting_connection = connection
+        return self._reporting_connection.cursor()
+
+    def _execute_reporting(self, sql, values):
+        """Run a SELECT on the reporting connection.
+
+        :returns: the result rows or None if the query should be run on the
+            main connection instead.
+        """
+        cursor = self._get_reporting_cursor()
+        if cursor is None:
+            return None
+        if values is None:
+            values = ()
+        start = time.time()
+        try:
+            cursor.execute(sql, values)
+            results = cursor.fetchall()
+        except sqlite3.OperationalError, e:
+            logging.warn("reporting query failed (%s), using the main "
+                    "connection\nstatement: %s", e, sql)
+            return None
+        self._check_time(sql, time.time() - start)
+        return results
+
     def on_event_finished(self, eventloop, success):
         self.finish_transaction(commit=success)
 
     def finish_transaction(self, commit=True):
+        if commit:
+            self._run_pending_updates()
+        else:
+            self._pending_updates = {}
         if len(self._statements_in_transaction) == 0:
             return
         if not self._quitting_from_operational_error:
@@ -722,6 +998,10 @@ class LiveStorage:
             # We want to avoid updating the database at this point.
             return
 
+        # Run any queued UPDATEs first, so that statements see the changes
+        # and run in the right order.
+        self._run_pending_updates()
+
         if is_update and len(self._statements_in_transaction) == 0:
             self.cursor.execute("BEGIN TRANSACTION")
 
@@ -873,6 +1153,8 @@ class LiveStorage:
                         (name, schema.table_name, ', '.join(columns)))
         self._create_variables_table()
         self.cursor.execute(iteminfocache.create_sql())
+        for sql in searchindex.create_sql():
+            self.cursor.execute(sql)
         self._set_version()
 
     def _get_version(self):
@@ -902,7 +1184,7 @@ class LiveStorage:
         """Saves the current database then starts fresh with an empty
         database.
         """
-        self.connection.close()
+        self._close_connections()
         self.save_invalid_db()
         self.open_connection()
         self._init_database()
@@ -942,6 +1224,84 @@ class LiveStorage:
             save_name = "%s.%d" % (org_save_name, i)
         return save_name
 
+class LazyColumnLoader(object):
+    """Loads the lazy columns for a group of objects restored together.
+
+    Restored objects store their loader in the _lazy_column_loader
+    attribute.  AttributeUpdateTracker calls load() the first time a lazy
+    column is accessed.  We load the columns for all objects in the group
+    that are in memory, since objects restored together usually get used
+    together.
+    """
+    def __init__(self, storage, schema, id_list):
+        self.storage = storage
+        self.schema = schema
+        self.unloaded_ids = set(id_list)
+
+    def load(self, objects):
+        """Load lazy columns for objects and the rest of our group."""
+        object_map = {}
+        for id_ in self.unloaded_ids:
+            try:
+                object_map[id_] = self.storage.get_obj_by_id(id_)
+            except KeyError:
+                # removed, or not restored yet
+                pass
+        for obj in objects:
+            object_map[obj.id] = obj
+        self.unloaded_ids.difference_update(object_map)
+        self.storage._load_lazy_columns(self.schema, object_map.values())
+
+class CheckpointThread(object):
+    """Runs WAL checkpoints for a database in a separate thread.
+
+    Checkpointing copies the changes in the WAL file back to the database.
+    It's the slow part of WAL journaling, so we do it here rather than let
+    sqlite do it in the backend thread when we commit.
+    """
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(name='DB Checkpoint Thread',
+                                       target=self.thread_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def thread_loop(self):
+        # sqlite connections can't be shared between threads, so we need
+        # our own.
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            while True:
+                self.stop_event.wait(self.interval)
+                if self.stop_event.isSet():
+                    break
+                self.checkpoint(connection)
+        finally:
+            connection.close()
+
+    def checkpoint(self, connection):
+        start = time.time()
+        try:
+            # PASSIVE doesn't wait for readers or writers, whatever can't get
+            # copied now will get copied next time.
+            connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.DatabaseError, e:
+            logging.warn("WAL checkpoint failed: %s", e)
+            return
+        end = time.time()
+        if end - start > 0.5:
+            logging.timing("WAL checkpoint slow (%0.3f seconds)", end - start)
+
 class SQLiteConverter(object):
     def __init__(self):
         self._to_sql_converters = {}
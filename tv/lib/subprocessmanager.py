@@ -41,10 +41,13 @@ with the command line and env from plat.utils.miro_helper_program_info().
 import cPickle as pickle
 import logging
 import os
+import shutil
 import struct
 import subprocess
 import sys
+import tempfile
 import threading
+import time
 import warnings
 import Queue
 
@@ -68,8 +71,15 @@ def _on_windows():
 # ** Protocol between miro and subprocesses **
 #
 # We spawn a child process and communicate to it by sending messages through
-# it's stdin and stdout.  Each message contains a length (a unsigned long)
-# followed by a pickled object.
+# it's stdin and stdout.  Each message starts with a header containing a kind
+# byte, a length (a unsigned long) and the time the message was sent.  For
+# normal messages, the header is followed by an object pickled with the
+# highest pickle protocol.  Large messages (feed HTML, parsed feeds, etc.) get
+# written to a temporary file and the header is followed by the path to that
+# file.  The reader deletes the file once it's loaded the object.  Each
+# subprocess gets its own temporary directory for these files, which the main
+# process deletes when the subprocess quits or restarts.  That way files
+# don't pile up if a process dies before reading them.
 #
 # The communication goes like this:
 #
@@ -109,8 +119,9 @@ class SubprocessMessage(messagetools.Message):
 
 class StartupInfo(SubprocessMessage):
     """Data needed to bootstrap the subprocess."""
-    def __init__(self, config_dict):
+    def __init__(self, config_dict, temp_dir):
         self.config_dict = config_dict
+        self.temp_dir = temp_dir
 
 class HandlerInfo(SubprocessMessage):
     """Describes how to build a SubprocessHandler object."""
@@ -203,6 +214,14 @@ class SubprocessResponder(messagetools.MessageHandler):
         """Called after the subprocess restarts after a crash."""
         pass
 
+    def on_quit(self):
+        """Called when the subprocess quits without shutdown() being called.
+
+        If the subprocess crashed, we restart it right after this, then call
+        on_startup() and on_restart().
+        """
+        pass
+
     def handle_subprocess_error(self, msg):
         if msg.soft_fail:
             app.controller.failed_soft('in subprocess', msg.report)
@@ -212,7 +231,86 @@ class SubprocessResponder(messagetools.MessageHandler):
 class LoadError(StandardError):
     """Exception for corrupt data when reading from a pipe."""
 
-SIZEOF_LONG = struct.calcsize("L")
+class IPCStats(object):
+    """Tracks the cost of sending messages between processes.
+
+    For each message class, we track how many messages were sent/received,
+    their size in bytes and how long they took.  For sent messages, the time
+    is the time spent pickling and writing the message.  For received
+    messages, it's the latency between when the other side started sending
+    the message and when we finished loading it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            # maps message class names to [count, bytes, total time, max time]
+            self.sent = {}
+            self.received = {}
+        finally:
+            self.lock.release()
+
+    def _record(self, counters, obj, byte_count, seconds):
+        if obj is None:
+            return
+        name = obj.__class__.__name__
+        self.lock.acquire()
+        try:
+            try:
+                stats = counters[name]
+            except KeyError:
+                stats = counters[name] = [0, 0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += byte_count
+            stats[2] += seconds
+            stats[3] = max(stats[3], seconds)
+        finally:
+            self.lock.release()
+
+    def record_sent(self, obj, byte_count, seconds):
+        self._record(self.sent, obj, byte_count, seconds)
+
+    def record_received(self, obj, byte_count, latency):
+        self._record(self.received, obj, byte_count, latency)
+
+    def get_stats(self):
+        """Get the current stats.
+
+        :returns: dict with "sent" and "received" keys.  Each value is a dict
+            mapping message class names to (count, bytes, total time, max
+            time) tuples
+        """
+        self.lock.acquire()
+        try:
+            return {
+                'sent': dict((k, tuple(v)) for k, v in self.sent.items()),
+                'received': dict((k, tuple(v))
+                                 for k, v in self.received.items()),
+            }
+        finally:
+            self.lock.release()
+
+    def log_stats(self):
+        stats = self.get_stats()
+        for direction in ('sent', 'received'):
+            for name, (count, byte_count, total, maximum) in sorted(
+                    stats[direction].items()):
+                logging.info("IPC %s %s: %d messages, %d bytes, "
+                        "avg %0.4fs, max %0.4fs", direction, name, count,
+                        byte_count, total / count, maximum)
+
+ipc_stats = IPCStats()
+
+# message header: kind, length, time sent
+_HEADER = struct.Struct("!cLd")
+# message kinds
+_KIND_PICKLE = 'p'
+_KIND_FILE = 'f'
+# send pickles at least this big using a temporary file
+LARGE_MESSAGE_SIZE = 1024 * 1024
 
 def _read_bytes_from_pipe(pipe, length):
     """Read size bytes from a pipe.
@@ -233,6 +331,44 @@ def _read_bytes_from_pipe(pipe, length):
         data.append(d)
     return ''.join(data)
 
+def _read_message_file(path):
+    """Read the pickle data for a large message, then delete the file."""
+    try:
+        try:
+            f = open(path, 'rb')
+            try:
+                return f.read()
+            finally:
+                f.close()
+        finally:
+            os.remove(path)
+    except EnvironmentError, e:
+        raise LoadError("Error reading message file: %s" % e)
+
+def _write_message_file(pickle_data, temp_dir=None):
+    """Write the pickle data for a large message to a temporary file.
+
+    :param temp_dir: directory to create the file in, or None to use the
+        default temporary directory
+    :returns: path to the file, or None if we couldn't write it
+    """
+    try:
+        fd, path = tempfile.mkstemp(prefix='miro-ipc-', dir=temp_dir)
+    except EnvironmentError, e:
+        logging.warn("Error creating message file: %s", e)
+        return None
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(pickle_data)
+        finally:
+            f.close()
+    except EnvironmentError, e:
+        logging.warn("Error writing message file: %s", e)
+        os.remove(path)
+        return None
+    return path
+
 def _load_obj(pipe):
     """Load an object from one side of a pipe.
 
@@ -243,17 +379,21 @@ def _load_obj(pipe):
 
     :returns: Python object send from the other side
     """
-    size_data = _read_bytes_from_pipe(pipe, SIZEOF_LONG)
-    if len(size_data) < SIZEOF_LONG:
-        raise LoadError("EOF reached while reading size field "
-                "(read %s bytes)" % len(size_data))
-    size = struct.unpack("L", size_data)[0]
-    pickle_data = _read_bytes_from_pipe(pipe, size)
-    if len(pickle_data) < size:
-        raise LoadError("EOF reached while reading pickle data "
-                "(read %s bytes)" % len(pickle_data))
+    header = _read_bytes_from_pipe(pipe, _HEADER.size)
+    if len(header) < _HEADER.size:
+        raise LoadError("EOF reached while reading header "
+                "(read %s bytes)" % len(header))
+    kind, size, sent_at = _HEADER.unpack(header)
+    data = _read_bytes_from_pipe(pipe, size)
+    if len(data) < size:
+        raise LoadError("EOF reached while reading message data "
+                "(read %s bytes)" % len(data))
+    if kind == _KIND_FILE:
+        data = _read_message_file(data)
+    elif kind != _KIND_PICKLE:
+        raise LoadError("Unknown message kind: %r" % kind)
     try:
-        return pickle.loads(pickle_data)
+        obj = pickle.loads(data)
     except pickle.PickleError:
         raise LoadError("Pickle data corrupt")
     except ImportError:
@@ -262,25 +402,41 @@ def _load_obj(pipe):
         # log this exception for easier debugging.
         _send_subprocess_error_for_exception()
         raise LoadError("Unknown error in pickle.loads: %s" % e)
+    ipc_stats.record_received(obj, len(data), time.time() - sent_at)
+    return obj
 
-def _dump_obj(obj, pipe):
+def _dump_obj(obj, pipe, temp_dir=None):
     """Dump an object to the other side of the pipe.
 
+    :param temp_dir: directory for the temporary file if obj is large
     :raises IOError: low-level error while writing to the pipe
     :raises pickle.PickleError: obj could not be pickled
     """
 
-    pickle_data = pickle.dumps(obj)
-    size_data = struct.pack("L", len(pickle_data))
+    start = time.time()
+    pickle_data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    path = None
+    if len(pickle_data) >= LARGE_MESSAGE_SIZE:
+        path = _write_message_file(pickle_data, temp_dir)
+    if path is not None:
+        kind, data = _KIND_FILE, path
+    else:
+        kind, data = _KIND_PICKLE, pickle_data
     # NOTE: We do a blocking write here.  This should be fine, since on both
     # sides we have a thread dedicated to just reading from the pipe and
     # pushing the data into a Queue.  However, there's some chance that the
     # process on the other side has gone really haywire and the reader thread
     # is hung.  I (BDK) can't really see a way for this to realistically
     # happen, so we stick with blocking writes.
-    pipe.write(size_data)
-    pipe.write(pickle_data)
-    pipe.flush()
+    try:
+        pipe.write(_HEADER.pack(kind, len(data), start))
+        pipe.write(data)
+        pipe.flush()
+    except IOError:
+        if path is not None:
+            os.remove(path)
+        raise
+    ipc_stats.record_sent(obj, len(pickle_data), time.time() - start)
 
 class SubprocessManager(object):
     """Manages a running subprocess
@@ -303,16 +459,23 @@ class SubprocessManager(object):
 
         handler_class and handler_args are used to build the SubprocessHandler
         inside the subprocess
+
+        message_base_class can be None, in which case messages must be sent
+        using send_message().  This is useful when several processes handle
+        the same messages.
         """
         if handler_args is None:
             handler_args = ()
-        message_base_class.install_handler(self)
+        if message_base_class is not None:
+            message_base_class.install_handler(self)
         self.responder = responder
         self.handler_class = handler_class
         self.handler_args = handler_args
         self.is_running = False
         self.process = None
         self.thread = None
+        # directory for large messages to and from the subprocess
+        self.temp_dir = None
 
     # Process management
 
@@ -325,6 +488,7 @@ class SubprocessManager(object):
 
     def _start(self):
         """Does the work to startup a new process/thread."""
+        self.temp_dir = self._make_temp_dir()
         # create our child process.
         self.process = self._start_subprocess()
         # create thread to handle the subprocess's output.  It would be nice
@@ -343,6 +507,20 @@ class SubprocessManager(object):
         self._send_startup_info()
         trapcall.trap_call("subprocess startup", self.responder.on_startup)
 
+    def _make_temp_dir(self):
+        try:
+            return tempfile.mkdtemp(prefix='miro-ipc-')
+        except EnvironmentError, e:
+            # we can still use the default temporary directory, we just
+            # won't be able to clean up after a crash.
+            logging.warn("Error creating subprocess temp dir: %s", e)
+            return None
+
+    def _remove_temp_dir(self):
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
     def _start_subprocess(self):
         cmd_line, env = miro_helper_program_info()
         kwargs = {
@@ -397,6 +575,7 @@ class SubprocessManager(object):
                     '_on_thread_quit called by an old thread')
             return
 
+        trapcall.trap_call("subprocess quit", self.responder.on_quit)
         if self.thread.quit_type == self.thread.QUIT_NORMAL:
             self._cleanup_process()
         else:
@@ -422,6 +601,8 @@ class SubprocessManager(object):
         self.thread = None
         self.process = None
         self.is_running = False
+        # any large message files that are left never got read
+        self._remove_temp_dir()
 
     # Handle communication to our child process
 
@@ -431,7 +612,7 @@ class SubprocessManager(object):
         if not self.is_running:
             raise ValueError("subprocess not running")
         try:
-            _dump_obj(msg, self.process.stdin)
+            _dump_obj(msg, self.process.stdin, self.temp_dir)
         except IOError:
             logging.warn("Broken pipe in send_message()")
             # we could try to restart our subprocess here, but if the pipe is
@@ -445,7 +626,8 @@ class SubprocessManager(object):
         self.send_message(None)
 
     def _send_startup_info(self):
-        self.send_message(StartupInfo(self._get_config_dict()))
+        self.send_message(StartupInfo(self._get_config_dict(),
+            self.temp_dir))
         self.send_message(HandlerInfo(self.handler_class, self.handler_args))
 
     def _get_config_dict(self):
@@ -599,6 +781,7 @@ def _subprocess_setup(stdin, stdout):
     msg = _load_obj(stdin)
     if not isinstance(msg, StartupInfo):
         raise LoadError("first message must a StartupInfo obj")
+    msg_handler.temp_dir = msg.temp_dir
     # setup some basic modules like config and gtcache
     initialize_locale()
     config.load(config.ManualConfig())
@@ -640,10 +823,12 @@ class PipeMessageProxy(object):
     """
     def __init__(self, fileobj):
         self.fileobj = fileobj
+        # directory for large messages, set once we get the StartupInfo
+        self.temp_dir = None
 
     def handle(self, msg):
         try:
-            _dump_obj(msg, self.fileobj)
+            _dump_obj(msg, self.fileobj, self.temp_dir)
         except pickle.PickleError:
             _send_subprocess_error_for_exception()
         # NOTE: we don't handle IOError here because what can we do about
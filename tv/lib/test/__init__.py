@@ -56,12 +56,16 @@ from miro.test.databasesanitytest import *
 from miro.test.subscriptiontest import *
 from miro.test.opmltest import *
 from miro.test.schedulertest import *
+from miro.test.eventlooptest import *
 from miro.test.networktest import *
 from miro.test.httpclienttest import *
 from miro.test.httpdownloadertest import *
+from miro.test.torrentsessiontest import *
 from miro.test.httpauthtoolstest import *
 from miro.test.feedtest import *
 from miro.test.feedparsertest import *
+from miro.test.feedupdatetest import *
+from miro.test.feedcountstest import *
 from miro.test.parseurltest import *
 from miro.test.utiltest import *
 from miro.test.playlisttest import *
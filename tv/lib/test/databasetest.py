@@ -7,6 +7,7 @@ from miro import databaselog
 from miro import item
 from miro import feed
 from miro import schema
+from miro import viewpredicate
 
 class DatabaseTestCase(MiroTestCase):
     def setUp(self):
@@ -146,6 +147,29 @@ class ViewTrackerTest(DatabaseTestCase):
         self.assertEquals(self.remove_callbacks, [self.i2])
         self.assertEquals(self.change_callbacks, [self.i1])
 
+    def test_bulk_insert_delta(self):
+        self.setup_view(item.Item.make_view("feed.userTitle='booya'",
+                joins={'feed': 'feed.id=item.feed_id'}))
+        self.tracker.set_bulk_mode(True)
+        bulk_callbacks = []
+        def on_bulk(tracker, objects, signal):
+            bulk_callbacks.append((signal, objects))
+        for signal in ('bulk-added', 'bulk-removed', 'bulk-changed'):
+            self.tracker.connect(signal, on_bulk, signal)
+        app.bulk_sql_manager.start()
+        i4 = item.Item(item.FeedParserValues({'title': u'item4'}),
+                       feed_id=self.feed.id)
+        # this item isn't in the view, so we shouldn't get a signal for it
+        item.Item(item.FeedParserValues({'title': u'item5'}),
+                  feed_id=self.feed2.id)
+        self.i2.remove()
+        app.bulk_sql_manager.finish()
+        # we should only get signals for the objects inserted/removed, not
+        # for the other objects in the view.
+        self.assertEquals(bulk_callbacks,
+                [('bulk-added', [i4]), ('bulk-removed', [self.i2])])
+        self.assertSameSet(self.tracker.current_ids, [self.i1.id, i4.id])
+
     def test_unlink(self):
         self.tracker.unlink()
         self.feed2.set_title(u"booya")
@@ -162,11 +186,99 @@ class ViewTrackerTest(DatabaseTestCase):
         self.assertEquals(self.remove_callbacks, [])
         self.assertEquals(self.change_callbacks, [])
 
+    def test_dependencies(self):
+        self.assertEquals(self.tracker.dependencies(),
+                frozenset(['userTitle']))
+        # views with joins depend on other tables
+        self.setup_view(item.Item.make_view("feed.userTitle='booya'",
+                joins={'feed': 'feed.id=item.feed_id'}))
+        self.assertEquals(self.tracker.dependencies(), None)
+
+    def test_skip_check_for_unrelated_change(self):
+        checked = []
+        def check_object(obj):
+            checked.append(obj)
+        self.tracker.check_object = check_object
+        # changing an attribute that our view doesn't depend on should send
+        # the changed signal without re-checking the view
+        self.feed.maxNew = 10
+        self.feed.signal_change()
+        self.assertEquals(checked, [])
+        self.assertEquals(self.change_callbacks, [self.feed])
+        # objects outside the view don't get a signal
+        self.feed2.maxNew = 10
+        self.feed2.signal_change()
+        self.assertEquals(checked, [])
+        self.assertEquals(self.change_callbacks, [self.feed])
+        # changing userTitle should re-check the view
+        self.feed2.userTitle = u'booya'
+        self.feed2.signal_change()
+        self.assertEquals(checked, [self.feed2])
+
     def test_check_all_item_not_loaded(self):
         tracker = self.view.make_tracker()
         self.clear_ddb_object_cache()
         tracker.check_all_objects()
 
+class ViewPredicateTest(DatabaseTestCase):
+    def check_predicate(self, view, fully_compiled=True):
+        predicate = viewpredicate.ViewPredicate('item', view.where,
+                view.values, view.joins)
+        self.assertEquals(predicate.is_fully_compiled(), fully_compiled)
+        ids_in_view = set(view.id_list())
+        for obj in (self.i1, self.i2, self.i3):
+            matches = predicate.matches(obj)
+            if not predicate.is_fully_compiled():
+                matches = matches and app.db.query_count('item',
+                        'item.id=? AND %s' % predicate.residual_where,
+                        (obj.id,) + predicate.residual_values, view.joins)
+            self.assertEquals(bool(matches), obj.id in ids_in_view)
+
+    def test_simple(self):
+        self.check_predicate(item.Item.feed_view(self.feed.id))
+        self.check_predicate(item.Item.visible_feed_view(self.feed2.id))
+        self.check_predicate(item.Item.media_children_view(self.i1.id))
+
+    def test_join(self):
+        self.feed.set_title(u'booya')
+        self.check_predicate(item.Item.make_view("feed.userTitle='booya'",
+                joins={'feed': 'feed.id=item.feed_id'}))
+        self.check_predicate(item.Item.make_view(
+            "feed.userTitle LIKE 'BOO%'",
+            joins={'feed': 'feed.id=item.feed_id'}))
+        self.check_predicate(item.Item.toplevel_view())
+        self.check_predicate(item.Item.feed_available_view(self.feed.id))
+
+    def test_null_logic(self):
+        # downloader_id is NULL for all our items, so the LEFT JOIN gives us
+        # NULL for all rd columns
+        self.check_predicate(item.Item.downloaded_view())
+        self.check_predicate(item.Item.make_view(
+            "NOT rd.state IN ('finished', 'paused')",
+            joins={'remote_downloader AS rd': 'item.downloader_id=rd.id'}))
+        self.check_predicate(item.Item.make_view(
+            "rd.state IS NULL AND NOT item.seen",
+            joins={'remote_downloader AS rd': 'item.downloader_id=rd.id'}))
+
+    def test_residual_sql(self):
+        # subqueries and reverse joins can't be compiled, they get checked
+        # with SQL
+        self.check_predicate(item.Item.orphaned_from_feed_view(),
+                fully_compiled=False)
+        self.check_predicate(item.Item.watchable_other_view(),
+                fully_compiled=False)
+
+    def test_tracker_uses_predicate(self):
+        view = item.Item.make_view("feed.userTitle='booya'",
+                joins={'feed': 'feed.id=item.feed_id'})
+        tracker = view.make_tracker()
+        self.assert_(tracker.predicate.is_fully_compiled())
+        self.assertEquals(len(tracker), 0)
+        self.feed.set_title(u'booya')
+        self.i1.signal_change()
+        self.assertEquals(len(tracker), 1)
+        tracker.unlink()
+
 # class TestViewLimiter(database.ViewLimiter):
 #     def __init__(self, *feeds_to_include):
 #         self.feeds_to_include = feeds_to_include
@@ -0,0 +1,279 @@
+import select
+import threading
+import time
+
+from miro import eventloop
+from miro import util
+from miro.test.framework import MiroTestCase, EventLoopTest
+
+class PollerTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.sock1, self.sock2 = util.make_dummy_socket_pair()
+        self.fd1, self.fd2 = self.sock1.fileno(), self.sock2.fileno()
+
+    def tearDown(self):
+        self.sock1.close()
+        self.sock2.close()
+        MiroTestCase.tearDown(self)
+
+    def poller_classes(self):
+        classes = [eventloop.Poller]
+        if hasattr(select, 'poll'):
+            classes.append(eventloop.PollPoller)
+        if hasattr(select, 'epoll'):
+            classes.append(eventloop.EpollPoller)
+        return classes
+
+    def check_poll(self, poller, read_ready, write_ready):
+        r, w, x = poller.poll(0)
+        self.assertSameSet(r, read_ready)
+        self.assertSameSet(w, write_ready)
+        self.assertEquals(list(x), [])
+
+    def test_read_write(self):
+        for poller_class in self.poller_classes():
+            poller = poller_class()
+            poller.add_read(self.fd1)
+            poller.add_write(self.fd2)
+            # nothing to read, but fd2 can be written to
+            self.check_poll(poller, [], [self.fd2])
+            self.sock2.send("a")
+            self.check_poll(poller, [self.fd1], [self.fd2])
+            poller.remove_write(self.fd2)
+            self.check_poll(poller, [self.fd1], [])
+            poller.remove_read(self.fd1)
+            self.check_poll(poller, [], [])
+            self.sock1.recv(1024)
+
+    def test_set_fds(self):
+        for poller_class in self.poller_classes():
+            poller = poller_class()
+            self.sock2.send("a")
+            poller.set_fds([self.fd1], [self.fd2], [])
+            self.check_poll(poller, [self.fd1], [self.fd2])
+            poller.set_fds([self.fd1], [], [])
+            self.check_poll(poller, [self.fd1], [])
+            poller.set_fds([], [], [])
+            self.check_poll(poller, [], [])
+            self.sock1.recv(1024)
+
+    def test_hangup(self):
+        # closing the other end of a socket should make it readable
+        for poller_class in self.poller_classes():
+            sock1, sock2 = util.make_dummy_socket_pair()
+            poller = poller_class()
+            poller.add_read(sock1.fileno())
+            sock2.close()
+            self.check_poll(poller, [sock1.fileno()], [])
+            sock1.close()
+
+class EventLoopPollerTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        self.sock1, self.sock2 = util.make_dummy_socket_pair()
+        self.read_count = 0
+
+    def tearDown(self):
+        self.sock1.close()
+        self.sock2.close()
+        EventLoopTest.tearDown(self)
+
+    def on_readable(self):
+        self.read_count += 1
+        self.sock1.recv(1024)
+        eventloop.remove_read_callback(self.sock1)
+        self.stopEventLoop(abnormal=False)
+
+    def test_read_callback(self):
+        eventloop.add_read_callback(self.sock1, self.on_readable)
+        self.sock2.send("a")
+        self.runEventLoop()
+        self.assertEquals(self.read_count, 1)
+        poller = eventloop._eventloop.poller
+        self.assert_(self.sock1.fileno() not in poller.read_fds)
+
+class CallQueueTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.queue = eventloop.CallQueue()
+        self.calls = []
+
+    def add_call(self, name, priority=eventloop.PRIORITY_NORMAL):
+        self.queue.add_idle(self.calls.append, name, args=(name,),
+                priority=priority)
+
+    def test_priority(self):
+        self.add_call('normal1')
+        self.add_call('low', eventloop.PRIORITY_LOW)
+        self.add_call('high', eventloop.PRIORITY_HIGH)
+        self.add_call('normal2')
+        self.queue.process_idles()
+        self.assertEquals(self.calls, ['high', 'normal1', 'normal2', 'low'])
+
+    def test_time_budget(self):
+        # with no time budget, we should only process 1 idle each time
+        # through the loop
+        old_budget = eventloop.IDLE_TIME_BUDGET
+        eventloop.IDLE_TIME_BUDGET = -1
+        try:
+            loop = eventloop.EventLoop()
+            loop.idle_queue = self.queue
+            self.add_call('one')
+            self.add_call('two')
+            for event in loop.generate_events([], []):
+                event()
+            self.assertEquals(self.calls, ['one'])
+            self.assertEquals(loop.calc_timeout(), 0)
+            for event in loop.generate_events([], []):
+                event()
+            self.assertEquals(self.calls, ['one', 'two'])
+        finally:
+            eventloop.IDLE_TIME_BUDGET = old_budget
+
+class CallStatsTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.stats = eventloop.CallStats()
+
+    def test_record(self):
+        self.stats.record('foo', 0.0005, 0.05)
+        self.stats.record('foo', 2.0, 20.0)
+        self.stats.record('bar', 0.0, 0.0)
+        stats = self.stats.get_stats()
+        self.assertSameSet(stats.keys(), ['foo', 'bar'])
+        foo = stats['foo']
+        self.assertEquals(foo['count'], 2)
+        self.assertAlmostEqual(foo['total_duration'], 20.05)
+        self.assertEquals(foo['max_duration'], 20.0)
+        self.assertEquals(foo['max_latency'], 2.0)
+        self.assertEquals(foo['duration'], [0, 0, 1, 0, 0, 1])
+        self.assertEquals(foo['latency'], [1, 0, 0, 0, 1, 0])
+
+    def test_max_names(self):
+        for i in xrange(eventloop.CallStats.MAX_NAMES + 5):
+            self.stats.record('call-%d' % i, 0.0, 0.0)
+        stats = self.stats.get_stats()
+        self.assertEquals(len(stats), eventloop.CallStats.MAX_NAMES + 1)
+        self.assertEquals(stats['other']['count'], 5)
+
+    def test_strip_details(self):
+        # per-object details shouldn't create separate entries
+        self.stats.record('timeout (Feed update (feed 1))', 0.0, 0.0)
+        self.stats.record('timeout (Feed update (feed 2))', 0.0, 0.0)
+        self.stats.record(
+                'idle (Thread Pool Callback (getAddrInfo (a.com:80)))',
+                0.0, 0.0)
+        self.stats.record('foo() (using as_idle)', 0.0, 0.0)
+        stats = self.stats.get_stats()
+        self.assertSameSet(stats.keys(), ['timeout (Feed update)',
+            'idle (Thread Pool Callback (getAddrInfo))', 'foo()'])
+        self.assertEquals(stats['timeout (Feed update)']['count'], 2)
+
+    def test_dump(self):
+        self.stats.record('foo', 0.0, 1.0)
+        self.stats.record('bar', 0.0, 2.0)
+        path = self.make_temp_path('.txt')
+        self.stats.dump(path)
+        lines = open(path).read().splitlines()
+        self.assertEquals(len(lines), 3)
+        # slowest calls should be listed first
+        self.assert_(lines[1].endswith('bar'))
+        self.assert_(lines[2].endswith('foo'))
+
+    def test_dispatch(self):
+        # DelayedCall.dispatch() should record stats
+        eventloop.call_stats.reset()
+        queue = eventloop.CallQueue()
+        queue.add_idle(lambda: None, 'test call')
+        queue.process_idles()
+        stats = eventloop.get_call_stats()
+        self.assertEquals(stats['idle (test call)']['count'], 1)
+
+class FakeEventLoop(object):
+    def __init__(self):
+        self.quit_flag = False
+        self.idle_queue = eventloop.CallQueue()
+
+    def wakeup(self):
+        pass
+
+class ThreadPoolTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.event_loop = FakeEventLoop()
+        self.pool = eventloop.ThreadPool(self.event_loop)
+        self.pool.init_threads()
+        self.release_event = threading.Event()
+        self.results = []
+
+    def tearDown(self):
+        self.release_event.set()
+        self.pool.close_threads()
+        MiroTestCase.tearDown(self)
+
+    def blocking_call(self):
+        self.release_event.wait(5)
+        return 'blocking'
+
+    def queue_call(self, function, *args, **kwargs):
+        self.pool.queue_call(self.results.append, self.results.append,
+                function, 'test call', *args, **kwargs)
+
+    def wait_for(self, check):
+        for x in xrange(100):
+            if check():
+                return
+            time.sleep(0.02)
+        raise AssertionError("timed out waiting for thread pool")
+
+    def wait_for_results(self, count):
+        def check():
+            self.event_loop.idle_queue.process_idles()
+            return len(self.results) >= count
+        self.wait_for(check)
+
+    def test_call(self):
+        self.queue_call(lambda x, y: x + y, 1, 2)
+        self.wait_for_results(1)
+        self.assertEquals(self.results, [3])
+        stats = self.pool.get_stats()[eventloop.LANE_DEFAULT]
+        self.assertEquals(stats['completed'], 1)
+        self.assertEquals(stats['in_flight'], 0)
+
+    def test_lane_arg(self):
+        # lane shouldn't be passed to the function
+        def func(**kwargs):
+            return kwargs
+        self.queue_call(func, foo='bar', lane=eventloop.LANE_IO)
+        self.wait_for_results(1)
+        self.assertEquals(self.results, [{'foo': 'bar'}])
+        self.assertRaises(ValueError, self.queue_call, func,
+                lane='not-a-lane')
+
+    def test_grow_and_shrink(self):
+        self.pool.IDLE_THREAD_TIMEOUT = 0.1
+        min_threads, max_threads = self.pool.LANES[eventloop.LANE_DEFAULT]
+        for x in xrange(max_threads + 2):
+            self.queue_call(self.blocking_call)
+        def get_stats():
+            return self.pool.get_stats()[eventloop.LANE_DEFAULT]
+        # the pool should grow to max_threads, but no further
+        self.wait_for(lambda: get_stats()['in_flight'] == max_threads)
+        self.assertEquals(get_stats()['threads'], max_threads)
+        self.assertEquals(get_stats()['queued'], 2)
+        self.release_event.set()
+        self.wait_for_results(max_threads + 2)
+        # after the extra threads sit idle, they should exit
+        self.wait_for(lambda: get_stats()['threads'] == min_threads)
+
+    def test_lanes_independent(self):
+        # blocking all of the IO threads shouldn't stop the default lane
+        min_threads, max_threads = self.pool.LANES[eventloop.LANE_IO]
+        for x in xrange(max_threads + 1):
+            self.queue_call(self.blocking_call, lane=eventloop.LANE_IO)
+        self.queue_call(lambda: 'quick')
+        self.wait_for_results(1)
+        self.assertEquals(self.results, ['quick'])
+        stats = self.pool.get_stats()
+        self.assertEquals(stats[eventloop.LANE_IO]['in_flight'], max_threads)
@@ -0,0 +1,93 @@
+from miro import app
+from miro.feed import Feed
+from miro.folder import ChannelFolder
+from miro.item import Item, FileItem, FeedParserValues
+from miro.singleclick import _build_entry
+from miro.test.framework import MiroTestCase
+
+def fp_values_for_url(url):
+    return FeedParserValues(_build_entry(url, 'video/x-unknown'))
+
+class FeedCountsTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.feed = Feed(u'http://example.com/feed.rss',
+                initiallyAutoDownloadable=False)
+        self.items = [self.make_item(i) for i in xrange(3)]
+
+    def make_item(self, i):
+        return Item(fp_values_for_url(u'http://example.com/%s.ogg' % i),
+                feed_id=self.feed.id)
+
+    def make_file_item(self):
+        return FileItem(self.make_temp_path('.avi'), feed_id=self.feed.id)
+
+    def check_counts(self, available, unwatched):
+        self.assertEquals(self.feed.num_available(), available)
+        self.assertEquals(self.feed.num_unwatched(), unwatched)
+        # our totals should match what's in the database
+        self.assertEquals(app.feed_counts.reconcile(), 0)
+
+    def test_available(self):
+        self.check_counts(3, 0)
+        self.make_item(3)
+        self.check_counts(4, 0)
+        self.items[0].remove()
+        self.check_counts(3, 0)
+
+    def test_mark_as_viewed(self):
+        self.check_counts(3, 0)
+        self.feed.mark_as_viewed()
+        self.check_counts(0, 0)
+        self.make_item(3)
+        self.check_counts(1, 0)
+
+    def test_unwatched(self):
+        file_items = [self.make_file_item() for i in xrange(2)]
+        self.check_counts(3, 2)
+        file_items[0].mark_item_seen()
+        self.check_counts(3, 1)
+        file_items[0].mark_item_unseen()
+        self.check_counts(3, 2)
+
+    def test_folder(self):
+        folder = ChannelFolder(u'test folder')
+        # items in the manual feed are never available, but they can be
+        # unwatched
+        other_feed = Feed(u'dtv:manualFeed')
+        FileItem(self.make_temp_path('.avi'), feed_id=other_feed.id)
+        self.make_file_item()
+        self.feed.set_folder(folder)
+        other_feed.set_folder(folder)
+        self.assertEquals(folder.num_available(), 3)
+        self.assertEquals(folder.num_unwatched(), 2)
+        self.make_item(3)
+        self.assertEquals(folder.num_available(), 4)
+        self.feed.set_folder(None)
+        self.assertEquals(folder.num_available(), 0)
+        self.assertEquals(folder.num_unwatched(), 1)
+        other_feed.remove()
+        self.assertEquals(folder.num_unwatched(), 0)
+
+    def test_reconcile(self):
+        self.check_counts(3, 0)
+        # change an item without calling signal_change(), so our totals
+        # don't see it
+        self.items[0].autoDownloaded = True
+        app.db.update_obj(self.items[0])
+        self.assertEquals(self.feed.num_available(), 3)
+        self.assertEquals(app.feed_counts.reconcile(), 1)
+        self.assertEquals(self.feed.num_available(), 2)
+
+    def test_signal_coalescing(self):
+        self.check_counts(3, 0)
+        signals = []
+        def on_signal_change():
+            signals.append(self.feed.num_available())
+        self.feed.on_signal_change = on_signal_change
+        for item in self.items:
+            item.autoDownloaded = True
+            item.signal_change()
+        self.assertEquals(signals, [])
+        app.feed_counts._signal_changes()
+        self.assertEquals(signals, [0])
@@ -1,6 +1,7 @@
 import os
 import unittest
 import pprint
+import cPickle
 
 from miro import feedparserutil
 from miro.item import FeedParserValues
@@ -235,6 +236,27 @@ class FeedParserValuesTest(unittest.TestCase):
             fpv = FeedParserValues(d.entries[i])
             self.assertEquals(fpv.data["thumbnail_url"], url)
 
+    def test_parse_to_values(self):
+        fn = "http___feeds_miroguide_com_miroguide_featured.xml"
+        d = _parse_feed(fn)
+        parsed = feedparserutil.parse_to_values(os.path.join(FPTESTINPUT, fn))
+        self.assertEquals(parsed['entries'], [])
+        self.assertEquals(parsed['feed']['title'], d['feed']['title'])
+        # the values should survive being sent from the worker process, but
+        # we shouldn't send the whole entry
+        parsed = cPickle.loads(cPickle.dumps(parsed,
+                                             cPickle.HIGHEST_PROTOCOL))
+        self.assertEquals(len(parsed['entry_values']), len(d.entries))
+        for fpv, entry in zip(parsed['entry_values'], d.entries):
+            expected = FeedParserValues(entry)
+            self.assertEquals(fpv.entry, None)
+            self.assertEquals(fpv.data, expected.data)
+            if expected.first_video_enclosure is None:
+                self.assertEquals(fpv.first_video_enclosure, None)
+            else:
+                self.assertEquals(fpv.first_video_enclosure,
+                        {'url': expected.first_video_enclosure['url']})
+
 
 # FIXME - could use way more feedparser tests
 
@@ -7,7 +7,8 @@ from miro import prefs
 from miro import dialogs
 from miro import feedparserutil
 from miro.item import Item
-from miro.feed import validate_feed_url, normalize_feed_url, Feed
+from miro.feed import (validate_feed_url, normalize_feed_url, Feed,
+                       get_content_hash_stats)
 
 from miro.test.framework import MiroTestCase, EventLoopTest
 
@@ -439,6 +440,72 @@ support participatory culture and build a fairer music industry.</description>
         self.assertEquals(Item.make_view().count(), 4)
         self.check_guids(3, 4, 5, 6)
 
+class ContentHashTest(FeedTestCase):
+    # Test that we skip parsing feeds whose content hasn't changed
+    def setUp(self):
+        FeedTestCase.setUp(self)
+        self.write_feed(u'First Item')
+        self.feed = self.make_feed()
+
+    def write_feed(self, title):
+        self.write_file("""<?xml version="1.0"?>
+<rss version="2.0">
+   <channel>
+      <title>Content Hash Test</title>
+      <item>
+         <title>%s</title>
+         <guid>guid-1</guid>
+         <enclosure url="http://example.com/movie.mpg" />
+      </item>
+   </channel>
+</rss>""" % title)
+
+    def check_title(self, title):
+        self.assertEquals(Item.make_view().get_singleton().get_title(),
+                          title)
+
+    def test_unchanged(self):
+        self.update_feed(self.feed)
+        self.assertNotEquals(self.feed.actualFeed.content_hash, None)
+        stats = get_content_hash_stats()
+        # updating again with the same content shouldn't parse the feed.
+        # Check that by changing the item, which parsing would undo.
+        item = Item.make_view().get_singleton()
+        item.entry_title = u'Changed'
+        item.signal_change()
+        finished = []
+        self.feed.connect('update-finished', finished.append)
+        self.update_feed(self.feed)
+        self.check_title(u'Changed')
+        self.assertEquals(finished, [self.feed])
+        new_stats = get_content_hash_stats()
+        self.assertEquals(new_stats['checks'], stats['checks'] + 1)
+        self.assertEquals(new_stats['hits'], stats['hits'] + 1)
+        self.assert_(not self.feed.is_updating())
+
+    def test_changed(self):
+        self.update_feed(self.feed)
+        old_hash = self.feed.actualFeed.content_hash
+        self.write_feed(u'Second Title')
+        self.update_feed(self.feed)
+        self.check_title(u'Second Title')
+        self.assertNotEquals(self.feed.actualFeed.content_hash, old_hash)
+
+    def test_clean_old_items(self):
+        self.update_feed(self.feed)
+        self.feed.actualFeed.clean_old_items()
+        self.assertEquals(self.feed.actualFeed.content_hash, None)
+
+    def test_multi_feed_clean_old_items(self):
+        multi_feed = Feed(u"dtv:savedsearch/all?q=dogs")
+        # point the search at our file rather than the search engines
+        multi_feed.actualFeed.urls = [self.url]
+        self.update_feed(multi_feed)
+        self.assertEquals(multi_feed.actualFeed.content_hash.keys(),
+                          [self.url])
+        multi_feed.actualFeed.clean_old_items()
+        self.assertEquals(multi_feed.actualFeed.content_hash, {})
+
 class FeedParserAttributesTestCase(FeedTestCase):
     """Test that we save/restore attributes from feedparser correctly.
 
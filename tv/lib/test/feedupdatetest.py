@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from miro import app
+from miro import feedupdate
+from miro import prefs
+from miro import signals
+from miro.test.framework import EventLoopTest
+
+class FakeFeedImpl(object):
+    def __init__(self, url):
+        self.url = url
+        self.last_update_finished = None
+        self.unchanged_rate = 0.0
+        self.change_count = 0
+
+    def signal_change(self):
+        self.change_count += 1
+
+class FakeFeed(signals.SignalEmitter):
+    def __init__(self, id_, url):
+        signals.SignalEmitter.__init__(self, 'update-finished', 'removed')
+        self.id = id_
+        self.actualFeed = FakeFeedImpl(url)
+        self.visible = True
+        self.last_viewed = datetime.min
+
+    def get_title(self):
+        return u'feed %s' % self.id
+
+    def id_exists(self):
+        return True
+
+class FeedUpdateQueueTest(EventLoopTest):
+    def setUp(self):
+        EventLoopTest.setUp(self)
+        app.config.set(prefs.FEED_UPDATE_MAX_CONCURRENT, 3)
+        app.config.set(prefs.FEED_UPDATE_MAX_PER_HOST, 2)
+        self.queue = feedupdate.FeedUpdateQueue()
+        self.updated = []
+
+    def make_feeds(self, *urls):
+        return [FakeFeed(i, url) for i, url in enumerate(urls)]
+
+    def queue_update(self, feed):
+        # skip the timeout that schedule_update() uses
+        self.queue.timeouts[feed.id] = None
+        self.queue.do_update(feed, lambda: self.updated.append(feed))
+
+    def finish_update(self, feed):
+        feed.emit('update-finished')
+        self.runPendingIdles()
+
+    def test_limits(self):
+        feeds = self.make_feeds(u'http://a.com/1', u'http://a.com/2',
+                u'http://a.com/3', u'http://b.com/1', u'http://c.com/1')
+        for feed in feeds:
+            self.queue_update(feed)
+        # we should only update 2 feeds from a.com
+        self.assertEquals(self.updated, [feeds[0], feeds[1], feeds[3]])
+        stats = self.queue.get_stats()
+        self.assertEquals(stats['queue_depth'], 2)
+        self.assertEquals(stats['host_counts'], {'a.com': 2, 'b.com': 1})
+        # when a feed finishes, the next feed should be able to update, even
+        # though a feed from a.com was queued first
+        self.finish_update(feeds[3])
+        self.assertEquals(self.updated[3:], [feeds[4]])
+        self.finish_update(feeds[0])
+        self.assertEquals(self.updated[4:], [feeds[2]])
+        stats = self.queue.get_stats()
+        self.assertEquals(stats['queue_depth'], 0)
+        self.assertEquals(stats['update']['count'], 2)
+        self.assertEquals(stats['wait']['count'], 5)
+
+    def test_non_network_feeds(self):
+        # feeds that don't use the network shouldn't have a per-host limit
+        feeds = self.make_feeds(u'dtv:search', u'dtv:manualFeed',
+                u'file:///tmp/feed.rss')
+        for feed in feeds:
+            self.queue_update(feed)
+        self.assertEquals(self.updated, feeds)
+
+    def test_priority(self):
+        app.config.set(prefs.FEED_UPDATE_MAX_CONCURRENT, 1)
+        feeds = self.make_feeds(u'http://a.com/1', u'http://b.com/1',
+                u'http://c.com/1', u'http://d.com/1', u'http://e.com/1')
+        # update feeds 1-4 once.  Feed 3 doesn't change.
+        for feed in feeds[1:]:
+            self.queue_update(feed)
+            if feed is feeds[3]:
+                self.queue.mark_unchanged(feed)
+            self.finish_update(feed)
+        self.assertEquals(self.queue.get_stats()['unchanged_count'], 1)
+        self.assert_(feeds[3].actualFeed.unchanged_rate > 0.0)
+        self.assertEquals(feeds[4].actualFeed.unchanged_rate, 0.0)
+        # pretend that the updates happened a while ago
+        now = datetime.now()
+        for i, seconds in ((1, 1000), (2, 500), (3, 900), (4, 600)):
+            feeds[i].actualFeed.last_update_finished = (now -
+                    timedelta(seconds=seconds))
+        feeds[3].actualFeed.unchanged_rate = 1.0
+        # feed 2 was viewed recently
+        feeds[2].last_viewed = datetime.now()
+        # start updating feed 0, then queue up the rest
+        self.updated = []
+        for feed in feeds:
+            self.queue_update(feed)
+        for feed in feeds:
+            self.finish_update(self.updated[-1])
+        # feed 0 started updating right away.  Feed 2 was viewed recently.
+        # Feed 3 is staler than feed 4, but it never changes.
+        self.assertEquals(self.updated,
+                [feeds[0], feeds[2], feeds[1], feeds[4], feeds[3]])
+
+    def test_history_saved(self):
+        # the results of an update get stored on the feed impl, so that they
+        # survive restarts
+        feed = self.make_feeds(u'http://a.com/1')[0]
+        self.queue_update(feed)
+        self.queue.mark_unchanged(feed)
+        self.finish_update(feed)
+        feed_impl = feed.actualFeed
+        self.assertNotEquals(feed_impl.last_update_finished, None)
+        self.assert_(feed_impl.unchanged_rate > 0.0)
+        self.assertEquals(feed_impl.change_count, 1)
+        # a new queue, like we would have after a restart, should use them
+        queue = feedupdate.FeedUpdateQueue()
+        self.assert_(queue.calc_priority(feed) >
+                -feedupdate.MAX_STALENESS)
@@ -11,6 +11,7 @@ from miro import config
 from miro import database
 from miro import eventloop
 from miro import feed
+from miro import feedcounts
 from miro import downloader
 from miro import httpauth
 from miro import httpclient
@@ -19,6 +20,7 @@ from miro import moviedata
 from miro import util
 from miro import prefs
 from miro import searchengines
+from miro import searchindex
 from miro import signals
 from miro import storedatabase
 from time import sleep
@@ -382,6 +384,8 @@ class MiroTestCase(unittest.TestCase):
     def setup_new_item_info_cache(self):
         app.item_info_cache = iteminfocache.ItemInfoCache()
         app.item_info_cache.load()
+        app.search_index = searchindex.SearchIndex()
+        app.search_index.load()
 
     def reset_failed_soft_count(self):
         app.controller.failed_soft_count = 0
@@ -405,6 +409,7 @@ class MiroTestCase(unittest.TestCase):
         app.db = storedatabase.LiveStorage(path,
                                            schema_version=schema_version,
                                            object_schemas=object_schemas)
+        app.feed_counts = feedcounts.FeedCounts()
         app.db.raise_load_errors = self.raise_db_load_errors
 
     def allow_db_load_errors(self, allow):
@@ -507,12 +512,12 @@ class EventLoopTest(MiroTestCase):
         eventloop.add_idle(function, name, args=None, kwargs=None)
 
     def hasIdles(self):
-        return not (eventloop._eventloop.idle_queue.queue.empty() and
-                    eventloop._eventloop.urgent_queue.queue.empty())
+        return (eventloop._eventloop.idle_queue.has_pending_idle() or
+                eventloop._eventloop.urgent_queue.has_pending_idle())
 
     def processThreads(self):
         eventloop._eventloop.threadpool.init_threads()
-        while not eventloop._eventloop.threadpool.queue.empty():
+        while eventloop._eventloop.threadpool.has_pending_calls():
             sleep(0.05)
         eventloop._eventloop.threadpool.close_threads()
 
@@ -4,10 +4,12 @@ import pycurl
 import pickle
 from cStringIO import StringIO
 
+from miro import app
 from miro import dialogs
 from miro import eventloop
 from miro import httpauth
 from miro import httpclient
+from miro import prefs
 from miro import signals
 from miro.plat import resources
 from miro.test import mock
@@ -82,6 +84,32 @@ class HTTPClientTest(HTTPClientTestBase):
         self.grab_url(self.httpserver.build_url('test.txt'))
         self.assertEquals(self.grab_url_info['body'], self.test_response_data)
 
+    @uses_httpclient
+    def test_handle_reuse(self):
+        self.grab_url(self.httpserver.build_url('test.txt'))
+        self.wait_for_libcurl_manager()
+        stats = httpclient.curl_manager.get_handle_stats()
+        self.assertEquals(stats['created'], 1)
+        self.assertEquals(stats['reused'], 0)
+        self.assertEquals(stats['idle'], 1)
+        # the second request should reuse the handle from the first
+        self.grab_url(self.httpserver.build_url('test.txt'))
+        self.assertEquals(self.grab_url_info['body'], self.test_response_data)
+        self.wait_for_libcurl_manager()
+        stats = httpclient.curl_manager.get_handle_stats()
+        self.assertEquals(stats['created'], 1)
+        self.assertEquals(stats['reused'], 1)
+        self.assertEquals(stats['idle'], 1)
+
+    @uses_httpclient
+    def test_keepalive_limit(self):
+        app.config.set(prefs.HTTP_KEEPALIVE_PER_HOST, 0)
+        self.grab_url(self.httpserver.build_url('test.txt'))
+        self.wait_for_libcurl_manager()
+        stats = httpclient.curl_manager.get_handle_stats()
+        self.assertEquals(stats['idle'], 0)
+        self.assertEquals(stats['closed'], 1)
+
     @uses_httpclient
     def test_file_get(self):
         path = resources.path("testdata/httpserver/test.txt")
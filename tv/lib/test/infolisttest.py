@@ -105,6 +105,7 @@ class InfoListTestBase(MiroTestCase):
         """
         to_update = []
         resort = bool(kwargs.get('resort'))
+        redraw = kwargs.get('redraw', True)
         for i in xrange(0, len(args), 2):
             info = FakeInfo(args[i+1], args[i])
             idx = self.find_info_index(info.id)
@@ -112,7 +113,7 @@ class InfoListTestBase(MiroTestCase):
             to_update.append(info)
         if resort:
             self.sort_info_list(self.correct_infos)
-        self.infolist.update_infos(to_update, resort=resort)
+        self.infolist.update_infos(to_update, resort=resort, redraw=redraw)
         self.check_info_list(self.correct_infos)
 
     def check_remove(self, *id_list):
@@ -193,6 +194,11 @@ class InfoListDataTest(InfoListTestBase):
         self.check_update_sort(self.sorter, reverse=True)
         self.check_update(1, 'aaa', 2, 'ZZZ', resort=True)
 
+    def test_update_without_redraw(self):
+        self.check_insert(self.make_infos('m', 'i', 'r', 'o'))
+        self.check_update(0, 'mm', 3, 'oo', redraw=False)
+        self.assertEquals(self.infolist.get_info(0).name, 'mm')
+
     def test_non_integer_id(self):
         infos = self.make_infos('m', 'i', 'r', 'o', 'p', 'c', 'f')
         for i in infos:
@@ -265,6 +271,7 @@ class InfoListGTKTest(InfoListDataTest):
     def setUp(self):
         InfoListDataTest.setUp(self)
         self.signals_seen = []
+        self.rows_changed = 0
         # import gtk inside the function because it will fail on OS X
         import gtk
         self.treeview = gtk.TreeView()
@@ -319,6 +326,7 @@ class InfoListGTKTest(InfoListDataTest):
             raise
 
     def on_row_changed(self, obj, path, it):
+        self.rows_changed += 1
         try:
             # check path points to the correct info
             self.assertEquals(len(path), 1)
@@ -368,6 +376,10 @@ class InfoListGTKTest(InfoListDataTest):
             self.signal_error = True
             raise
 
+    def test_update_without_redraw(self):
+        InfoListDataTest.test_update_without_redraw(self)
+        self.assertEquals(self.rows_changed, 0)
+
     def check_insert(self, *args, **kwargs):
         self.tracked_infos = self.correct_infos[:]
         InfoListDataTest.check_insert(self, *args, **kwargs)
@@ -1,5 +1,4 @@
 import logging
-import cPickle
 import functools
 
 from miro import app
@@ -13,6 +12,7 @@ from miro.folder import PlaylistFolder, ChannelFolder
 from miro.singleclick import _build_entry
 from miro.tabs import TabOrder
 from miro import itemsource
+from miro import iteminfocache
 from miro import messages
 from miro import messagehandler
 from miro import metadataprogress
@@ -474,6 +474,25 @@ class FeedItemTrackTest(TrackerTest):
         self.assertEquals(len(self.test_handler.messages), 2)
         self.check_changed_message(1, changed=[self.items[0]])
 
+    def test_changed_fields(self):
+        self.items[0].set_title(u'new name')
+        self.runUrgentCalls()
+        self.assertEquals(len(self.test_handler.messages), 2)
+        message = self.test_handler.messages[1]
+        self.assertEquals(message.changed_fields.keys(), [self.items[0].id])
+        fields = message.changed_fields[self.items[0].id]
+        self.assert_('name' in fields)
+        self.assert_('name_sort_key' in fields)
+        self.assert_('download_info' not in fields)
+        self.assert_('description' not in fields)
+
+    def test_no_change(self):
+        # signal_change() without changing anything shouldn't result in a
+        # message
+        self.items[0].signal_change()
+        self.runUrgentCalls()
+        self.assertEquals(len(self.test_handler.messages), 1)
+
     def test_add(self):
         self.make_item(u'http://example.com/3')
         self.make_item(u'http://example.com/4')
@@ -498,6 +517,91 @@ class FeedItemTrackTest(TrackerTest):
         self.runUrgentCalls()
         self.assertEquals(len(self.test_handler.messages), 1)
 
+class ItemListPagingTest(TrackerTest):
+    def setUp(self):
+        TrackerTest.setUp(self)
+        self.feed = Feed(u'dtv:manualFeed')
+        self.items = []
+        for i in xrange(5):
+            entry = _build_entry(u'http://example.com/%s' % i,
+                    'video/x-unknown', {'title': u'item %s' % i})
+            self.items.append(Item(FeedParserValues(entry),
+                feed_id=self.feed.id))
+        self.runUrgentCalls()
+        self.old_page_size = messagehandler.DatabaseSourceTrackerBase.page_size
+        messagehandler.DatabaseSourceTrackerBase.page_size = 2
+        self.track_items(self.sort_key, True)
+
+    def track_items(self, sort_key=None, reverse=False):
+        self.test_handler.messages = []
+        messages.TrackItems('feed', self.feed.id, sort_key,
+                reverse).send_to_backend()
+        self.runUrgentCalls()
+
+    def sort_key(self, info):
+        return info.name
+
+    def tearDown(self):
+        messagehandler.DatabaseSourceTrackerBase.page_size = self.old_page_size
+        TrackerTest.tearDown(self)
+
+    def sent_infos(self):
+        infos = list(self.test_handler.messages[0].items)
+        for message in self.test_handler.messages[1:]:
+            self.assertEquals(type(message), messages.ItemsChanged)
+            infos.extend(message.added)
+        return infos
+
+    def pending_items(self):
+        sent_ids = set(info.id for info in self.sent_infos())
+        return [i for i in self.items if i.id not in sent_ids]
+
+    def test_pages(self):
+        self.assertEquals(len(self.test_handler.messages), 1)
+        # the first page should be what the frontend displays first
+        self.assertEquals([info.id for info in
+            self.test_handler.messages[0].items],
+            [self.items[4].id, self.items[3].id])
+        self.runPendingIdles()
+        self.assertEquals(len(self.test_handler.messages), 3)
+        self.assertSameSet([info.id for info in self.sent_infos()],
+                [i.id for i in self.items])
+
+    def test_remove_pending(self):
+        to_remove = self.pending_items()[0]
+        to_remove.remove()
+        self.runUrgentCalls()
+        # the frontend never got the item, so it shouldn't get the removal
+        self.assertEquals(len(self.test_handler.messages), 1)
+        self.runPendingIdles()
+        self.assertSameSet([info.id for info in self.sent_infos()],
+                [i.id for i in self.items if i is not to_remove])
+
+    def test_change_pending(self):
+        to_change = self.pending_items()[0]
+        to_change.set_title(u'new title')
+        self.runUrgentCalls()
+        self.assertEquals(len(self.test_handler.messages), 1)
+        self.runPendingIdles()
+        for info in self.sent_infos():
+            if info.id == to_change.id:
+                self.assertEquals(info.name, u'new title')
+
+    def test_stop(self):
+        messages.StopTrackingItems('feed', self.feed.id).send_to_backend()
+        self.runPendingIdles()
+        self.assertEquals(len(self.test_handler.messages), 1)
+
+    def test_no_sort(self):
+        # if we don't know the frontend's sort, we can't pick the first page,
+        # so we send everything at once.
+        self.track_items()
+        self.runPendingIdles()
+        self.assertEquals(len(self.test_handler.messages), 1)
+        self.assertSameSet([info.id for info in
+            self.test_handler.messages[0].items],
+            [i.id for i in self.items])
+
 class PlaylistItemTrackTest(TrackerTest):
     def setUp(self):
         TrackerTest.setUp(self)
@@ -606,6 +710,46 @@ class ItemInfoCacheTest(FeedItemTrackTest):
         app.item_info_cache.save()
         self.setup_new_item_info_cache()
 
+class ItemInfoUpdateTest(MiroTestCase):
+    # Test creating ItemInfos from the old ItemInfo for an item
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.feed = Feed(u'dtv:manualFeed')
+        entry = _build_entry(u'http://example.com/', 'video/x-unknown',
+                {'title': u'my item', 'description': u'<b>bold</b> text'})
+        self.item = Item(FeedParserValues(entry), feed_id=self.feed.id)
+        self.old_info = itemsource.DatabaseItemSource._item_info_for(
+                self.item)
+
+    def check_info(self):
+        info = itemsource.DatabaseItemSource._item_info_for(self.item,
+                self.old_info)
+        # we should get the same values as calculating everything from
+        # scratch
+        real_info = itemsource.DatabaseItemSource._item_info_for(self.item)
+        self.assertEquals(info.as_dict(), real_info.as_dict())
+        return info
+
+    def test_unchanged(self):
+        info = self.check_info()
+        self.assert_(info.description_stripped is
+                self.old_info.description_stripped)
+        self.assert_(info.search_ngrams is self.old_info.search_ngrams)
+        self.assert_(info.name_sort_key is self.old_info.name_sort_key)
+
+    def test_name_change(self):
+        self.item.set_title(u'new title')
+        info = self.check_info()
+        self.assertEquals(info.name, u'new title')
+        self.assert_(info.search_ngrams is not self.old_info.search_ngrams)
+        self.assert_(info.description_stripped is
+                self.old_info.description_stripped)
+
+    def test_description_change(self):
+        self.item.set_description(u'<i>other</i> text')
+        info = self.check_info()
+        self.assertEquals(info.description_stripped[0], u'other text')
+
 class ItemInfoCacheErrorTest(MiroTestCase):
     # Test errors when loading the Item info cache
     def setUp(self):
@@ -631,7 +775,7 @@ class ItemInfoCacheErrorTest(MiroTestCase):
         for item in self.items:
             cache_info = app.item_info_cache.id_to_info[item.id]
             real_info = itemsource.DatabaseItemSource._item_info_for(item)
-            self.assertEquals(cache_info.__dict__, real_info.__dict__)
+            self.assertEquals(cache_info.as_dict(), real_info.as_dict())
         # it should also delete all data from the item cache table
         app.db.cursor.execute("SELECT COUNT(*) FROM item_info_cache")
         self.assertEquals(app.db.cursor.fetchone()[0], 0)
@@ -643,9 +787,27 @@ class ItemInfoCacheErrorTest(MiroTestCase):
         for item in self.items:
             app.db.cursor.execute("SELECT pickle FROM item_info_cache "
                     "WHERE id=%s" % item.id)
-            db_info = cPickle.loads(str(app.db.cursor.fetchone()[0]))
+            db_info = iteminfocache.decode_info(
+                    str(app.db.cursor.fetchone()[0]))
             real_info = itemsource.DatabaseItemSource._item_info_for(item)
-            self.assertEquals(db_info.__dict__, real_info.__dict__)
+            self.assertEquals(db_info.as_dict(), real_info.as_dict())
+
+    def test_format_version_change(self):
+        app.db.finish_transaction()
+        app.item_info_cache.save()
+        old_version = iteminfocache.FORMAT_VERSION
+        iteminfocache.FORMAT_VERSION += 1
+        try:
+            # we should ignore the data saved with the old version
+            self.setup_new_item_info_cache()
+        finally:
+            iteminfocache.FORMAT_VERSION = old_version
+        app.db.cursor.execute("SELECT COUNT(*) FROM item_info_cache")
+        self.assertEquals(app.db.cursor.fetchone()[0], 0)
+        for item in self.items:
+            cache_info = app.item_info_cache.id_to_info[item.id]
+            real_info = itemsource.DatabaseItemSource._item_info_for(item)
+            self.assertEquals(cache_info.as_dict(), real_info.as_dict())
 
     def test_failsafe_load_item_change(self):
         # Test Items calling signal_change() when we do a failsafe load
@@ -694,7 +856,25 @@ class ItemInfoCacheErrorTest(MiroTestCase):
         self.assertEquals(cached_info.name, 'new title2')
 
     def get_info_from_item_info_cache(self, id):
-        return app.item_info_cache.id_to_info[id]
+        return app.item_info_cache.get_info(id)
+
+    def test_load_in_background(self):
+        app.db.finish_transaction()
+        app.item_info_cache.save()
+        # make the data for the last item bad.  We should only rebuild that
+        # ItemInfo.
+        bad_item = self.items[-1]
+        app.db.cursor.execute("UPDATE item_info_cache SET pickle='BOGUS' "
+                "WHERE id=?", (bad_item.id,))
+        self.setup_new_item_info_cache()
+        for item in self.items:
+            cache_info = app.item_info_cache.get_info(item.id)
+            real_info = itemsource.DatabaseItemSource._item_info_for(item)
+            self.assertEquals(cache_info.as_dict(), real_info.as_dict())
+        self.assertEquals(app.item_info_cache._infos_changed.keys(),
+                [bad_item.id])
+        self.assertEquals(len(app.item_info_cache.all_infos()),
+                len(self.items))
 
     def test_item_info_version(self):
         app.db.finish_transaction()
@@ -339,6 +339,34 @@ class NetworkBufferTest(MiroTestCase):
         # check to make sure the value doesn't change as a result
         self.assertEquals(self.buffer.getValue(), "ONETWOTHREE")
 
+    def test_read_across_chunks(self):
+        for data in ("ON", "E\r", "\nTW", "O", "\nTHREE"):
+            self.buffer.addData(data)
+        self.assertEquals(self.buffer.read(1), "O")
+        self.assertEquals(self.buffer.readline(), "NE")
+        self.assertEquals(self.buffer.readline(), "TWO")
+        self.assertEquals(self.buffer.readline(), None)
+        self.buffer.addData("\n")
+        self.assertEquals(self.buffer.readline(), "THREE")
+        self.assertEquals(self.buffer.has_data(), False)
+        self.assertEquals(self.buffer.read(), "")
+
+    def test_peek(self):
+        self.buffer.addData("12345")
+        self.buffer.addData("67890")
+        self.assertEquals(self.buffer.peek(3), "123")
+        self.assertEquals(self.buffer.peek(7), "1234567")
+        self.assertEquals(self.buffer.length, 10)
+        self.assertEquals(self.buffer.read(7), "1234567")
+        self.assertEquals(self.buffer.peek(), "890")
+
+    def test_unread_after_partial_read(self):
+        self.buffer.addData("ONETWO")
+        self.assertEquals(self.buffer.read(3), "ONE")
+        self.buffer.unread("ZERO\n")
+        self.assertEquals(self.buffer.readline(), "ZERO")
+        self.assertEquals(self.buffer.read(), "TWO")
+
 
 class WeirdCloseConnectionTest(AsyncSocketTest):
     def test_close_during_open_connection(self):
@@ -1,14 +1,17 @@
 import gc
 
+from miro import app
 from miro import messages
 from miro import models
 from miro import search
+from miro import searchindex
 from miro import ngrams
 from miro import itemsource
 from miro.item import FeedParserValues
 from miro.singleclick import _build_entry
 from miro.test.framework import MiroTestCase
 from miro.frontends.widgets.itemtrack import SearchFilter
+from miro.frontends.widgets.itemtrack import SharedIndexSearchFilter
 
 class NGramTest(MiroTestCase):
     def test_simple(self):
@@ -134,6 +137,94 @@ class ItemSearcherTest(MiroTestCase):
         self.check_search_results('my', self.item1)
         self.check_empty_result('second')
 
+    def test_negative_terms(self):
+        self.check_search_results('my -first', self.item2)
+        self.check_search_results('-first', self.item2)
+        self.check_search_results('item -my')
+
+    def test_filter_ids(self):
+        id_list = [self.item1.id, self.item2.id]
+        self.assertEquals(self.searcher.filter_ids(id_list, 'my'), id_list)
+        self.assertEquals(self.searcher.filter_ids(id_list, 'irst'),
+                [self.item1.id])
+        self.assertEquals(self.searcher.filter_ids(id_list, 'my -irst'),
+                [self.item2.id])
+        self.assertEquals(self.searcher.filter_ids(id_list, 'miro'), [])
+        self.assertEquals(self.searcher.filter_ids([], 'my'), [])
+
+    def test_posting_lists(self):
+        # posting lists should be sorted arrays, with changes merged in
+        item3 = self.make_item(u'http://example.com/', u'my third item')
+        self.searcher.remove_item(self.item2.id)
+        posting = self.searcher._get_posting(u'my')
+        self.assertEquals(list(posting), sorted([self.item1.id, item3.id]))
+        self.assertEquals(self.searcher._get_posting(u'secon').tolist(), [])
+
+class SearchIndexTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.feed = models.Feed(u'http://example.com/')
+        self.item1 = self.make_item(u'my first item')
+        self.item2 = self.make_item(u'my second item')
+
+    def make_item(self, title):
+        additional = {'title': title}
+        entry = _build_entry(u'http://example.com/', 'video/x-unknown',
+                additional)
+        return models.Item(FeedParserValues(entry), feed_id=self.feed.id)
+
+    def check_search_results(self, search_text, *correct_items):
+        correct_ids = [i.id for i in correct_items]
+        self.assertSameSet(app.search_index.search(search_text), correct_ids)
+
+    def reload_index(self):
+        app.db.finish_transaction()
+        app.search_index.save()
+        app.search_index.disconnect()
+        app.search_index = searchindex.SearchIndex()
+        app.search_index.load()
+
+    def test_track_changes(self):
+        self.check_search_results('my', self.item1, self.item2)
+        item3 = self.make_item(u'my third item')
+        self.check_search_results('my', self.item1, self.item2, item3)
+        self.item1.set_title(u'my new title')
+        self.check_search_results('first')
+        self.check_search_results('title', self.item1)
+        self.item2.remove()
+        self.check_search_results('my', self.item1, item3)
+
+    def test_save_and_load(self):
+        self.reload_index()
+        # the N-grams for each item should be read as needed
+        self.assertEquals(app.search_index._ngrams_for_item,
+                {self.item1.id: None, self.item2.id: None})
+        self.check_search_results('my', self.item1, self.item2)
+        self.check_search_results('second', self.item2)
+        self.item1.set_title(u'my new title')
+        self.item2.remove()
+        self.check_search_results('my', self.item1)
+        self.check_search_results('first')
+        # changes since the last load should be saved too
+        self.reload_index()
+        self.check_search_results('my', self.item1)
+        self.check_search_results('title', self.item1)
+        self.check_search_results('second')
+        app.db.cursor.execute("SELECT COUNT(*) FROM search_index_item")
+        self.assertEquals(app.db.cursor.fetchone()[0], 1)
+
+    def test_rebuild(self):
+        self.reload_index()
+        # if the data doesn't match the items, we should rebuild the index
+        app.db.cursor.execute("DELETE FROM search_index_item WHERE id=?",
+                (self.item2.id,))
+        self.reload_index()
+        self.assertEquals(app.search_index._ngrams_for_item[self.item1.id],
+                app.item_info_cache.get_info(self.item1.id).search_ngrams)
+        self.check_search_results('my', self.item1, self.item2)
+        self.reload_index()
+        self.check_search_results('second', self.item2)
+
 class SearchFilterTest(MiroTestCase):
     def setUp(self):
         MiroTestCase.setUp(self)
@@ -229,3 +320,190 @@ class SearchFilterTest(MiroTestCase):
         # only info2 matches the search, so removed should only include it
         self.check_changed_filter([], [], [self.info1, self.info2],
                 [], [], [self.info2])
+
+class FTSSearchIndexTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.feed = models.Feed(u'http://example.com/')
+        self.item1 = self.make_item(u'my first item')
+        self.item2 = self.make_item(u'my second item',
+                u'<b>first</b> description')
+        self.item3 = self.make_item(u'something else')
+        self.index_path = self.make_temp_path('.sqlite')
+        self.index = searchindex.FTSSearchIndex(self.index_path)
+        self.index.load()
+
+    def tearDown(self):
+        if self.index.connection is not None:
+            self.index.close()
+        MiroTestCase.tearDown(self)
+
+    def make_item(self, title, description=None):
+        additional = {'title': title}
+        if description is not None:
+            additional['description'] = description
+        entry = _build_entry(u'http://example.com/', 'video/x-unknown',
+                additional)
+        return models.Item(FeedParserValues(entry), feed_id=self.feed.id)
+
+    def check_search_results(self, search_text, *correct_items):
+        correct_ids = [i.id for i in correct_items]
+        self.assertSameSet(self.index.search(search_text), correct_ids)
+
+    def test_search(self):
+        self.check_search_results('my', self.item1, self.item2)
+        self.check_search_results('MY SEC', self.item2)
+        self.check_search_results('"my first"', self.item1)
+        self.check_search_results('my -second', self.item1)
+        self.check_search_results('-my', self.item3)
+        self.check_search_results('', self.item1, self.item2, self.item3)
+        self.check_search_results('description', self.item2)
+        # we match word prefixes, not substrings
+        self.check_search_results('irst')
+        self.check_search_results('!!')
+
+    def test_ranking(self):
+        # matches in the name count more than matches in the description
+        self.assertEquals(self.index.search_ranked('first'),
+                [self.item1.id, self.item2.id])
+        # for equal matches, newer items come first
+        self.assertEquals(self.index.search_ranked('my'),
+                [self.item2.id, self.item1.id])
+
+    def test_pagination(self):
+        self.assertEquals(self.index.search_ranked('', 0, 2),
+                [self.item3.id, self.item2.id])
+        self.assertEquals(self.index.search_ranked('', 2, 2),
+                [self.item1.id])
+        self.assertEquals(self.index.search_ranked('first', 1),
+                [self.item2.id])
+
+    def test_ranking_id_list(self):
+        id_list = [self.item1.id, self.item3.id]
+        self.assertEquals(self.index.search_ranked('my', id_list=id_list),
+                [self.item1.id])
+        self.assertEquals(self.index.search_ranked('first', 0, 1,
+            id_list=id_list + [self.item2.id]), [self.item1.id])
+        self.index.FILTER_ID_LIMIT = 1
+        self.assertEquals(self.index.search_ranked('my', id_list=id_list),
+                [self.item1.id])
+        self.assertEquals(self.index.search_ranked('first', 1, 1,
+            id_list=id_list + [self.item2.id]), [self.item2.id])
+
+    def test_filter_ids(self):
+        id_list = [self.item3.id, self.item2.id, self.item1.id]
+        self.assertEquals(self.index.filter_ids(id_list, 'my'),
+                [self.item2.id, self.item1.id])
+        self.index.FILTER_ID_LIMIT = 1
+        self.assertEquals(self.index.filter_ids(id_list, 'my'),
+                [self.item2.id, self.item1.id])
+
+    def test_search_filter_ranking(self):
+        filterer = SharedIndexSearchFilter(self.index)
+        filterer.filter_initial_list([app.item_info_cache.get_info(i.id)
+            for i in (self.item1, self.item2, self.item3)])
+        self.assertEquals(filterer.calc_ranking(), None)
+        filterer.set_search('first')
+        self.assertEquals(filterer.calc_ranking(),
+                {self.item1.id: 0, self.item2.id: 1})
+        filterer.RANKED_PAGE_SIZE = 1
+        self.assertEquals(filterer.calc_ranking(), {self.item1.id: 0})
+
+    def test_track_changes(self):
+        item4 = self.make_item(u'my fourth item')
+        self.item1.set_title(u'new title')
+        self.item2.remove()
+        self.check_search_results('my', item4)
+        self.check_search_results('title', self.item1)
+
+    def test_save_and_load(self):
+        self.item1.set_title(u'new title')
+        self.index.close()
+        self.index = searchindex.FTSSearchIndex(self.index_path)
+        self.index.load()
+        self.check_search_results('title', self.item1)
+        self.check_search_results('my', self.item2)
+
+    def test_rebuild(self):
+        # if we don't close the index (for example, because Miro crashed),
+        # we should rebuild it.
+        self.index.disconnect()
+        self.item2.remove()
+        self.index = searchindex.FTSSearchIndex(self.index_path)
+        self.index.load()
+        self.check_search_results('my', self.item1)
+
+    def test_rebuild_after_save(self):
+        # periodic saves shouldn't make the index look like it was closed
+        self.index.save()
+        self.index.disconnect()
+        self.item2.remove()
+        self.index = searchindex.FTSSearchIndex(self.index_path)
+        self.index.load()
+        self.check_search_results('my', self.item1)
+
+class SharedIndexSearchFilterTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.feed = models.Feed(u'http://example.com/')
+        self.filterer = SharedIndexSearchFilter(app.search_index)
+        self.items = [self.make_item(title) for title in
+                (u'info one', u'info two', u'info three', u'info four')]
+        self.info1, self.info2, self.info3, self.info4 = [
+                self.make_info(item) for item in self.items]
+
+    def make_item(self, title):
+        additional = {'title': title}
+        entry = _build_entry(u'http://example.com/', 'video/x-unknown',
+                additional)
+        return models.Item(FeedParserValues(entry), feed_id=self.feed.id)
+
+    def make_info(self, item):
+        return app.item_info_cache.get_info(item.id)
+
+    def test_initial_list(self):
+        self.assertEquals(self.filterer.filter_initial_list(
+            [self.info1, self.info2]), [self.info1, self.info2])
+        self.filterer = SharedIndexSearchFilter(app.search_index)
+        self.filterer.set_search("two")
+        self.assertEquals(self.filterer.filter_initial_list(
+            [self.info1, self.info2]), [self.info2])
+        self.assertTrue(self.filterer.is_filtering())
+
+    def test_change_search(self):
+        self.filterer.filter_initial_list([self.info1, self.info2])
+        added, removed = self.filterer.set_search("two")
+        self.assertSameSet(added, [])
+        self.assertSameSet(removed, [self.info1.id])
+        added, removed = self.filterer.set_search("one")
+        self.assertSameSet(added, [self.info1])
+        self.assertSameSet(removed, [self.info2.id])
+        # items outside of our list shouldn't be added
+        added, removed = self.filterer.set_search("info")
+        self.assertSameSet(added, [self.info2])
+
+    def test_changes(self):
+        infos = [self.info1, self.info2, self.info3]
+        self.filterer.filter_initial_list(infos)
+        self.filterer.set_search("three")
+        self.items[0].set_title(u'three')
+        self.info1 = self.make_info(self.items[0])
+        added, changed, removed = self.filterer.filter_changes(
+                [self.info4], [self.info1, self.info3], [self.info2.id])
+        self.assertSameSet(added, [self.info1])
+        self.assertSameSet(changed, [self.info3])
+        self.assertSameSet(removed, [])
+        self.items[0].set_title(u'one')
+        self.info1 = self.make_info(self.items[0])
+        added, changed, removed = self.filterer.filter_changes(
+                [], [self.info1], [self.info3.id])
+        self.assertSameSet(added, [])
+        self.assertSameSet(changed, [])
+        self.assertSameSet(removed, [self.info1.id, self.info3.id])
+        self.assertEquals(self.filterer.matching_ids, set())
+
+    def test_no_ranking(self):
+        # SearchIndex can't rank matches, so we keep the normal sort
+        self.filterer.filter_initial_list([self.info1, self.info2])
+        self.filterer.set_search("two")
+        self.assertEquals(self.filterer.calc_ranking(), None)
@@ -9,6 +9,7 @@ from miro import databaseupgrade
 from miro import dialogs
 from miro import downloader
 from miro import item
+from miro import prefs
 from miro import feed
 from miro import folder
 from miro import widgetstate
@@ -279,6 +280,60 @@ class DiskTest(FakeSchemaTest):
         self.reload_test_database()
         self.check_database()
 
+    def test_update_batching(self):
+        self.joe.name = u'JO MAMA'
+        self.joe.signal_change()
+        self.joe.age = 15
+        self.joe.signal_change()
+        self.lee.name = u'LEE'
+        self.lee.signal_change()
+        # the updates should be queued up, with joe's changes merged
+        self.assertEquals(len(app.db._pending_updates), 2)
+        joe_changes = app.db._pending_updates[self.joe.id][1]
+        self.assert_('name' in joe_changes)
+        self.assert_('age' in joe_changes)
+        # queries should see the changes
+        view = RestorableHuman.make_view("name='JO MAMA' AND age=15")
+        self.assertEquals(view.count(), 1)
+        self.assertEquals(app.db._pending_updates, {})
+        self.reload_test_database()
+        self.check_database()
+
+    def test_update_missing_row(self):
+        # UPDATEs run later than update_obj(), so a missing row isn't an
+        # error for the caller.  We call failed_soft() instead.
+        table_name = app.db._schema_map[self.joe.__class__].table_name
+        app.db.cursor.execute("DELETE FROM %s WHERE id=?" % table_name,
+                (self.joe.id,))
+        self.joe.name = u'JO MAMA'
+        self.joe.signal_change()
+        self.lee.name = u'LEE'
+        self.lee.signal_change()
+        app.controller.failed_soft_okay = True
+        self.reset_failed_soft_count()
+        app.db.finish_transaction()
+        self.check_failed_soft_count(1)
+        self.assertEquals(app.db._pending_updates, {})
+
+    def test_update_sql_cached(self):
+        self.joe.name = u'JO MAMA'
+        self.joe.signal_change()
+        self.lee.name = u'LEE'
+        self.lee.signal_change()
+        app.db.finish_transaction()
+        # joe and lee use different tables, but lee2 should use the same SQL
+        # as lee
+        lee2 = Human(u"lee2", 25, 1.4, [], {})
+        lee2.name = u'LEE2'
+        lee2.signal_change()
+        app.db.finish_transaction()
+        self.assertEquals(len(app.db._update_sql_cache), 2)
+        for sql in app.db._update_sql_cache.values():
+            self.assert_(sql.endswith('WHERE id=?'))
+        self.db.append(lee2)
+        self.reload_test_database()
+        self.check_database()
+
     def test_binary_reload(self):
         self.joe.id_code = 'abc'
         self.joe.signal_change()
@@ -470,6 +525,59 @@ class DiskTest(FakeSchemaTest):
         lee_view = Human.make_view("id=?", values=(lee.id,))
         self.assertEquals(lee_view.count(), 0)
 
+class WALTest(DiskTest):
+    # runs all the DiskTest tests with WAL journaling on
+    wal_mode = True
+
+    def reload_test_database(self, version=0):
+        # setUp() opens the database before we could change the prefs, so
+        # set them each time instead
+        app.config.set(prefs.SQLITE_WAL_MODE, self.wal_mode)
+        app.config.set(prefs.SQLITE_SYNCHRONOUS, u'NORMAL')
+        DiskTest.reload_test_database(self, version)
+
+    def test_journal_mode(self):
+        app.db.cursor.execute("PRAGMA journal_mode")
+        self.assertEquals(app.db.cursor.fetchone()[0].lower(), 'wal')
+        app.db.cursor.execute("PRAGMA synchronous")
+        self.assertEquals(app.db.cursor.fetchone()[0], 1) # NORMAL
+        self.assert_(app.db._checkpointer is not None)
+
+    def test_wal_checkpointed_on_close(self):
+        self.joe.name = u'JO MAMA'
+        self.joe.signal_change()
+        app.db.finish_transaction()
+        self.assert_(os.path.exists(self.save_path + '-wal'))
+        app.db.close()
+        self.assert_(not os.path.exists(self.save_path + '-wal'))
+        self.reload_test_database()
+        self.check_database()
+
+    def test_reporting_select(self):
+        def select_names():
+            rows = Human.select(['name'], 'age=?', (25,), reporting=True)
+            return [r[0] for r in rows]
+        # commit the objects from setUp() so the reporting connection sees
+        # them
+        app.db.finish_transaction()
+        self.assertEquals(select_names(), [u'lee'])
+        self.assert_(app.db._reporting_connection is not None)
+        # uncommitted changes aren't visible to the reporting connection, so
+        # we should fall back to the main one.
+        self.lee.name = u'LEE'
+        self.lee.signal_change()
+        self.assertEquals(select_names(), [u'LEE'])
+        app.db.finish_transaction()
+        self.assertEquals(select_names(), [u'LEE'])
+
+    def test_wal_disabled(self):
+        self.wal_mode = False
+        self.reload_test_database()
+        app.db.cursor.execute("PRAGMA journal_mode")
+        self.assertEquals(app.db.cursor.fetchone()[0].lower(), 'persist')
+        self.assert_(app.db._checkpointer is None)
+        self.check_database()
+
 class ObjectMemoryTest(FakeSchemaTest):
     def test_remove_remove_object_map(self):
         self.reload_test_database()
@@ -550,6 +658,65 @@ class CorruptReprTest(FakeSchemaTest):
                               "WHERE name='ben'")
         self.assertRaises(SyntaxError, self.reload_object, self.ben)
 
+class LazyColumnTest(FakeSchemaTest):
+    def setUp(self):
+        HumanSchema.lazy_fields = ('stuff', 'id_code')
+        FakeSchemaTest.setUp(self)
+        self.lee2 = Human(u"lee2", 25, 1.4, [], {}, car=u'honda')
+        app.db.finish_transaction()
+        self.clear_ddb_object_cache()
+
+    def tearDown(self):
+        del HumanSchema.lazy_fields
+        FakeSchemaTest.tearDown(self)
+
+    def get_humans(self):
+        humans = dict((h.name, h) for h in Human.make_view())
+        return humans[u'lee'], humans[u'lee2']
+
+    def test_lazy_restore(self):
+        lee, lee2 = self.get_humans()
+        self.assert_('stuff' not in lee.__dict__)
+        self.assertEquals(lee.high_scores, {u'virtual bowling': 212})
+        self.assertEquals(lee.stuff, {})
+        self.assertEquals(lee.id_code, None)
+        self.assert_('_lazy_column_loader' not in lee.__dict__)
+        # objects restored together should be loaded together
+        self.assertEquals(lee2.__dict__['stuff'], {'car': u'honda'})
+
+    def test_update_unloaded(self):
+        lee, lee2 = self.get_humans()
+        lee.name = u'LEE'
+        lee.signal_change()
+        app.db.finish_transaction()
+        self.assert_('stuff' not in lee.__dict__)
+        lee = self.reload_object(lee)
+        self.assertEquals(lee.name, u'LEE')
+        self.assertEquals(lee.stuff, {})
+
+    def test_set_before_load(self):
+        lee, lee2 = self.get_humans()
+        lee.stuff = {'a': 1}
+        self.assertEquals(lee.id_code, None)
+        self.assertEquals(lee.stuff, {'a': 1})
+        lee.signal_change()
+        app.db.finish_transaction()
+        lee = self.reload_object(lee)
+        self.assertEquals(lee.stuff, {'a': 1})
+
+    def test_remove(self):
+        lee, lee2 = self.get_humans()
+        lee2.remove()
+        self.assertEquals(lee2.stuff, {'car': u'honda'})
+
+    def test_malformed_lazy_column(self):
+        app.db.cursor.execute("UPDATE human SET stuff='{baddata' "
+                              "WHERE name='lee'")
+        lee, lee2 = self.get_humans()
+        self.assertEqual(lee.stuff, 'testing123')
+        app.db.cursor.execute("SELECT stuff from human WHERE name='lee'")
+        self.assertEqual(app.db.cursor.fetchone()[0], "'testing123'")
+
 class ConverterTest(StoreDatabaseTest):
     def test_convert_repr(self):
         converter = storedatabase.SQLiteConverter()
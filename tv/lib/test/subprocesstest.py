@@ -1,12 +1,14 @@
 import os
 import time
 import Queue
+from cStringIO import StringIO
 
 from miro import app
+from miro import prefs
 from miro import subprocessmanager
 from miro import workerprocess
 from miro.plat import resources
-from miro.test.framework import EventLoopTest
+from miro.test.framework import EventLoopTest, MiroTestCase
 
 # setup some test messages/handlers
 class TestSubprocessHandler(subprocessmanager.SubprocessHandler):
@@ -25,6 +27,9 @@ class TestSubprocessHandler(subprocessmanager.SubprocessHandler):
     def handle_ping(self, msg):
         Pong().send_to_main_process()
 
+    def handle_echo(self, msg):
+        EchoReply(msg.data).send_to_main_process()
+
     def handle_force_exception(self, msg):
         1/0
 
@@ -34,6 +39,7 @@ class TestSubprocessResponder(subprocessmanager.SubprocessResponder):
         self.events_saw = []
         self.subprocess_events_saw = []
         self.pong_count = 0
+        self.echo_replies = []
         self.break_on_pong = False
         self.subprocess_ready = False
 
@@ -46,11 +52,17 @@ class TestSubprocessResponder(subprocessmanager.SubprocessResponder):
     def on_shutdown(self):
         self.events_saw.append("shutdown")
 
+    def on_quit(self):
+        self.events_saw.append("quit")
+
     def handle_pong(self, msg):
         if self.break_on_pong:
             1/0
         self.pong_count += 1
 
+    def handle_echo_reply(self, msg):
+        self.echo_replies.append(msg.data)
+
     def handle_saw_event(self, msg):
         self.subprocess_events_saw.append(msg.event)
         if msg.event == 'startup':
@@ -65,6 +77,10 @@ class Ping(TestMessage):
 class ForceException(TestMessage):
     pass
 
+class Echo(TestMessage):
+    def __init__(self, data):
+        self.data = data
+
 class Pong(subprocessmanager.SubprocessResponse):
     pass
 
@@ -72,8 +88,73 @@ class SawEvent(subprocessmanager.SubprocessResponse):
     def __init__(self, event):
         self.event = event
 
+class EchoReply(subprocessmanager.SubprocessResponse):
+    def __init__(self, data):
+        self.data = data
+
 # Actual tests go below here
 
+class PipeProtocolTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        subprocessmanager.ipc_stats.reset()
+
+    def send_and_load(self, obj):
+        pipe = StringIO()
+        subprocessmanager._dump_obj(obj, pipe)
+        pipe.seek(0)
+        return subprocessmanager._load_obj(pipe), pipe.getvalue()
+
+    def test_small_message(self):
+        msg, pipe_data = self.send_and_load(Echo('abc'))
+        self.assertEquals(msg.data, 'abc')
+
+    def test_large_message(self):
+        data = 'a' * subprocessmanager.LARGE_MESSAGE_SIZE
+        msg, pipe_data = self.send_and_load(Echo(data))
+        self.assertEquals(msg.data, data)
+        # the data should have gone through a temporary file, which the
+        # reader deletes
+        self.assert_(len(pipe_data) < 1024)
+        path = pipe_data[subprocessmanager._HEADER.size:]
+        self.assert_(not os.path.exists(path))
+
+    def test_large_message_temp_dir(self):
+        temp_dir = self.make_temp_dir_path()
+        data = 'a' * subprocessmanager.LARGE_MESSAGE_SIZE
+        pipe = StringIO()
+        subprocessmanager._dump_obj(Echo(data), pipe, temp_dir)
+        path = pipe.getvalue()[subprocessmanager._HEADER.size:]
+        self.assertEquals(os.path.dirname(path), temp_dir)
+        pipe.seek(0)
+        self.assertEquals(subprocessmanager._load_obj(pipe).data, data)
+
+    def test_corrupt_data(self):
+        pipe = StringIO()
+        subprocessmanager._dump_obj(Echo('abc'), pipe)
+        pipe.seek(0)
+        pipe.write('x')
+        pipe.seek(0)
+        self.assertRaises(subprocessmanager.LoadError,
+                subprocessmanager._load_obj, pipe)
+        pipe = StringIO()
+        subprocessmanager._dump_obj(Echo('abc'), pipe)
+        truncated = StringIO(pipe.getvalue()[:-1])
+        self.assertRaises(subprocessmanager.LoadError,
+                subprocessmanager._load_obj, truncated)
+
+    def test_stats(self):
+        self.send_and_load(Echo('abc'))
+        self.send_and_load(Echo('abcdef'))
+        self.send_and_load(None)
+        stats = subprocessmanager.ipc_stats.get_stats()
+        self.assertEquals(stats['sent'].keys(), ['Echo'])
+        self.assertEquals(stats['received'].keys(), ['Echo'])
+        count, byte_count, total_time, max_time = stats['sent']['Echo']
+        self.assertEquals(count, 2)
+        self.assertEquals(stats['received']['Echo'][:2],
+                (count, byte_count))
+
 class SubprocessManagerTest(EventLoopTest):
     # FIXME: we should have a better way of waiting for the subprocess to do
     # things, than calling runEventLoop() with an arbitrary timeout.
@@ -134,6 +215,14 @@ class SubprocessManagerTest(EventLoopTest):
         # check that we got a pong for each ping
         self.assertEquals(self.responder.pong_count, 3)
 
+    def test_large_message(self):
+        # test sending messages big enough to go through a temporary file
+        data = 'a' * (subprocessmanager.LARGE_MESSAGE_SIZE * 2)
+        Echo(data).send_to_process()
+        Echo('abc').send_to_process()
+        self.runEventLoop(1.0, timeoutNormal=True)
+        self.assertEquals(self.responder.echo_replies, [data, 'abc'])
+
     def test_event_callbacks(self):
         # test that we get event callbacks
 
@@ -150,8 +239,9 @@ class SubprocessManagerTest(EventLoopTest):
         self._wait_for_subprocess_ready()
         # the subprocess should see a startup
         self.assertEqual(self.responder.subprocess_events_saw, ['startup'])
-        # the main process should see a startup and a restart
-        self.assertEqual(self.responder.events_saw, ['startup', 'restart'])
+        # the main process should see a quit, a startup and a restart
+        self.assertEqual(self.responder.events_saw,
+                ['quit', 'startup', 'restart'])
 
         # check that on_shutdown() gets called on both sides
         self.responder.events_saw = []
@@ -177,6 +267,20 @@ class SubprocessManagerTest(EventLoopTest):
         # test that the original thread is gone
         self.assert_(not old_thread.is_alive())
 
+    def test_temp_dir_cleanup(self):
+        # test that we remove the temp dir for large messages when the
+        # process restarts or quits
+        old_temp_dir = self.subprocess.temp_dir
+        self.assert_(os.path.isdir(old_temp_dir))
+        self.subprocess.process.terminate()
+        self.responder.subprocess_ready = False
+        self._wait_for_subprocess_ready()
+        self.assert_(not os.path.exists(old_temp_dir))
+        temp_dir = self.subprocess.temp_dir
+        self.assert_(os.path.isdir(temp_dir))
+        self.subprocess.shutdown()
+        self.assert_(not os.path.exists(temp_dir))
+
     def test_subprocess_exception(self):
         # check that subprocess handler exceptions don't break things
         original_pid = self.subprocess.process.pid
@@ -207,8 +311,10 @@ class WorkerProcessTest(EventLoopTest):
     def setUp(self):
         EventLoopTest.setUp(self)
         # override the normal handler class with our own
-        workerprocess._subprocess_manager.handler_class = (
+        workerprocess._worker_pool.handler_class = (
                 UnittestWorkerProcessHandler)
+        workerprocess._task_queue.reset()
+        app.config.set(prefs.WORKER_PROCESS_COUNT, 2)
         self.result = self.error = None
 
     def callback(self, result):
@@ -250,16 +356,25 @@ class WorkerProcessTest(EventLoopTest):
         self.assertEquals(self.result, None)
         self.assert_(isinstance(self.error, ValueError))
 
+    def test_pool_size(self):
+        workerprocess.startup()
+        self.assertEquals(len(workerprocess._worker_pool.workers), 2)
+
+    def test_default_pool_size(self):
+        app.config.set(prefs.WORKER_PROCESS_COUNT, 0)
+        count = workerprocess._calc_worker_count()
+        self.assert_(1 <= count <= workerprocess.MAX_DEFAULT_WORKERS)
+
     def test_crash(self):
         # force a crash of our subprocess right after we send the task
         workerprocess.startup()
-        original_pid = workerprocess._subprocess_manager.process.pid
         self.send_feedparser_task()
-        workerprocess._subprocess_manager.process.terminate()
+        worker = workerprocess._task_queue.task_workers.values()[0]
+        original_pid = worker.process.pid
+        worker.process.terminate()
         self.runEventLoop(4.0)
         # check that we really restarted the subprocess
-        self.assertNotEqual(original_pid,
-                workerprocess._subprocess_manager.process.pid)
+        self.assertNotEqual(original_pid, worker.process.pid)
         self.check_successful_result()
 
     def test_queue_before_start(self):
@@ -271,3 +386,101 @@ class WorkerProcessTest(EventLoopTest):
         workerprocess.startup()
         self.runEventLoop(4.0)
         self.check_successful_result()
+
+class FakeWorker(object):
+    def __init__(self):
+        self.messages = []
+        self.is_running = True
+
+    def send_message(self, msg):
+        if not self.is_running:
+            raise ValueError("subprocess not running")
+        self.messages.append(msg)
+
+class TaskQueueTest(MiroTestCase):
+    """Test how TaskQueue spreads tasks between workers."""
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.queue = workerprocess.TaskQueue()
+        self.workers = [FakeWorker(), FakeWorker()]
+        self.results = []
+
+    def add_task(self):
+        msg = workerprocess.FeedparserTask('')
+        self.queue.add_task(msg, self.results.append, self.results.append)
+        return msg
+
+    def send_result(self, msg):
+        self.queue.process_result(workerprocess.TaskResult(msg.task_id,
+            msg.task_id))
+
+    def test_least_loaded(self):
+        for worker in self.workers:
+            self.queue.worker_started(worker)
+        for i in xrange(4):
+            self.add_task()
+        self.assertEquals(len(self.workers[0].messages), 2)
+        self.assertEquals(len(self.workers[1].messages), 2)
+        # finishing tasks on one worker should send new tasks there
+        for msg in self.workers[0].messages[:]:
+            self.send_result(msg)
+        self.add_task()
+        self.assertEquals(len(self.workers[0].messages), 3)
+        self.assertEquals(len(self.workers[1].messages), 2)
+        self.assertEquals(sorted(self.results),
+                sorted(msg.task_id for msg in self.workers[0].messages[:2]))
+
+    def test_queue_before_start(self):
+        tasks = [self.add_task() for i in xrange(2)]
+        self.queue.worker_started(self.workers[0])
+        self.assertEquals(self.workers[0].messages, tasks)
+
+    def test_restart(self):
+        for worker in self.workers:
+            self.queue.worker_started(worker)
+        for i in xrange(4):
+            self.add_task()
+        lost_tasks = self.workers[0].messages[:]
+        # when a worker restarts, only its tasks should be sent again
+        self.queue.worker_started(self.workers[0])
+        self.assertEquals(self.workers[0].messages, lost_tasks * 2)
+        self.assertEquals(len(self.workers[1].messages), 2)
+        # results from before the crash shouldn't be processed twice
+        self.send_result(lost_tasks[0])
+        self.send_result(lost_tasks[0])
+        self.assertEquals(self.results, [lost_tasks[0].task_id])
+
+    def test_stop(self):
+        for worker in self.workers:
+            self.queue.worker_started(worker)
+        tasks = [self.add_task() for i in xrange(4)]
+        # when a worker stops, its tasks should move to the other worker
+        self.queue.worker_stopped(self.workers[0])
+        self.assertEquals(sorted(msg.task_id
+                                 for msg in self.workers[1].messages),
+                          [msg.task_id for msg in tasks])
+        self.queue.all_workers_stopped()
+        self.queue.worker_started(self.workers[0])
+        self.assertEquals(self.workers[0].messages[-4:], tasks)
+
+    def test_quit(self):
+        old_task_queue = workerprocess._task_queue
+        workerprocess._task_queue = self.queue
+        try:
+            responders = []
+            for worker in self.workers:
+                responder = workerprocess.WorkerProcessResponder()
+                responder.worker = worker
+                responder.on_startup()
+                responders.append(responder)
+            tasks = [self.add_task() for i in xrange(2)]
+            # when a worker quits unexpectedly, its tasks should go to the
+            # other worker, and we shouldn't send it new ones.
+            self.workers[0].is_running = False
+            responders[0].on_quit()
+            tasks.append(self.add_task())
+            self.assertEquals(sorted(msg.task_id
+                                     for msg in self.workers[1].messages),
+                              [msg.task_id for msg in tasks])
+        finally:
+            workerprocess._task_queue = old_task_queue
@@ -0,0 +1,156 @@
+from miro.test.framework import MiroTestCase
+from miro.dl_daemon import download
+
+class FakeAlert(object):
+    def message(self):
+        return 'fake alert'
+
+class FakeLibtorrent(object):
+    """Stands in for the libtorrent module.
+
+    We can't create real alerts, so TorrentSession checks against these
+    classes instead.
+    """
+    class state_update_alert(FakeAlert):
+        def __init__(self, status):
+            self.status = status
+
+    class save_resume_data_alert(FakeAlert):
+        def __init__(self, handle, resume_data):
+            self.handle = handle
+            self.resume_data = resume_data
+
+    class save_resume_data_failed_alert(FakeAlert):
+        def __init__(self, handle):
+            self.handle = handle
+
+    def __init__(self):
+        self.bencode_hook = None
+
+    def bencode(self, data):
+        if self.bencode_hook is not None:
+            self.bencode_hook()
+        return 'bencoded:%s' % data
+
+class FakeSession(object):
+    def __init__(self):
+        self.alerts = []
+        self.posted_updates = 0
+
+    def pop_alerts(self):
+        alerts = self.alerts
+        self.alerts = []
+        return alerts
+
+    def post_torrent_updates(self):
+        self.posted_updates += 1
+
+class FakeHandle(object):
+    def __init__(self, info_hash):
+        self._info_hash = info_hash
+
+    def info_hash(self):
+        return self._info_hash
+
+class FakeStatus(object):
+    def __init__(self, handle):
+        self.handle = handle
+
+class FakeDownloader(object):
+    def __init__(self, info_hash):
+        self.info_hash = info_hash
+        self.handle = FakeHandle(info_hash)
+        self.statuses = []
+
+    def update_status(self, status=None):
+        self.statuses.append(status)
+
+class TorrentSessionAlertTest(MiroTestCase):
+    def setUp(self):
+        MiroTestCase.setUp(self)
+        self.saved_lt = download.lt
+        self.saved_save_fast_resume_data = download.save_fast_resume_data
+        download.lt = self.fake_lt = FakeLibtorrent()
+        download.save_fast_resume_data = self.save_fast_resume_data
+        self.saved_data = []
+        self.writer_starts = 0
+        self.torrent_session = download.TorrentSession()
+        self.torrent_session.session = FakeSession()
+        self.torrent_session.use_alerts = True
+        self.torrent_session._start_resume_data_writer = self.start_writer
+        self.downloader1 = self.add_downloader('a1')
+        self.downloader2 = self.add_downloader('b2')
+
+    def tearDown(self):
+        download.lt = self.saved_lt
+        download.save_fast_resume_data = self.saved_save_fast_resume_data
+        MiroTestCase.tearDown(self)
+
+    def add_downloader(self, info_hash):
+        downloader = FakeDownloader(info_hash)
+        info_hash_long = download.info_hash_to_long(info_hash)
+        self.torrent_session.info_hash_to_downloader[info_hash_long] = (
+            downloader)
+        return downloader
+
+    def save_fast_resume_data(self, info_hash, fast_resume_data):
+        self.saved_data.append((info_hash, fast_resume_data))
+
+    def start_writer(self):
+        self.writer_starts += 1
+
+    def send_alerts(self, *alerts):
+        self.torrent_session.session.alerts.extend(alerts)
+        self.torrent_session.update_torrents()
+
+    def test_state_update(self):
+        status1 = FakeStatus(self.downloader1.handle)
+        unknown_status = FakeStatus(FakeHandle('c3'))
+        self.send_alerts(FakeLibtorrent.state_update_alert(
+            [status1, unknown_status]))
+        self.assertEquals(self.downloader1.statuses, [status1])
+        self.assertEquals(self.downloader2.statuses, [])
+        self.assertEquals(self.torrent_session.session.posted_updates, 1)
+
+    def test_save_resume_data_alert(self):
+        self.send_alerts(
+            FakeLibtorrent.save_resume_data_alert(self.downloader1.handle,
+                                                  'data1'),
+            FakeLibtorrent.save_resume_data_alert(self.downloader2.handle,
+                                                  'data2'),
+            FakeLibtorrent.save_resume_data_failed_alert(
+                self.downloader2.handle))
+        # we only need 1 writer for both
+        self.assertEquals(self.writer_starts, 1)
+        self.assertEquals(self.saved_data, [])
+        self.torrent_session._write_resume_data()
+        self.assertSameSet(self.saved_data, [
+            ('a1', 'bencoded:data1'),
+            ('b2', 'bencoded:data2'),
+        ])
+        # once the writer finishes, new data starts a new one
+        self.torrent_session.queue_resume_data('a1', 'data3')
+        self.assertEquals(self.writer_starts, 2)
+
+    def test_latest_data_wins(self):
+        self.torrent_session.queue_resume_data('a1', 'old')
+        self.torrent_session.queue_resume_data('a1', 'new')
+        self.torrent_session._write_resume_data()
+        self.assertEquals(self.saved_data, [('a1', 'bencoded:new')])
+
+    def test_save_now_drops_queued_data(self):
+        self.torrent_session.queue_resume_data('a1', 'queued')
+        self.torrent_session.save_resume_data_now('a1', 'forced')
+        self.torrent_session._write_resume_data()
+        self.assertEquals(self.saved_data, [('a1', 'forced')])
+
+    def test_save_now_while_encoding(self):
+        # if we force a save after the writer popped its data, the older
+        # data shouldn't overwrite it
+        def bencode_hook():
+            self.fake_lt.bencode_hook = None
+            self.torrent_session.save_resume_data_now('a1', 'forced')
+        self.fake_lt.bencode_hook = bencode_hook
+        self.torrent_session.queue_resume_data('a1', 'queued')
+        self.torrent_session._write_resume_data()
+        self.assertEquals(self.saved_data, [('a1', 'forced')])
@@ -0,0 +1,650 @@
+# Miro - an RSS based video player application
+# Copyright (C) 2005, 2006, 2007, 2008, 2009, 2010, 2011
+# Participatory Culture Foundation
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link the code of portions of this program with the OpenSSL
+# library.
+#
+# You must obey the GNU General Public License in all respects for all of
+# the code used other than OpenSSL. If you modify file(s) with this
+# exception, you may extend this exception to your version of the file(s),
+# but you are not obligated to do so. If you do not wish to do so, delete
+# this exception statement from your version. If you delete this exception
+# statement from all source files in the program, then also delete it here.
+
+"""``miro.viewpredicate`` -- Evaluate View where clauses in python.
+
+ViewTracker needs to know if a single object is in its view each time that
+object changes.  Asking sqlite means running a COUNT(*) query for every
+tracker on every change, which adds up quickly when a feed update touches
+thousands of items.
+
+This module compiles the subset of SQL that our views use (=, !=, <, >, IN,
+IS NULL, LIKE, AND/OR/NOT and LEFT JOINs on the id of another table) into
+python functions that run against the DDBObjects that we already have in
+memory.
+
+The where clause is split at its top-level ANDs and each part is compiled
+separately.  Parts that we can't compile are kept as SQL and only checked
+with a query when all the compiled parts match.
+"""
+
+import datetime
+import re
+
+from miro import app
+
+class CompileError(ValueError):
+    """We can't compile part of a where clause."""
+    pass
+
+class CantEvaluate(StandardError):
+    """We can't evaluate a predicate for an object in memory.
+
+    This happens when a joined object isn't loaded, or when a value has a type
+    that we don't know how to handle.  Callers should fall back to running the
+    SQL query.
+    """
+    pass
+
+_token_re = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')|
+    (?P<number>\d+(?:\.\d*)?)|
+    (?P<placeholder>\?)|
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*)|
+    (?P<op>==|!=|<>|<=|>=|=|<|>)|
+    (?P<punct>[(),.])|
+    (?P<other>\S)""", re.VERBOSE)
+_whitespace_re = re.compile(r'\s*')
+_numeric_prefix_re = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+class Token(object):
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def is_keyword(self, *keywords):
+        return self.kind == 'name' and self.value.upper() in keywords
+
+    def is_punct(self, value):
+        return self.kind == 'punct' and self.value == value
+
+    def __repr__(self):
+        return 'Token(%s, %r)' % (self.kind, self.value)
+
+def tokenize(sql):
+    """Split a SQL expression into a list of Token objects."""
+    tokens = []
+    pos = _whitespace_re.match(sql).end()
+    while pos < len(sql):
+        m = _token_re.match(sql, pos)
+        tokens.append(Token(m.lastgroup, m.group(), m.start(), m.end()))
+        pos = _whitespace_re.match(sql, m.end()).end()
+    return tokens
+
+def split_conjuncts(tokens):
+    """Split a list of tokens at the top-level AND keywords.
+
+    If the expression isn't a plain list of ANDs (for example it has a
+    top-level OR), we return a single chunk with all the tokens.
+    """
+    depth = 0
+    chunks = [[]]
+    for token in tokens:
+        if token.is_punct('('):
+            depth += 1
+        elif token.is_punct(')'):
+            depth -= 1
+        elif depth == 0 and token.is_keyword('OR', 'BETWEEN', 'CASE'):
+            return [tokens]
+        elif depth == 0 and token.is_keyword('AND'):
+            chunks.append([])
+            continue
+        chunks[-1].append(token)
+    if [] in chunks:
+        return [tokens]
+    return chunks
+
+# SQL values and the 3-valued logic that goes with them.  None is used for
+# NULL.
+
+def _truth(value):
+    """Convert a value to True/False/None the way sqlite does in a boolean
+    context.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    elif isinstance(value, (int, long, float)):
+        return value != 0
+    elif isinstance(value, basestring):
+        # sqlite converts strings to numbers using their numeric prefix
+        m = _numeric_prefix_re.match(value)
+        return m is not None and float(m.group()) != 0
+    elif isinstance(value, datetime.datetime):
+        # stored as "YYYY-MM-DD ...", the year is always non-zero
+        return True
+    raise CantEvaluate("Can't convert %r to a boolean" % (value,))
+
+def _check_comparable(a, b):
+    # datetimes are stored as text in sqlite, don't try to compare them to
+    # anything except other datetimes.
+    if (isinstance(a, datetime.datetime) !=
+            isinstance(b, datetime.datetime)):
+        raise CantEvaluate("Can't compare %r and %r" % (a, b))
+
+def _eq(a, b):
+    return a == b
+
+def _ne(a, b):
+    return a != b
+
+def _lt(a, b):
+    return a < b
+
+def _le(a, b):
+    return a <= b
+
+def _gt(a, b):
+    return a > b
+
+def _ge(a, b):
+    return a >= b
+
+_comparison_ops = {
+    '=': _eq,
+    '==': _eq,
+    '!=': _ne,
+    '<>': _ne,
+    '<': _lt,
+    '<=': _le,
+    '>': _gt,
+    '>=': _ge,
+}
+
+_like_regex_cache = {}
+def _like_regex(pattern):
+    """Convert a LIKE pattern to a regex.
+
+    Like sqlite, matching is case-insensitive for ASCII characters only.
+    """
+    try:
+        return _like_regex_cache[pattern]
+    except KeyError:
+        pass
+    parts = []
+    for char in _sql_text(pattern):
+        if char == '%':
+            parts.append('.*')
+        elif char == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    regex = re.compile(''.join(parts) + '$', re.IGNORECASE | re.DOTALL)
+    _like_regex_cache[pattern] = regex
+    return regex
+
+def _sql_text(value):
+    if isinstance(value, basestring):
+        return value
+    elif isinstance(value, bool):
+        return unicode(int(value))
+    elif isinstance(value, (int, long, float)):
+        return unicode(value)
+    raise CantEvaluate("Can't convert %r to text" % (value,))
+
+# Node constructors.  Each returns a function that inputs a context dict
+# (table alias -> DDBObject or None) and returns a SQL value.
+
+def _constant_node(value):
+    def constant(context):
+        return value
+    return constant
+
+def _column_node(alias, attr):
+    def column(context):
+        obj = context[alias]
+        if obj is None:
+            # LEFT JOIN with no matching row
+            return None
+        try:
+            return getattr(obj, attr)
+        except AttributeError:
+            raise CantEvaluate("%s has no attribute %s" % (obj, attr))
+    return column
+
+def _and_node(children):
+    def and_(context):
+        rv = True
+        for child in children:
+            value = _truth(child(context))
+            if value is False:
+                return False
+            elif value is None:
+                rv = None
+        return rv
+    return and_
+
+def _or_node(children):
+    def or_(context):
+        rv = False
+        for child in children:
+            value = _truth(child(context))
+            if value is True:
+                return True
+            elif value is None:
+                rv = None
+        return rv
+    return or_
+
+def _not_node(child):
+    def not_(context):
+        value = _truth(child(context))
+        if value is None:
+            return None
+        return not value
+    return not_
+
+def _comparison_node(op, left, right):
+    func = _comparison_ops[op]
+    def comparison(context):
+        a = left(context)
+        b = right(context)
+        if a is None or b is None:
+            return None
+        _check_comparable(a, b)
+        return func(a, b)
+    return comparison
+
+def _is_null_node(child, negate):
+    def is_null(context):
+        return (child(context) is None) != negate
+    return is_null
+
+def _in_node(child, members, negate):
+    def in_(context):
+        value = child(context)
+        if value is None:
+            return None
+        saw_null = False
+        for member in members:
+            member_value = member(context)
+            if member_value is None:
+                saw_null = True
+                continue
+            _check_comparable(value, member_value)
+            if value == member_value:
+                return not negate
+        if saw_null:
+            return None
+        return negate
+    return in_
+
+def _like_node(child, pattern, negate):
+    def like(context):
+        value = child(context)
+        pattern_value = pattern(context)
+        if value is None or pattern_value is None:
+            return None
+        matched = _like_regex(pattern_value).match(_sql_text(value))
+        return (matched is not None) != negate
+    return like
+
+class ColumnResolver(object):
+    """Map column references in SQL to (alias, attribute) pairs.
+
+    :param table_name: table that the view selects from
+    :param joins: joins dict passed to View
+    """
+    def __init__(self, table_name, joins):
+        self.table_name = table_name.lower()
+        self.columns = {}
+        self.join_keys = {}
+        self._add_table(self.table_name, table_name)
+        if joins is not None:
+            for join_table, join_where in joins.items():
+                self._add_join(join_table, join_where)
+
+    def _add_table(self, alias, table_name):
+        try:
+            column_names = app.db.column_names(table_name)
+        except KeyError:
+            raise CompileError("Unknown table: %s" % table_name)
+        self.columns[alias] = dict((name.lower(), name)
+                for name in column_names)
+
+    def _add_join(self, join_table, join_where):
+        parts = join_table.split()
+        if len(parts) == 1:
+            table_name = alias = parts[0]
+        elif len(parts) == 2:
+            table_name, alias = parts
+        elif len(parts) == 3 and parts[1].upper() == 'AS':
+            table_name, alias = parts[0], parts[2]
+        else:
+            return
+        alias = alias.lower()
+        try:
+            self._add_table(alias, table_name)
+        except CompileError:
+            return
+        # We can handle joins on the id column of the joined table where the
+        # other side is a column of our table.  For those, we store the
+        # attribute that holds the id of the joined object.  Other joins
+        # stay in self.columns, but can't be used by compiled expressions.
+        tokens = tokenize(join_where)
+        if len(tokens) == 7 and tokens[3].kind == 'op':
+            sides = (tokens[:3], tokens[4:])
+        elif len(tokens) == 5 and tokens[1].kind == 'op':
+            sides = (tokens[:1], tokens[2:])
+        elif len(tokens) == 5 and tokens[3].kind == 'op':
+            sides = (tokens[:3], tokens[4:])
+        else:
+            return
+        if tokens[len(sides[0])].value not in ('=', '=='):
+            return
+        for joined_side, our_side in (sides, reversed(sides)):
+            if (len(joined_side) == 3 and
+                    joined_side[0].value.lower() == alias and
+                    joined_side[2].value.lower() == 'id'):
+                try:
+                    our_alias, attr = self._resolve_tokens(our_side)
+                except CompileError:
+                    return
+                if our_alias == self.table_name:
+                    self.join_keys[alias] = attr
+                return
+
+    def _resolve_tokens(self, tokens):
+        if len(tokens) == 1 and tokens[0].kind == 'name':
+            return self.resolve(None, tokens[0].value)
+        elif (len(tokens) == 3 and tokens[0].kind == 'name' and
+                tokens[1].is_punct('.') and tokens[2].kind == 'name'):
+            return self.resolve(tokens[0].value, tokens[2].value)
+        raise CompileError("Can't resolve %s" % tokens)
+
+    def resolve(self, qualifier, column):
+        """Resolve a column reference.
+
+        :returns: (alias, attribute_name) tuple
+        :raises CompileError: the column can't be found
+        """
+        column = column.lower()
+        if qualifier is not None:
+            alias = qualifier.lower()
+            if alias not in self.columns:
+                raise CompileError("Unknown table: %s" % qualifier)
+        elif column in self.columns[self.table_name]:
+            alias = self.table_name
+        else:
+            matches = [a for a, cols in self.columns.items()
+                    if column in cols]
+            if len(matches) != 1:
+                raise CompileError("Can't resolve column: %s" % column)
+            alias = matches[0]
+        try:
+            return alias, self.columns[alias][column]
+        except KeyError:
+            raise CompileError("Unknown column: %s.%s" % (alias, column))
+
+    def can_fetch(self, alias):
+        return alias == self.table_name or alias in self.join_keys
+
+class Parser(object):
+    """Parse a list of tokens into a node function.
+
+    :param tokens: list of tokens to parse
+    :param values: values to use for the ? placeholders in tokens
+    :param resolver: ColumnResolver to use
+    """
+    def __init__(self, tokens, values, resolver):
+        self.tokens = tokens
+        self.values = values
+        self.resolver = resolver
+        self.pos = 0
+        self.placeholder_index = 0
+        self.columns = set()
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise CompileError("Unexpected token: %r" % self.peek())
+        return node
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise CompileError("Unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def accept_keyword(self, *keywords):
+        token = self.peek()
+        if token is not None and token.is_keyword(*keywords):
+            self.pos += 1
+            return True
+        return False
+
+    def accept_punct(self, value):
+        token = self.peek()
+        if token is not None and token.is_punct(value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_punct(self, value):
+        if not self.accept_punct(value):
+            raise CompileError("Expected %r, got %r" % (value, self.peek()))
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.accept_keyword('OR'):
+            children.append(self.parse_and())
+        if len(children) == 1:
+            return children[0]
+        return _or_node(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.accept_keyword('AND'):
+            children.append(self.parse_not())
+        if len(children) == 1:
+            return children[0]
+        return _and_node(children)
+
+    def parse_not(self):
+        if self.accept_keyword('NOT'):
+            return _not_node(self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        token = self.peek()
+        if token is None:
+            return left
+        if token.kind == 'op':
+            self.pos += 1
+            return _comparison_node(token.value, left, self.parse_operand())
+        if self.accept_keyword('IS'):
+            negate = self.accept_keyword('NOT')
+            if not self.accept_keyword('NULL'):
+                raise CompileError("Only IS NULL is supported")
+            return _is_null_node(left, negate)
+        negate = self.accept_keyword('NOT')
+        if self.accept_keyword('IN'):
+            return _in_node(left, self.parse_in_list(), negate)
+        if self.accept_keyword('LIKE'):
+            node = _like_node(left, self.parse_operand(), negate)
+            if self.peek() is not None and self.peek().is_keyword('ESCAPE'):
+                raise CompileError("LIKE ... ESCAPE not supported")
+            return node
+        if negate:
+            raise CompileError("Unexpected NOT")
+        return left
+
+    def parse_in_list(self):
+        self.expect_punct('(')
+        if self.peek() is not None and self.peek().is_keyword('SELECT'):
+            raise CompileError("Subqueries not supported")
+        members = [self.parse_operand()]
+        while self.accept_punct(','):
+            members.append(self.parse_operand())
+        self.expect_punct(')')
+        return members
+
+    def parse_operand(self):
+        token = self.next()
+        if token.is_punct('('):
+            node = self.parse_or()
+            self.expect_punct(')')
+            return node
+        elif token.kind == 'string':
+            return _constant_node(token.value[1:-1].replace("''", "'"))
+        elif token.kind == 'number':
+            if '.' in token.value:
+                return _constant_node(float(token.value))
+            return _constant_node(int(token.value))
+        elif token.kind == 'placeholder':
+            value = self.values[self.placeholder_index]
+            self.placeholder_index += 1
+            return _constant_node(value)
+        elif token.is_keyword('NULL'):
+            return _constant_node(None)
+        elif token.kind == 'name':
+            if token.is_keyword('SELECT', 'EXISTS', 'CASE', 'AND', 'OR',
+                    'NOT', 'IN', 'IS', 'LIKE'):
+                raise CompileError("Unexpected keyword: %s" % token.value)
+            if self.accept_punct('.'):
+                column = self.next()
+                if column.kind != 'name':
+                    raise CompileError("Bad column reference")
+                alias, attr = self.resolver.resolve(token.value, column.value)
+            else:
+                if self.peek() is not None and self.peek().is_punct('('):
+                    raise CompileError("Functions not supported")
+                alias, attr = self.resolver.resolve(None, token.value)
+            if not self.resolver.can_fetch(alias):
+                raise CompileError("Can't fetch objects for %s" % alias)
+            self.columns.add((alias, attr))
+            return _column_node(alias, attr)
+        raise CompileError("Unexpected token: %r" % token)
+
+class ViewPredicate(object):
+    """Compiled version of a View's where clause.
+
+    Member variables:
+
+    * ``residual_where`` -- SQL for the parts of the where clause that we
+      couldn't compile, or None if we compiled everything
+    * ``residual_values`` -- values for residual_where
+    * ``columns`` -- set of (alias, attribute) pairs used by the compiled
+      clauses
+    """
+
+    def __init__(self, table_name, where, values, joins):
+        self.table_name = table_name.lower()
+        self.clauses = []
+        self.residual_where = None
+        self.residual_values = ()
+        self.join_keys = []
+        self.columns = set()
+        if where is None:
+            return
+        try:
+            resolver = ColumnResolver(table_name, joins)
+        except CompileError:
+            self.residual_where = where
+            self.residual_values = values
+            return
+        residual_parts = []
+        residual_values = []
+        value_pos = 0
+        for chunk in split_conjuncts(tokenize(where)):
+            placeholder_count = len([t for t in chunk
+                if t.kind == 'placeholder'])
+            chunk_values = values[value_pos:value_pos+placeholder_count]
+            value_pos += placeholder_count
+            parser = Parser(chunk, chunk_values, resolver)
+            try:
+                self.clauses.append(parser.parse())
+            except (CompileError, IndexError):
+                residual_parts.append(where[chunk[0].start:chunk[-1].end])
+                residual_values.extend(chunk_values)
+            else:
+                self.columns.update(parser.columns)
+        if residual_parts:
+            self.residual_where = ' AND '.join('(%s)' % part
+                    for part in residual_parts)
+            self.residual_values = tuple(residual_values)
+        aliases = set(alias for alias, attr in self.columns)
+        aliases.discard(self.table_name)
+        self.join_keys = [(alias, resolver.join_keys[alias])
+                for alias in aliases]
+
+    def is_fully_compiled(self):
+        return self.residual_where is None
+
+    def dependencies(self):
+        """Get the attributes that our where clause depends on.
+
+        :returns: frozenset of attribute names of objects in our table, or
+            None if the result could depend on something else (joined
+            tables, or SQL that we couldn't compile).
+        """
+        if self.residual_where is not None or self.join_keys:
+            return None
+        return frozenset(attr for alias, attr in self.columns)
+
+    def _make_context(self, obj):
+        context = {self.table_name: obj}
+        for alias, attr in self.join_keys:
+            try:
+                joined_id = getattr(obj, attr)
+            except AttributeError:
+                raise CantEvaluate("%s has no attribute %s" % (obj, attr))
+            if joined_id is None:
+                context[alias] = None
+            else:
+                try:
+                    context[alias] = app.db.get_obj_by_id(joined_id)
+                except KeyError:
+                    raise CantEvaluate("object %s not loaded" % joined_id)
+        return context
+
+    def matches(self, obj):
+        """Check if an object matches all the compiled parts of our where
+        clause.
+
+        If this returns True and residual_where is not None, then the caller
+        still needs to check residual_where with a SQL query.
+
+        :raises CantEvaluate: we can't check obj in python
+        """
+        if not self.clauses:
+            return True
+        context = self._make_context(obj)
+        for clause in self.clauses:
+            if _truth(clause(context)) is not True:
+                return False
+        return True
@@ -27,16 +27,25 @@
 # this exception statement from your version. If you delete this exception
 # statement from all source files in the program, then also delete it here.
 
-"""```workerprocess.py``` -- Miro worker subprocess
+"""```workerprocess.py``` -- Miro worker subprocesses
 
 To avoid UI freezing due to the GIL, we farm out all CPU-intensive backend
-tasks to this process.  See #17328 for more details.  Right now this just
+tasks to worker processes.  See #17328 for more details.  Right now this just
 includes feedparser, but we could pretty easily extend this to other tasks.
+
+We run a pool of worker processes, by default one for each CPU up to
+MAX_DEFAULT_WORKERS (see the WORKER_PROCESS_COUNT pref), so that things like
+updating hundreds of feeds at startup don't have to wait on a single
+process.
 """
 
 import itertools
+import logging
+import multiprocessing
 
+from miro import app
 from miro import feedparserutil
+from miro import prefs
 from miro import subprocessmanager
 from miro import util
 
@@ -70,15 +79,32 @@ class WorkerProcessHandler(subprocessmanager.SubprocessHandler):
         TaskResult(msg.task_id, rv).send_to_main_process()
 
     def handle_feedparser_task(self, msg):
-        parsed_feed =  feedparserutil.parse(msg.html)
+        parsed_feed =  feedparserutil.parse_to_values(msg.html)
         # bozo_exception is sometimes C object that is not picklable.  We
         # don't use it anyways, so just unset the value
         parsed_feed['bozo_exception'] = None
         return parsed_feed
 
 class WorkerProcessResponder(subprocessmanager.SubprocessResponder):
+    """Handles messages from one of our worker processes.
+
+    :attribute worker: SubprocessManager for the worker process
+    """
+    def __init__(self):
+        subprocessmanager.SubprocessResponder.__init__(self)
+        self.worker = None
+
     def on_startup(self):
-        _task_queue.run_pending_tasks()
+        _task_queue.worker_started(self.worker)
+
+    def on_shutdown(self):
+        _task_queue.worker_stopped(self.worker)
+
+    def on_quit(self):
+        # Stop sending tasks to the worker, and send the ones it was working
+        # on to the other workers.  If it's restarting, on_startup() adds it
+        # back.
+        _task_queue.worker_stopped(self.worker)
 
     def handle_task_result(self, msg):
         _task_queue.process_result(msg)
@@ -86,45 +112,154 @@ class WorkerProcessResponder(subprocessmanager.SubprocessResponder):
 # Manage task queue
 
 class TaskQueue(object):
+    """Tracks the tasks that we send to our worker processes.
+
+    Each task gets sent to a single worker, the running worker with the
+    fewest tasks in progress.  If a worker crashes or is shut down, we only
+    resend the tasks that it was working on.  If no workers are running, we
+    hold on to tasks until one starts up.
+    """
     def __init__(self):
-        # maps task_ids to (msg, callback, errback) tuples
-        self.tasks_in_progress = {}
+        self.reset()
 
     def reset(self):
+        # maps task_ids to (msg, callback, errback) tuples
         self.tasks_in_progress = {}
+        # maps running workers -> set of ids for the tasks we sent them
+        self.worker_tasks = {}
+        # maps task_ids -> worker that we sent the task to
+        self.task_workers = {}
+        # ids for tasks that are waiting for a worker to start
+        self.unassigned_tasks = []
 
     def add_task(self, msg, callback, errback):
         """Add a new task to the queue."""
         self.tasks_in_progress[msg.task_id] = (msg, callback, errback)
-        if _subprocess_manager.is_running:
-            msg.send_to_process()
+        self._dispatch(msg.task_id)
+
+    def _dispatch(self, task_id):
+        """Send a task to the least loaded worker."""
+        if not self.worker_tasks:
+            self.unassigned_tasks.append(task_id)
+            return
+        worker = min(self.worker_tasks,
+                key=lambda w: len(self.worker_tasks[w]))
+        self.worker_tasks[worker].add(task_id)
+        self.task_workers[task_id] = worker
+        msg = self.tasks_in_progress[task_id][0]
+        worker.send_message(msg)
+
+    def _dispatch_tasks(self, task_ids):
+        # send older tasks first
+        for task_id in sorted(task_ids):
+            self._dispatch(task_id)
 
     def process_result(self, reply):
-        """Process a TaskResult from our subprocess."""
-        msg, callback, errback = self.tasks_in_progress.pop(reply.task_id)
+        """Process a TaskResult from one of our workers."""
+        worker = self.task_workers.pop(reply.task_id, None)
+        if worker in self.worker_tasks:
+            self.worker_tasks[worker].discard(reply.task_id)
+        try:
+            msg, callback, errback = self.tasks_in_progress.pop(reply.task_id)
+        except KeyError:
+            # We already handled a result for this task.  This can happen
+            # when a worker sends a result, then crashes before we process
+            # it.
+            logging.warn("Got result for unknown task: %s", reply.task_id)
+            return
         if isinstance(reply.result, Exception):
             errback(reply.result)
         else:
             callback(reply.result)
 
-    def run_pending_tasks(self):
-        """Rerun all tasks in the queue."""
-        for msg, callback, errback in self.tasks_in_progress.values():
-            msg.send_to_process()
+    def _remove_worker(self, worker):
+        """Stop tracking a worker.
+
+        :returns: ids for the tasks that the worker was working on
+        """
+        task_ids = self.worker_tasks.pop(worker, set())
+        for task_id in task_ids:
+            del self.task_workers[task_id]
+        return task_ids
+
+    def worker_started(self, worker):
+        """Call this when a worker starts up or restarts.
+
+        If the worker restarted after a crash, the tasks it was working on
+        got lost, so we send them out again.
+        """
+        lost_tasks = self._remove_worker(worker)
+        self.worker_tasks[worker] = set()
+        unassigned_tasks = self.unassigned_tasks
+        self.unassigned_tasks = []
+        self._dispatch_tasks(lost_tasks.union(unassigned_tasks))
+
+    def worker_stopped(self, worker):
+        """Call this when a worker shuts down.
+
+        We send the tasks it was working on to the other workers.
+        """
+        self._dispatch_tasks(self._remove_worker(worker))
+
+    def all_workers_stopped(self):
+        """Call this when all the workers are about to shut down."""
+        for worker in self.worker_tasks.keys():
+            self.unassigned_tasks.extend(self._remove_worker(worker))
 
 _task_queue = TaskQueue()
 
-# Manage subprocess
-_subprocess_manager = subprocessmanager.SubprocessManager(TaskMessage,
-        WorkerProcessResponder(), WorkerProcessHandler)
+# Manage subprocesses
+
+# most workers to run if the WORKER_PROCESS_COUNT pref isn't set.  Each one
+# is a full python process, so we don't want one for every core on big
+# machines.
+MAX_DEFAULT_WORKERS = 4
+
+def _calc_worker_count():
+    count = app.config.get(prefs.WORKER_PROCESS_COUNT)
+    if count <= 0:
+        try:
+            count = min(multiprocessing.cpu_count(), MAX_DEFAULT_WORKERS)
+        except NotImplementedError:
+            count = 1
+    return count
+
+class WorkerProcessPool(object):
+    """Manages our worker processes.
+
+    :attribute workers: SubprocessManager for each of our workers
+    """
+    def __init__(self, handler_class):
+        self.handler_class = handler_class
+        self.workers = []
+
+    def start(self):
+        if self.workers:
+            return
+        for i in xrange(_calc_worker_count()):
+            responder = WorkerProcessResponder()
+            worker = subprocessmanager.SubprocessManager(None, responder,
+                    self.handler_class)
+            responder.worker = worker
+            self.workers.append(worker)
+            worker.start()
+
+    def shutdown(self):
+        _task_queue.all_workers_stopped()
+        for worker in self.workers:
+            worker.shutdown()
+        self.workers = []
+
+_worker_pool = WorkerProcessPool(WorkerProcessHandler)
 
 def startup():
-    """Startup the worker process."""
-    _subprocess_manager.start()
+    """Startup the worker processes."""
+    _worker_pool.start()
 
 def shutdown():
-    """Shutdown the worker process."""
-    _subprocess_manager.shutdown()
+    """Shutdown the worker processes."""
+    _worker_pool.shutdown()
+    subprocessmanager.ipc_stats.log_stats()
 
 # API for sending tasks
 def run_feedparser(html, callback, errback):
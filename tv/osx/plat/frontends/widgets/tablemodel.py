@@ -257,12 +257,13 @@ class InfoListModel(infolist.InfoList, signals.SignalEmitter):
         self.emit('structure-will-change')
         infolist.InfoList.remove_ids(self, *args, **kwargs)
 
-    def update_infos(self, *args, **kwargs):
-        self.emit('structure-will-change')
+    def update_infos(self, infos, resort, redraw=True):
+        if resort or redraw:
+            self.emit('structure-will-change')
         # HACK: update_infos might only change rows, so we maybe we only need
         # to emit 'row-changed' here.  But most of the time we will re-sort
         # things so it seems simpler just to emit structure-will-change
-        infolist.InfoList.update_infos(self, *args, **kwargs)
+        infolist.InfoList.update_infos(self, infos, resort, redraw)
 
     def remove_all(self, *args, **kwargs):
         self.emit('structure-will-change')